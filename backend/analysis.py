@@ -1,6 +1,7 @@
 import logging
 
 import numpy as np
+import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from langchain_core.prompts import ChatPromptTemplate
@@ -12,8 +13,10 @@ logger = logging.getLogger(__name__)
 
 class AdvancedVisualizer:
 
-    def __init__(self, df, api_key):
+    def __init__(self, df, api_key, column_stats=None):
         self.df = df
+        # Per-column statistics precomputed by the sqlite-server, keyed by column name
+        self.column_stats = {column["column"]: column for column in column_stats or []}
         self.original_df = df.copy()
         self.metadata = None
         self.numeric_cols = self.df.select_dtypes(include=[np.number]).columns
@@ -47,7 +50,13 @@ class AdvancedVisualizer:
             insights["columns"] = list(self.df.columns)
 
             # 2. Missing values
-            missing_data = self.df.isnull().sum()
+            if self.column_stats:
+                missing_data = pd.Series({
+                    column: stats["null_count"] for column, stats in self.column_stats.items()
+                    if column in self.df.columns
+                })
+            else:
+                missing_data = self.df.isnull().sum()
             for column, count in missing_data[missing_data > 0].items():
                 insights["missing_values"][column] = {
                     "missing_count": int(count),  # Convert to int
@@ -57,6 +66,16 @@ class AdvancedVisualizer:
             # 3. Numeric column statistics
             numeric_cols = self.df.select_dtypes(include=[np.number]).columns
             for col in numeric_cols:
+                stats = self.column_stats.get(col)
+                if stats and stats["mean"] is not None and stats["quantiles"]:
+                    insights["numeric_column_statistics"][col] = {
+                        "mean": round(float(stats["mean"]), 2),
+                        "median": round(float(stats["quantiles"]["0.5"]), 2),
+                        "std_dev": round(float(stats["std"] or 0.0), 2),
+                        "min": round(float(stats["min"]), 2),
+                        "max": round(float(stats["max"]), 2)
+                    }
+                    continue
                 insights["numeric_column_statistics"][col] = {
                     "mean": round(float(self.df[col].mean()), 2),  # Convert to float
                     "median": round(float(self.df[col].median()), 2),  # Convert to float
@@ -68,6 +87,13 @@ class AdvancedVisualizer:
             # 4. Categorical column information
             cat_cols = self.df.select_dtypes(include=["object"]).columns
             for col in cat_cols:
+                stats = self.column_stats.get(col)
+                if stats:
+                    insights["categorical_column_information"][col] = {
+                        "unique_values": int(stats["distinct_count"]),
+                        "top_3_values": [value for value, _ in stats["top_values"][:3]]
+                    }
+                    continue
                 insights["categorical_column_information"][col] = {
                     "unique_values": int(self.df[col].nunique()),  # Convert to int
                     "top_3_values": self.df[col].value_counts().nlargest(3).index.tolist()
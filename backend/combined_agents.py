@@ -107,16 +107,16 @@ class CombinedAgent:
         return "\n".join([f"{tool.name}: {tool.description}" for tool in tools])
 
 
-    def invoke(self, request) -> Dict[str, Any]:
+    async def ainvoke(self, request) -> Dict[str, Any]:
         file_uuid = request.file_uuid
         query = request.query
-        router_response = self.router.invoke({"input":query})
+        router_response = await self.router.ainvoke({"input":query})
         print(f"Router response: {router_response}, and type: {type(router_response)}")
         if "CSV Agent" in router_response:
             if file_uuid is None:
                 raise ValueError("file_uuid is required for CSV Agent queries")
-            return self.csv_agent.invoke({"question": query, "file_uuid": file_uuid})
+            return await self.csv_agent.ainvoke({"question": query, "file_uuid": file_uuid})
         elif "Receptionist Agent" in router_response:
-            return self.receptionist_agent.invoke(query)
+            return await self.receptionist_agent.ainvoke(query)
         else:
             raise ValueError("Router couldn't determine the appropriate agent")
\ No newline at end of file
@@ -1,5 +1,6 @@
 import json
 from langchain_core.prompts import ChatPromptTemplate
+from backend.my_agent.DatabaseManager import describe_truncation
 from backend.my_agent.LLMManager import LLMManager
 from backend.my_agent.graph_instructions import graph_instructions
 
@@ -9,7 +10,7 @@ class DataFormatter:
         self.llm_manager = LLMManager(api_key=API_KEY)
 
     
-    def format_data_for_visualization(self, state: dict) -> dict:
+    async def format_data_for_visualization(self, state: dict) -> dict:
         """Format the data for the chosen visualization type."""
         visualization = state['visualization']
         results = state['results']
@@ -25,24 +26,24 @@ class DataFormatter:
             try:
                 return self._format_scatter_data(results)
             except Exception as e:
-                return self._format_other_visualizations(visualization, question, sql_query, results)
+                return await self._format_other_visualizations(visualization, question, sql_query, results)
         
         if visualization == "bar" or visualization == "horizontal_bar":
             try:
-                return self._format_bar_data(results, question)
+                return await self._format_bar_data(results, question)
             except Exception as e:
-                return self._format_other_visualizations(visualization, question, sql_query, results)
+                return await self._format_other_visualizations(visualization, question, sql_query, results)
         
         if visualization == "line":
             try:
-                return self._format_line_data(results, question)
+                return await self._format_line_data(results, question)
             except Exception as e:
-                return self._format_other_visualizations(visualization, question, sql_query, results)
+                return await self._format_other_visualizations(visualization, question, sql_query, results)
         
-        return self._format_other_visualizations(visualization, question, sql_query, results)
+        return await self._format_other_visualizations(visualization, question, sql_query, results)
 
 
-    def summarize_visualization(self, state: dict) -> dict:
+    async def summarize_visualization(self, state: dict) -> dict:
         """Summarize the produced visualization of the data."""
         results = state['results']
         question = state['question']
@@ -71,6 +72,8 @@ class DataFormatter:
         Visualization Data (JSON format):
         {{vis_data}}
 
+        {{truncation}}
+
         Please summarize this visualization, focusing on the key insights and trends, in a way that can be easily understood when read aloud."""
 
         prompt = ChatPromptTemplate.from_messages([
@@ -78,10 +81,11 @@ class DataFormatter:
             ("human", human_template),
         ])
 
-        response = self.llm_manager.invoke(prompt, vis_type=vis_type, vis_data=vis_data)
+        truncation = describe_truncation(results, state.get('truncated_reason'))
+        response = await self.llm_manager.ainvoke(prompt, vis_type=vis_type, vis_data=vis_data, truncation=truncation)
         return {"visualization_summary": response}
 
-    def _format_line_data(self, results, question):
+    async def _format_line_data(self, results, question):
         if isinstance(results, str):
             results = eval(results)
 
@@ -95,7 +99,7 @@ class DataFormatter:
                 ("system", "You are a data labeling expert. Given a question and some data, provide a concise and relevant label for the data series."),
                 ("human", "Question: {question}\n Data (first few rows): {data}\n\nProvide a concise label for this y axis. For example, if the data is the sales figures over time, the label could be 'Sales'. If the data is the population growth, the label could be 'Population'. If the data is the revenue trend, the label could be 'Revenue'."),
             ])
-            label = self.llm_manager.invoke(prompt, question=question, data=str(results[:2]))
+            label = await self.llm_manager.ainvoke(prompt, question=question, data=str(results[:2]))
 
             formatted_data = {
                 "xValues": x_values,
@@ -161,7 +165,7 @@ class DataFormatter:
                 ("system", "You are a data labeling expert. Given a question and some data, provide a concise and relevant label for the y-axis."),
                 ("human", "Question: {question}\n Data (first few rows): {data}\n\nProvide a concise label for the y-axis. For example, if the data represents sales figures over time for different categories, the label could be 'Sales'. If it's about population growth for different groups, it could be 'Population'."),
             ])
-            y_axis_label = self.llm_manager.invoke(prompt, question=question, data=str(results[:2]))
+            y_axis_label = await self.llm_manager.ainvoke(prompt, question=question, data=str(results[:2]))
 
             # Add the y-axis label to the formatted data
             formatted_data["yAxisLabel"] = y_axis_label.strip()
@@ -205,7 +209,7 @@ class DataFormatter:
         return {"formatted_data_for_visualization": formatted_data}
 
 
-    def _format_bar_data(self, results, question):
+    async def _format_bar_data(self, results, question):
         if isinstance(results, str):
             results = eval(results)
 
@@ -219,7 +223,7 @@ class DataFormatter:
                 ("system", "You are a data labeling expert. Given a question and some data, provide a concise and relevant label for the data series."),
                 ("human", "Question: {question}\nData (first few rows): {data}\n\nProvide a concise label for this y axis. For example, if the data is the sales figures for products, the label could be 'Sales'. If the data is the population of cities, the label could be 'Population'. If the data is the revenue by region, the label could be 'Revenue'."),
             ])
-            label = self.llm_manager.invoke(prompt, question=question, data=str(results[:2]))
+            label = await self.llm_manager.ainvoke(prompt, question=question, data=str(results[:2]))
             
             values = [{"data": data, "label": label}]
         elif len(results[0]) == 3:
@@ -241,13 +245,13 @@ class DataFormatter:
 
         return {"formatted_data_for_visualization": formatted_data}
 
-    def _format_other_visualizations(self, visualization, question, sql_query, results):
+    async def _format_other_visualizations(self, visualization, question, sql_query, results):
         instructions = graph_instructions[visualization]
         prompt = ChatPromptTemplate.from_messages([
             ("system", "You are a Data expert who formats data according to the required needs. You are given the question asked by the user, it's sql query, the result of the query and the format you need to format it in."),
             ("human", 'For the given question: {question}\n\nSQL query: {sql_query}\n\Result: {results}\n\nUse the following example to structure the data: {instructions}. Just give the json string. Do not format it'),
         ])
-        response = self.llm_manager.invoke(prompt, question=question, sql_query=sql_query, results=results, instructions=instructions, response_format={"type": "json_object"})
+        response = await self.llm_manager.ainvoke(prompt, question=question, sql_query=sql_query, results=results, instructions=instructions, response_format={"type": "json_object"})
             
         try:
             formatted_data_for_visualization = json.loads(response)
@@ -1,23 +1,177 @@
+import asyncio
+import json
+import logging
+import weakref
+import httpx
 import requests
 import os
-from typing import List, Any
+from typing import List, Any, Iterator
 from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Generated queries run under the agent's time budget on the sqlite-server; leave room for it
+DB_TIMEOUT_SECONDS = float(os.getenv("DB_TIMEOUT_SECONDS", "60"))
+DB_CONNECT_TIMEOUT_SECONDS = float(os.getenv("DB_CONNECT_TIMEOUT_SECONDS", "5"))
+# Retries of failed connections and of 502/503 answers (503 is an overloaded sqlite-server)
+DB_MAX_RETRIES = int(os.getenv("DB_MAX_RETRIES", "3"))
+DB_RETRY_BACKOFF_SECONDS = float(os.getenv("DB_RETRY_BACKOFF_SECONDS", "0.5"))
+# Keep-alive connections kept open to the sqlite-server
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+# Read schemas and run queries in-process through the sqlite-server's reader instead of
+# over HTTP, when both services run in the same container and share UPLOAD_DIR. Anything
+# that writes (project schemas, value dictionaries) still goes over HTTP
+DB_DIRECT_MODE = os.getenv("DB_DIRECT_MODE", "false").lower() in ("1", "true", "yes")
+
+# A 504 is a query that ran out of its time budget, and would again
+_RETRY_STATUSES = (502, 503)
+
+
+def describe_truncation(results: List[Any], truncated_reason: str) -> str:
+    """Line for prompts built from query results, saying whether they are complete."""
+    if not truncated_reason:
+        return "These are all the rows of the query."
+    cause = "the response size limit" if truncated_reason == "byte_limit" else "the row limit"
+    return (
+        f"Only the first {len(results)} rows were returned, the rest were cut off by {cause}. "
+        "Say that the answer is based on partial results."
+    )
+
+
+def _direct_db_path(uuid: str) -> str:
+    # Imported on first use, so the HTTP mode never loads the sqlite-server's reader
+    from backend.sqlite_server import reader
+    db_path = reader.db_path_for(uuid)
+    if not os.path.exists(db_path):
+        raise Exception("Database not found")
+    return db_path
+
+
+def _direct_schema(uuid: str) -> str:
+    from backend.sqlite_server import reader
+    return reader.read_schema(_direct_db_path(uuid))
+
+
+def _direct_query(file_uuid: str, query: str) -> dict:
+    from backend.sqlite_server import reader
+    return json.loads(reader.query_response(_direct_db_path(file_uuid), query, caller="agent"))
+
+
+def _direct_explain(file_uuid: str, query: str) -> dict:
+    from backend.sqlite_server.sql_validator import validate_query
+    return validate_query(_direct_db_path(file_uuid), query)
+
 
 class DatabaseManager:
-    def __init__(self, endpoint_url):
+    def __init__(self, endpoint_url, direct: bool = None):
         self.endpoint_url = endpoint_url #os.getenv("DB_ENDPOINT_URL")
+        self.direct = DB_DIRECT_MODE if direct is None else direct
+        self.timeout = (DB_CONNECT_TIMEOUT_SECONDS, DB_TIMEOUT_SECONDS)
+
+        # Keep-alive connections shared by all calls; every endpoint used here only reads,
+        # so POSTs are retried too
+        retry = Retry(
+            total=DB_MAX_RETRIES,
+            backoff_factor=DB_RETRY_BACKOFF_SECONDS,
+            status_forcelist=_RETRY_STATUSES,
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_maxsize=DB_POOL_SIZE, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # One pooled client per event loop, as a client cannot outlive the loop it was opened on
+        self._async_clients = weakref.WeakKeyDictionary()
+        # Reports of queries run in direct mode, referenced until they are sent
+        self._record_tasks = set()
+
+    def _async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                base_url=self.endpoint_url,
+                timeout=httpx.Timeout(DB_TIMEOUT_SECONDS, connect=DB_CONNECT_TIMEOUT_SECONDS),
+                # The transport retries failed connections, _arequest retries 502/503 answers
+                transport=httpx.AsyncHTTPTransport(
+                    retries=DB_MAX_RETRIES,
+                    limits=httpx.Limits(max_connections=DB_POOL_SIZE, max_keepalive_connections=DB_POOL_SIZE),
+                ),
+            )
+            self._async_clients[loop] = client
+        return client
+
+    async def _arequest(self, method: str, url: str, **kwargs) -> httpx.Response:
+        for attempt in range(DB_MAX_RETRIES + 1):
+            response = await self._async_client().request(method, url, **kwargs)
+            if response.status_code not in _RETRY_STATUSES or attempt == DB_MAX_RETRIES:
+                response.raise_for_status()
+                return response
+            retry_after = response.headers.get("Retry-After", "")
+            await asyncio.sleep(
+                float(retry_after) if retry_after.isdigit() else DB_RETRY_BACKOFF_SECONDS * 2 ** attempt
+            )
+
+    def _direct(self, error: str, function, *args):
+        try:
+            return function(*args)
+        except Exception as e:
+            raise Exception(f"{error}: {getattr(e, 'detail', e)}")
+
+    async def _adirect(self, error: str, function, *args):
+        try:
+            return await asyncio.to_thread(function, *args)
+        except Exception as e:
+            raise Exception(f"{error}: {getattr(e, 'detail', e)}")
+
+    def _record_query(self, file_uuid: str, query: str):
+        """
+        Report a query run in direct mode, so the sqlite-server's index advisor and
+        rollups see it like the queries it answered itself. Best effort.
+        """
+        try:
+            self.session.post(
+                f"{self.endpoint_url}/record-queries",
+                json={"file_uuid": file_uuid, "queries": [query]},
+                timeout=self.timeout
+            ).raise_for_status()
+        except requests.RequestException as e:
+            logger.warning(f"Failed to report a query of {file_uuid}: {e}")
+
+    async def _arecord_query(self, file_uuid: str, query: str):
+        try:
+            await self._arequest(
+                "POST", "/record-queries", json={"file_uuid": file_uuid, "queries": [query]}
+            )
+        except httpx.HTTPError as e:
+            logger.warning(f"Failed to report a query of {file_uuid}: {e}")
+
+    def close(self):
+        self.session.close()
+
+    async def aclose(self):
+        """Close the client of the running event loop."""
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
 
     def get_schema(self, uuid: str) -> str:
         """Retrieve the database schema."""
+        if self.direct:
+            return self._direct("Error fetching schema", _direct_schema, uuid)
         try:
-            response = requests.get(
-                f"{self.endpoint_url}/get-schema/{uuid}"
+            response = self.session.get(
+                f"{self.endpoint_url}/get-schema/{uuid}", timeout=self.timeout
             )
             response.raise_for_status()
             return response.json()['schema']
         except requests.RequestException as e:
             raise Exception(f"Error fetching schema: {str(e)}")
-        
+
     def get_schemas(self, uuids: List[str], project_uuid: str) -> str:
         """Retrieve the database schema."""
         try:
@@ -27,22 +181,126 @@ class DatabaseManager:
             query_string = urlencode(params)
 
             # Make the GET request
-            response = requests.get(
-                f"{self.endpoint_url}/get-schemas?{query_string}"
+            response = self.session.get(
+                f"{self.endpoint_url}/get-schemas?{query_string}", timeout=self.timeout
             )
             response.raise_for_status()
             return response.json()['schema']
         except requests.RequestException as e:
             raise Exception(f"Error fetching schema: {str(e)}")
 
-    def execute_query(self, file_uuid: str, query: str) -> List[Any]:
-        """Execute SQL query on the remote database and return results."""
+    def execute_query(self, file_uuid: str, query: str) -> dict:
+        """
+        Execute SQL query on the remote database and return the first page of results:
+        `results`, plus `truncated` and `truncated_reason` when the agent's row or byte
+        budget cut them off.
+        """
+        if self.direct:
+            page = self._direct("Error executing query", _direct_query, file_uuid, query)
+            self._record_query(file_uuid, query)
+            return page
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.endpoint_url}/execute-query",
-                json={"file_uuid": file_uuid, "query": query}
+                json={"file_uuid": file_uuid, "query": query, "caller": "agent"},
+                timeout=self.timeout
             )
             response.raise_for_status()
-            return response.json()['results']
+            return response.json()
         except requests.RequestException as e:
-            raise Exception(f"Error executing query: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Error executing query: {str(e)}")
+
+    async def aget_schema(self, uuid: str) -> str:
+        """Retrieve the database schema without blocking the event loop."""
+        if self.direct:
+            return await self._adirect("Error fetching schema", _direct_schema, uuid)
+        try:
+            response = await self._arequest("GET", f"/get-schema/{uuid}")
+            return response.json()['schema']
+        except httpx.HTTPError as e:
+            raise Exception(f"Error fetching schema: {str(e)}")
+
+    async def aget_schemas(self, uuids: List[str], project_uuid: str) -> str:
+        """Retrieve the schema of several files without blocking the event loop."""
+        try:
+            params = [('file_uuids', uuid) for uuid in uuids]
+            params.append(('project_uuid', project_uuid))
+            response = await self._arequest("GET", "/get-schemas", params=params)
+            return response.json()['schema']
+        except httpx.HTTPError as e:
+            raise Exception(f"Error fetching schema: {str(e)}")
+
+    async def aexecute_query(self, file_uuid: str, query: str) -> dict:
+        """Execute SQL query on the remote database without blocking the event loop, see execute_query."""
+        if self.direct:
+            page = await self._adirect("Error executing query", _direct_query, file_uuid, query)
+            # Reported in the background, the answer doesn't wait for it
+            task = asyncio.create_task(self._arecord_query(file_uuid, query))
+            self._record_tasks.add(task)
+            task.add_done_callback(self._record_tasks.discard)
+            return page
+        try:
+            response = await self._arequest(
+                "POST",
+                "/execute-query",
+                json={"file_uuid": file_uuid, "query": query, "caller": "agent"}
+            )
+            return response.json()
+        except httpx.HTTPError as e:
+            raise Exception(f"Error executing query: {str(e)}")
+
+    async def aexplain_query(self, file_uuid: str, query: str) -> dict:
+        """Check a query against the remote database without running it."""
+        if self.direct:
+            return await self._adirect("Error validating query", _direct_explain, file_uuid, query)
+        try:
+            response = await self._arequest(
+                "POST",
+                "/explain-query",
+                json={"file_uuid": file_uuid, "query": query}
+            )
+            return response.json()
+        except httpx.HTTPError as e:
+            raise Exception(f"Error validating query: {str(e)}")
+
+    async def amatch_values(self, file_uuid: str, question: str, columns: dict, limit: int = 20) -> List[dict]:
+        """Values of the given {table: [column]} that fuzzily match the words of a question."""
+        try:
+            response = await self._arequest(
+                "POST",
+                "/match-values",
+                json={"file_uuid": file_uuid, "question": question, "columns": columns, "limit": limit}
+            )
+            return response.json()['values']
+        except httpx.HTTPError as e:
+            raise Exception(f"Error matching values: {str(e)}")
+
+    def iter_query(self, file_uuid: str, query: str, page_size: int = None) -> Iterator[List[Any]]:
+        """
+        Stream the rows of a query as they arrive, following continuation cursors.
+        Streams always go over HTTP, also in direct mode.
+        """
+        cursor = None
+        while True:
+            try:
+                with self.session.post(
+                    f"{self.endpoint_url}/execute-query",
+                    json={"file_uuid": file_uuid, "query": query, "stream": True,
+                          "page_size": page_size, "cursor": cursor, "caller": "agent"},
+                    stream=True,
+                    timeout=self.timeout
+                ) as response:
+                    response.raise_for_status()
+                    cursor = None
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        item = json.loads(line)
+                        if isinstance(item, dict):
+                            cursor = item.get("next_cursor")
+                        else:
+                            yield item
+            except requests.RequestException as e:
+                raise Exception(f"Error executing query: {str(e)}")
+            if cursor is None:
+                return
@@ -0,0 +1,239 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+from langchain_core.messages import BaseMessage
+
+logger = logging.getLogger(__name__)
+
+# Responses are kept in a SQLite file that every uvicorn worker of the ai-server opens
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join("uploads", "_llm_cache.sqlite"))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Hits only update last_used times and metrics in memory; they are written this often
+LLM_CACHE_FLUSH_SECONDS = float(os.getenv("LLM_CACHE_FLUSH_SECONDS", "5"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    latency REAL NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used);
+CREATE INDEX IF NOT EXISTS responses_created_at ON responses(created_at);
+CREATE TABLE IF NOT EXISTS metrics (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+-- Running total of the response sizes, so eviction never sums the whole table
+INSERT OR IGNORE INTO metrics (name, value) SELECT 'bytes', COALESCE(SUM(size), 0) FROM responses;
+CREATE TRIGGER IF NOT EXISTS responses_bytes_insert AFTER INSERT ON responses BEGIN
+    UPDATE metrics SET value = value + NEW.size WHERE name = 'bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS responses_bytes_update AFTER UPDATE OF size ON responses BEGIN
+    UPDATE metrics SET value = value + NEW.size - OLD.size WHERE name = 'bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS responses_bytes_delete AFTER DELETE ON responses BEGIN
+    UPDATE metrics SET value = value - OLD.size WHERE name = 'bytes';
+END;
+"""
+
+
+def cache_key(model: str, temperature: float, messages: List[BaseMessage]) -> str:
+    """sha256 of the model, its temperature and the formatted messages."""
+    payload = json.dumps(
+        {
+            "model": model,
+            "temperature": temperature,
+            "messages": [[message.type, message.content] for message in messages],
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache(ABC):
+    """
+    Interface of the response caches LLMManager accepts. `get` returns the cached
+    response text or None, `set` stores a response together with the latency of
+    the call that produced it.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, response: str, latency: float):
+        ...
+
+    @abstractmethod
+    def stats(self) -> dict:
+        ...
+
+
+class SQLiteLLMCache(LLMCache):
+    """
+    LLM responses in a SQLite database in WAL mode, so the workers of the ai-server
+    share entries and metrics. Entries expire after `ttl_seconds`, and the least
+    recently used ones are evicted once the responses exceed `max_bytes`. A hit
+    adds the latency of the original call to the saved seconds. Lookups don't
+    write: their last_used times and metrics are batched in memory and flushed
+    every `flush_seconds`, and before a response is stored.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl_seconds: int = LLM_CACHE_TTL_SECONDS,
+                 max_bytes: int = LLM_CACHE_MAX_BYTES, flush_seconds: float = LLM_CACHE_FLUSH_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.flush_seconds = flush_seconds
+        self._local = threading.local()
+        self._pending_lock = threading.Lock()
+        self._pending_used = {}
+        self._pending_counts = {}
+        self._flushed_at = time.monotonic()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; writers of other workers are waited for
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, conn: sqlite3.Connection, **increments):
+        conn.executemany(
+            "INSERT INTO metrics (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            increments.items(),
+        )
+
+    def _count_later(self, key: str = None, now: float = None, **increments):
+        with self._pending_lock:
+            if key is not None:
+                self._pending_used[key] = now
+            for name, value in increments.items():
+                self._pending_counts[name] = self._pending_counts.get(name, 0) + value
+            due = time.monotonic() - self._flushed_at >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write the batched last_used times and metrics of lookups."""
+        with self._pending_lock:
+            used, counts = self._pending_used, self._pending_counts
+            self._pending_used, self._pending_counts = {}, {}
+            self._flushed_at = time.monotonic()
+        if not used and not counts:
+            return
+        conn = self._connect()
+        with conn:
+            # Other workers may have used the entry more recently
+            conn.executemany(
+                "UPDATE responses SET last_used = ? WHERE key = ? AND last_used < ?",
+                [(used_at, key, used_at) for key, used_at in used.items()],
+            )
+            self._count(conn, **counts)
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        row = self._connect().execute(
+            "SELECT response, latency FROM responses WHERE key = ? AND created_at > ?",
+            (key, now - self.ttl_seconds),
+        ).fetchone()
+        if row is None:
+            self._count_later(misses=1)
+            return None
+        self._count_later(key, now, hits=1, saved_seconds=row[1])
+        return row[0]
+
+    def set(self, key: str, response: str, latency: float):
+        # Eviction goes by last_used, so the batched times are written first
+        self.flush()
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT INTO responses (key, response, size, latency, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET response = excluded.response, size = excluded.size, "
+                "latency = excluded.latency, created_at = excluded.created_at, last_used = excluded.last_used",
+                (key, response, size, latency, now, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        expired = conn.execute(
+            "DELETE FROM responses WHERE created_at <= ?", (now - self.ttl_seconds,)
+        ).rowcount
+        total = conn.execute("SELECT value FROM metrics WHERE name = 'bytes'").fetchone()[0]
+        evicted = 0
+        if total > self.max_bytes:
+            # Drop the least recently used responses until back under the limit
+            for key, size in conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_used"
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+        if expired or evicted:
+            self._count(conn, expirations=expired, evictions=evicted)
+
+    def stats(self) -> dict:
+        self.flush()
+        conn = self._connect()
+        metrics = dict(conn.execute("SELECT name, value FROM metrics").fetchall())
+        entries = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        hits = int(metrics.get("hits", 0))
+        misses = int(metrics.get("misses", 0))
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "expirations": int(metrics.get("expirations", 0)),
+            "evictions": int(metrics.get("evictions", 0)),
+            "saved_seconds": round(metrics.get("saved_seconds", 0.0), 3),
+            "entries": entries,
+            "bytes": int(metrics.get("bytes", 0)),
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def default_cache() -> Optional[LLMCache]:
+    """The cache shared by every LLMManager of the process, or None when LLM_CACHE_ENABLED is off."""
+    global _default_cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = SQLiteLLMCache()
+            # Lookups batched since the last flush
+            atexit.register(_default_cache.flush)
+        return _default_cache
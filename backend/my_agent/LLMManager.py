@@ -1,9 +1,16 @@
+import asyncio
+import logging
+import sqlite3
+import time
 from langchain_core.prompts import ChatPromptTemplate
+from backend.my_agent.LLMCache import LLMCache, cache_key, default_cache
 # from langchain_openai import ChatOpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAI
 
+logger = logging.getLogger(__name__)
+
 class LLMManager:
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache: LLMCache = None):
         model_name = "gemini-1.5-pro" #gemini-1.0-pro #"gemini-1.5-flash"
         temperature = 0.0
         verbose = True
@@ -13,8 +20,54 @@ class LLMManager:
                                 google_api_key=api_key, 
                                 temperature=temperature, 
                                 verbose=verbose)
+        # Responses are reused for byte-identical prompts to the same model and temperature
+        self.model_name = model_name
+        self.temperature = temperature
+        self.cache = cache if cache is not None else default_cache()
+
+    def _key(self, messages) -> str:
+        return cache_key(self.model_name, self.temperature, messages)
+
+    def _cache_get(self, key: str):
+        try:
+            return self.cache.get(key)
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache lookup failed: {e}")
+            return None
+
+    def _cache_set(self, key: str, response: str, latency: float):
+        try:
+            self.cache.set(key, response, latency)
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache write failed: {e}")
 
     def invoke(self, prompt: ChatPromptTemplate, **kwargs) -> str:
         messages = prompt.format_messages(**kwargs)
-        response = self.llm.invoke(messages)
-        return response.content
\ No newline at end of file
+        if self.cache is None:
+            return self.llm.invoke(messages).content
+
+        key = self._key(messages)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        started = time.perf_counter()
+        response = self.llm.invoke(messages).content
+        if isinstance(response, str):
+            self._cache_set(key, response, time.perf_counter() - started)
+        return response
+
+    async def ainvoke(self, prompt: ChatPromptTemplate, **kwargs) -> str:
+        messages = prompt.format_messages(**kwargs)
+        if self.cache is None:
+            return (await self.llm.ainvoke(messages)).content
+
+        # The cache may wait on writers of other workers, so it is used off the event loop
+        key = self._key(messages)
+        cached = await asyncio.to_thread(self._cache_get, key)
+        if cached is not None:
+            return cached
+        started = time.perf_counter()
+        response = (await self.llm.ainvoke(messages)).content
+        if isinstance(response, str):
+            await asyncio.to_thread(self._cache_set, key, response, time.perf_counter() - started)
+        return response
@@ -1,7 +1,7 @@
 import uuid
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
-from backend.my_agent.DatabaseManager import DatabaseManager
+from backend.my_agent.DatabaseManager import DatabaseManager, describe_truncation
 from backend.my_agent.LLMManager import LLMManager
 
 class SQLAgent:
@@ -9,10 +9,10 @@ class SQLAgent:
         self.db_manager = DatabaseManager(endpoint_url=ENDPOINT_URL)
         self.llm_manager = LLMManager(api_key=API_KEY)
 
-    def parse_question(self, state: dict) -> dict:
+    async def parse_question(self, state: dict) -> dict:
         """Parse user question and identify relevant tables and columns."""
         question = state['question']
-        schema = self.db_manager.get_schemas(uuids=state['file_uuids'], project_uuid=state['project_uuid'])
+        schema = await self.db_manager.aget_schemas(uuids=state['file_uuids'], project_uuid=state['project_uuid'])
 
 #         prompt = ChatPromptTemplate.from_messages([
 #             ("system", '''You are a data analyst that can help summarize SQL tables and parse user questions about a database. 
@@ -63,31 +63,30 @@ class SQLAgent:
 
         output_parser = JsonOutputParser()
         
-        response = self.llm_manager.invoke(prompt, schema=schema, question=question, response_format={"type": "json_object"})
+        response = await self.llm_manager.ainvoke(prompt, schema=schema, question=question, response_format={"type": "json_object"})
         parsed_response = output_parser.parse(response)
         return {"parsed_question": parsed_response}
 
-    def get_unique_nouns(self, state: dict) -> dict:
-        """Find unique nouns in relevant tables and columns."""
+    async def get_unique_nouns(self, state: dict) -> dict:
+        """Find the values of the relevant noun columns that the question refers to."""
         parsed_question = state['parsed_question']
         if not parsed_question['is_relevant']:
             return {"unique_nouns": []}
 
-        unique_nouns = set()
-        for table_info in parsed_question['relevant_tables']:
-            table_name = table_info['table_name']
-            noun_columns = table_info['noun_columns']
-            
-            if noun_columns:
-                column_names = ', '.join(f"`{col}`" for col in noun_columns)
-                query = f"SELECT DISTINCT {column_names} FROM `{table_name}`"
-                results = self.db_manager.execute_query(state['project_uuid'], query)
-                for row in results:
-                    unique_nouns.update(str(value) for value in row if value)
-
-        return {"unique_nouns": list(unique_nouns)}
-
-    def generate_sql(self, state: dict) -> dict:
+        columns = {
+            table_info['table_name']: table_info['noun_columns']
+            for table_info in parsed_question['relevant_tables']
+            if table_info['noun_columns']
+        }
+        if not columns:
+            return {"unique_nouns": []}
+
+        # Only values matching words of the question are fetched from the value dictionary,
+        # so the prompt stays small however many distinct values the columns hold
+        matches = await self.db_manager.amatch_values(state['project_uuid'], state['question'], columns)
+        return {"unique_nouns": list(dict.fromkeys(match['value'] for match in matches))}
+
+    async def generate_sql(self, state: dict) -> dict:
         """Generate SQL query based on parsed question and unique nouns."""
         question = state['question']
         parsed_question = state['parsed_question']
@@ -96,7 +95,7 @@ class SQLAgent:
         if not parsed_question['is_relevant']:
             return {"sql_query": "NOT_RELEVANT", "is_relevant": False}
     
-        schema = self.db_manager.get_schema(state['project_uuid'])
+        schema = await self.db_manager.aget_schema(state['project_uuid'])
 
         prompt = ChatPromptTemplate.from_messages([
             ("system", '''
@@ -142,21 +141,29 @@ Just give the query string. Do not format it. Make sure to use the correct spell
 Generate SQL query string'''),
         ])
 
-        response = self.llm_manager.invoke(prompt, schema=schema, question=question, parsed_question=parsed_question, unique_nouns=unique_nouns)
+        response = await self.llm_manager.ainvoke(prompt, schema=schema, question=question, parsed_question=parsed_question, unique_nouns=unique_nouns)
         
         if response.strip() == "NOT_ENOUGH_INFO":
             return {"sql_query": "NOT_RELEVANT"}
         else:
             return {"sql_query": response}
 
-    def validate_and_fix_sql(self, state: dict) -> dict:
+    async def validate_and_fix_sql(self, state: dict) -> dict:
         """Validate and fix the generated SQL query."""
         sql_query = state['sql_query']
 
         if sql_query == "NOT_RELEVANT":
             return {"sql_query": "NOT_RELEVANT", "sql_valid": False}
-        
-        schema = self.db_manager.get_schema(state['project_uuid'])
+
+        # The database compiles the query first; the LLM is only asked to fix real problems
+        check = await self.db_manager.aexplain_query(state['project_uuid'], sql_query)
+        if check["valid"]:
+            return {"sql_query": check["query"], "sql_valid": True}
+        issues = check["issues"]
+        if check["suggestions"]:
+            issues += f" (closest existing names: {', '.join(check['suggestions'])})"
+
+        schema = await self.db_manager.aget_schema(state['project_uuid'])
 
         prompt = ChatPromptTemplate.from_messages([
             ("system", '''
@@ -179,6 +186,9 @@ Respond in JSON format with the following structure. Only respond with the JSON:
 ===Generated SQL query:
 {sql_query}
 
+===Error reported by the database:
+{issues}
+
 Respond in JSON format with the following structure. Only respond with the JSON:
 {{
     "valid": boolean,
@@ -209,19 +219,23 @@ For example:
         ])
 
         output_parser = JsonOutputParser()
-        response = self.llm_manager.invoke(prompt, schema=schema, sql_query=sql_query, response_format={"type": "json_object"})
+        response = await self.llm_manager.ainvoke(prompt, schema=schema, sql_query=check["query"], issues=issues, response_format={"type": "json_object"})
         result = output_parser.parse(response)
 
         if result["valid"] and result["issues"] is None:
-            return {"sql_query": sql_query, "sql_valid": True}
+            corrected_query = check["query"]
         else:
-            return {
-                "sql_query": result["corrected_query"],
-                "sql_valid": result["valid"],
-                "sql_issues": result["issues"]
-            }
+            corrected_query = result["corrected_query"]
 
-    def execute_sql(self, state: dict) -> dict:
+        # Judge the fix by the database as well, not by the LLM's own verdict
+        recheck = await self.db_manager.aexplain_query(state['project_uuid'], corrected_query)
+        return {
+            "sql_query": recheck["query"],
+            "sql_valid": recheck["valid"],
+            "sql_issues": recheck["issues"] or issues
+        }
+
+    async def execute_sql(self, state: dict) -> dict:
         """Execute SQL query and return results."""
         query = state['sql_query']
         file_uuid = state['project_uuid']
@@ -229,12 +243,16 @@ For example:
             return {"results": "NOT_RELEVANT"}
 
         try:
-            results = self.db_manager.execute_query(file_uuid, query)
-            return {"results": results}
+            page = await self.db_manager.aexecute_query(file_uuid, query)
+            return {
+                "results": page["results"],
+                # The agent's budget caps the rows it gets back; the answer must not pass them off as all of them
+                "truncated_reason": page["truncated_reason"] if page["truncated"] else None,
+            }
         except Exception as e:
             return {"error": str(e)}
 
-    def format_results(self, state: dict) -> dict:
+    async def format_results(self, state: dict) -> dict:
         """Format query results into a human-readable response."""
         question = state['question']
         results = state['results']
@@ -244,13 +262,14 @@ For example:
 
         prompt = ChatPromptTemplate.from_messages([
             ("system", "You are an AI assistant that formats database query results into a human-readable response. Give a conclusion to the user's question based on the query results. Do not give the answer in markdown format. Only give the answer in one line."),
-            ("human", "User question: {question}\n\nQuery results: {results}\n\nFormatted response:"),
+            ("human", "User question: {question}\n\nQuery results: {results}\n\n{truncation}\n\nFormatted response:"),
         ])
 
-        response = self.llm_manager.invoke(prompt, question=question, results=results)
+        truncation = describe_truncation(results, state.get('truncated_reason'))
+        response = await self.llm_manager.ainvoke(prompt, question=question, results=results, truncation=truncation)
         return {"answer": response}
 
-    def choose_visualization(self, state: dict) -> dict:
+    async def choose_visualization(self, state: dict) -> dict:
         """Choose an appropriate visualization for the data."""
         question = state['question']
         results = state['results']
@@ -290,7 +309,7 @@ Query results: {results}
 Recommend a visualization:'''),
         ])
 
-        response = self.llm_manager.invoke(prompt, question=question, sql_query=sql_query, results=results)
+        response = await self.llm_manager.ainvoke(prompt, question=question, sql_query=sql_query, results=results)
         
         lines = response.split('\n')
         visualization = lines[0].split(': ')[1]
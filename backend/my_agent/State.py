@@ -21,6 +21,7 @@ class OutputState(TypedDict):
     sql_valid: bool
     sql_issues: str
     results: List[Any]
+    truncated_reason: str
     answer: Annotated[str, operator.add]
     error: str
     visualization: Annotated[str, operator.add]
@@ -44,10 +44,11 @@ class WorkflowManager:
     def returnGraph(self):
         return self.create_workflow().compile()
 
-    def run_sql_agent(self, question: str, file_uuids: List[str], project_uuid: str) -> dict:
+    async def run_sql_agent(self, question: str, file_uuids: List[str], project_uuid: str) -> dict:
         """Run the SQL agent workflow and return the formatted answer and visualization recommendation."""
         app = self.create_workflow().compile()
-        result = app.invoke({"question": question, "file_uuids": file_uuids, "project_uuid": project_uuid})
+        # The nodes are coroutines, so the graph is awaited on the caller's event loop
+        result = await app.ainvoke({"question": question, "file_uuids": file_uuids, "project_uuid": project_uuid})
         return {
             "answer": result['answer'],
             "visualization": result['visualization'],
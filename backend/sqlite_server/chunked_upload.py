@@ -0,0 +1,325 @@
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+from backend.sqlite_server import storage
+from backend.sqlite_server.ingest import stream_csv_to_sqlite
+
+logger = logging.getLogger(__name__)
+
+# Partially received uploads, resumable until they expire
+UPLOAD_SESSION_DIR = os.path.join(storage.UPLOAD_DIR, "_sessions")
+UPLOAD_SESSION_TTL_SECONDS = int(os.getenv("UPLOAD_SESSION_TTL_SECONDS", "86400"))
+# Largest chunk accepted by a single PUT
+UPLOAD_MAX_CHUNK_BYTES = int(os.getenv("UPLOAD_MAX_CHUNK_BYTES", str(64 * 1024 * 1024)))
+# CSV uploads converted while their chunks are still arriving
+UPLOAD_PIPELINE_THREADS = int(os.getenv("UPLOAD_PIPELINE_THREADS", "4"))
+# A pipeline waiting this long for the next chunk gives its thread back; the upload is
+# converted from its part file on completion, or by a new pipeline once chunks arrive again
+UPLOAD_PIPELINE_IDLE_SECONDS = int(os.getenv("UPLOAD_PIPELINE_IDLE_SECONDS", "300"))
+
+os.makedirs(UPLOAD_SESSION_DIR, exist_ok=True)
+
+_UPLOAD_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class UploadCancelled(Exception):
+    pass
+
+
+class UploadStalled(Exception):
+    pass
+
+
+class UploadSession:
+    """
+    State of one chunked upload. The received bytes are appended to `{upload_id}.part`,
+    so the offset survives restarts; `{upload_id}.json` keeps the upload's parameters.
+    """
+
+    def __init__(self, upload_id: str, meta: dict):
+        self.upload_id = upload_id
+        self.meta = meta
+        self.file_extension = os.path.splitext(meta["filename"])[1].lower()
+        self.part_path = os.path.join(UPLOAD_SESSION_DIR, f"{upload_id}.part")
+        self.meta_path = os.path.join(UPLOAD_SESSION_DIR, f"{upload_id}.json")
+        self.pipeline_path = os.path.join(UPLOAD_SESSION_DIR, f"{upload_id}.sqlite")
+        self.offset = os.path.getsize(self.part_path) if os.path.exists(self.part_path) else 0
+        self.write_lock = threading.Lock()  # serializes chunk writes and completion
+        self.condition = threading.Condition()  # signals new bytes to the pipeline
+        self.finished = False
+        self.cancelled = False
+        self.digest = None
+        self.pipeline = None
+
+    def save_meta(self):
+        with open(self.meta_path, "w") as file:
+            json.dump(self.meta, file)
+
+    def status(self) -> dict:
+        status = {
+            "upload_id": self.upload_id,
+            "filename": self.meta["filename"],
+            "offset": self.offset,
+            "total_size": self.meta.get("total_size"),
+            "complete": "result" in self.meta,
+        }
+        if "result" in self.meta:
+            status.update(self.meta["result"])
+        return status
+
+    def cancel(self):
+        with self.condition:
+            self.cancelled = True
+            self.condition.notify_all()
+
+
+class _GrowingFile(io.RawIOBase):
+    """
+    Reader over the part file of an upload that is still being received: reads block
+    until more bytes arrive and hit end-of-file only once the upload is complete. A read
+    waiting longer than UPLOAD_PIPELINE_IDLE_SECONDS raises UploadStalled.
+    """
+
+    def __init__(self, session: UploadSession):
+        self.session = session
+        self._file = open(session.part_path, "rb")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        session = self.session
+        deadline = time.monotonic() + UPLOAD_PIPELINE_IDLE_SECONDS
+        with session.condition:
+            while not session.cancelled and not session.finished and session.offset <= self._file.tell():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise UploadStalled(f"Upload {session.upload_id} received no chunk in time")
+                session.condition.wait(remaining)
+            if session.cancelled:
+                raise UploadCancelled(f"Upload {session.upload_id} was cancelled")
+            available = session.offset - self._file.tell()
+        if available <= 0:
+            return 0
+        return self._file.readinto(memoryview(buffer)[:available])
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def _run_pipeline(session: UploadSession) -> dict:
+    # A stalled pipeline may have left a partial database behind
+    storage.remove_database(session.pipeline_path)
+    with io.BufferedReader(_GrowingFile(session), buffer_size=1024 * 1024) as source:
+        return stream_csv_to_sqlite(source, session.pipeline_path)
+
+
+def _stalled(pipeline) -> bool:
+    return pipeline.done() and not pipeline.cancelled() and isinstance(pipeline.exception(), UploadStalled)
+
+
+class ChunkedUploads:
+    """
+    Resumable uploads sent as chunks at explicit offsets. CSV uploads are parsed and
+    inserted by a pipeline thread while later chunks are still being received, and
+    the content hash is updated chunk by chunk, so completing an upload only waits
+    for the tail of the conversion.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=UPLOAD_PIPELINE_THREADS, thread_name_prefix="upload-pipeline"
+        )
+
+    def _session(self, upload_id: str) -> UploadSession:
+        if not _UPLOAD_ID.fullmatch(upload_id):
+            raise HTTPException(status_code=404, detail="Upload not found")
+        with self._lock:
+            session = self._sessions.get(upload_id)
+            if session is not None:
+                return session
+            # Sessions of a previous server process resume from their part file
+            meta_path = os.path.join(UPLOAD_SESSION_DIR, f"{upload_id}.json")
+            if not os.path.exists(meta_path):
+                raise HTTPException(status_code=404, detail="Upload not found")
+            with open(meta_path) as file:
+                session = UploadSession(upload_id, json.load(file))
+            if "result" not in session.meta:
+                self._sessions[upload_id] = session
+            return session
+
+    def _start_pipeline(self, session: UploadSession):
+        """
+        Start converting a CSV upload on its first chunk, and again once chunks arrive
+        after its pipeline stalled. Sessions that never send a chunk hold no thread.
+        """
+        if session.file_extension != ".csv":
+            return
+        if session.pipeline is None or _stalled(session.pipeline):
+            session.pipeline = self._executor.submit(_run_pipeline, session)
+
+    def _ensure_digest(self, session: UploadSession):
+        if session.digest is not None:
+            return
+        session.digest = storage.content_digest(session.file_extension)
+        with open(session.part_path, "rb") as file:
+            for chunk in iter(lambda: file.read(storage.HASH_CHUNK_SIZE), b""):
+                session.digest.update(chunk)
+
+    def _expire_sessions(self):
+        deadline = time.time() - UPLOAD_SESSION_TTL_SECONDS
+        for name in os.listdir(UPLOAD_SESSION_DIR):
+            upload_id, extension = os.path.splitext(name)
+            path = os.path.join(UPLOAD_SESSION_DIR, name)
+            if extension != ".json" or os.path.getmtime(path) >= deadline:
+                continue
+            with self._lock:
+                session = self._sessions.pop(upload_id, None)
+            if session is not None:
+                session.cancel()
+            for suffix in (".part", ".json"):
+                stale_path = os.path.join(UPLOAD_SESSION_DIR, upload_id + suffix)
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+            storage.remove_database(os.path.join(UPLOAD_SESSION_DIR, f"{upload_id}.sqlite"))
+
+    def init(self, filename: str, total_size: int = None, project_uuid: str = None, user_uuid: str = None) -> dict:
+        storage.check_upload_extension(filename)
+        self._expire_sessions()
+        upload_id = uuid.uuid4().hex
+        session = UploadSession(
+            upload_id,
+            {
+                "filename": filename,
+                "total_size": total_size,
+                "project_uuid": project_uuid,
+                "user_uuid": user_uuid,
+                "created_at": time.time(),
+            },
+        )
+        open(session.part_path, "wb").close()
+        session.save_meta()
+        session.digest = storage.content_digest(session.file_extension)
+        with self._lock:
+            self._sessions[upload_id] = session
+        return session.status()
+
+    def status(self, upload_id: str) -> dict:
+        return self._session(upload_id).status()
+
+    def write_chunk(self, upload_id: str, offset: int, data: bytes) -> dict:
+        """Append a chunk; it must start exactly where the received bytes end."""
+        session = self._session(upload_id)
+        with session.write_lock:
+            if session.finished or "result" in session.meta:
+                raise HTTPException(status_code=409, detail="Upload is already complete")
+            if offset != session.offset:
+                raise HTTPException(
+                    status_code=409,
+                    detail={"message": "Chunk does not start at the received offset", "offset": session.offset},
+                )
+            total_size = session.meta.get("total_size")
+            if total_size is not None and offset + len(data) > total_size:
+                raise HTTPException(status_code=400, detail="Chunk exceeds the declared upload size")
+
+            self._ensure_digest(session)
+            with open(session.part_path, "ab") as file:
+                file.write(data)
+            session.digest.update(data)
+            # Sessions expire by the age of their meta file, counted from the last chunk
+            os.utime(session.meta_path)
+            with session.condition:
+                session.offset += len(data)
+                session.condition.notify_all()
+            self._start_pipeline(session)
+        return session.status()
+
+    def complete(self, upload_id: str) -> dict:
+        """
+        Finish an upload and store it like a regular one. Completing again returns
+        the stored result, so clients can retry after losing the response.
+        """
+        session = self._session(upload_id)
+        with session.write_lock:
+            if "result" in session.meta:
+                return session.meta["result"]
+            total_size = session.meta.get("total_size")
+            if total_size is not None and session.offset != total_size:
+                raise HTTPException(
+                    status_code=400,
+                    detail={"message": "Upload is incomplete", "offset": session.offset},
+                )
+
+            self._ensure_digest(session)
+            with session.condition:
+                session.finished = True
+                session.condition.notify_all()
+
+            file_uuid = str(uuid.uuid4())
+            try:
+                _, ingest_stats = storage.store_upload(
+                    session.digest.hexdigest(),
+                    lambda sqlite_path: self._convert(session, file_uuid, sqlite_path),
+                    session.meta["filename"],
+                    file_uuid,
+                    session.meta.get("project_uuid"),
+                    session.meta.get("user_uuid"),
+                )
+            finally:
+                # Duplicates leave the pipeline's database unused
+                if session.pipeline is not None:
+                    session.cancel()
+                    session.pipeline.add_done_callback(
+                        lambda _: storage.remove_database(session.pipeline_path)
+                    )
+
+            result = {"file_uuid": file_uuid}
+            if ingest_stats:
+                result["ingest"] = ingest_stats
+            session.meta["result"] = result
+            session.save_meta()
+            os.remove(session.part_path)
+            with self._lock:
+                self._sessions.pop(upload_id, None)
+        logger.info(f"Completed chunked upload {upload_id} as {file_uuid}")
+        return result
+
+    def _convert(self, session: UploadSession, file_uuid: str, sqlite_path: str):
+        pipeline = session.pipeline
+        # A pipeline still queued behind other uploads is cancelled rather than waited for
+        if pipeline is not None and not pipeline.cancel():
+            # The pipeline has been converting the CSV while it was received
+            try:
+                ingest_stats = pipeline.result()
+            except UploadStalled:
+                pass
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Error converting CSV to SQLite: {str(e)}")
+            else:
+                os.replace(session.pipeline_path, sqlite_path)
+                return ingest_stats
+
+        with open(session.part_path, "rb") as source:
+            return storage.convert_upload(source, session.file_extension, file_uuid, sqlite_path)
+
+    def shutdown(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            session.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+uploads = ChunkedUploads()
@@ -0,0 +1,303 @@
+import json
+import logging
+import math
+import sqlite3
+import time
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+from backend.sqlite_server.connection_pool import pool
+from backend.sqlite_server.ingest import quote_identifier
+
+logger = logging.getLogger(__name__)
+
+COLUMN_STATS_TABLE = "_column_stats"
+# Rows read from SQLite per batch while computing statistics
+STATS_BATCH_SIZE = 65536
+# Values kept by the top-k sketch and reported per column
+TOP_K_CAPACITY = 64
+TOP_K_REPORTED = 10
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+
+class HyperLogLog:
+    """Approximate distinct counter with 2**precision registers (about 0.8% error at precision 14)."""
+
+    def __init__(self, precision: int = 14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add_hashes(self, hashes: np.ndarray):
+        """Add 64-bit hashes of values."""
+        hashes = hashes.astype(np.uint64)
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        # Rank of the first set bit of the remaining bits, read from the top 32 of them
+        rest = ((hashes << np.uint64(self.precision)) >> np.uint64(32)).astype(np.float64)
+        _, bit_length = np.frexp(rest)
+        rank = np.where(rest > 0, 33 - bit_length, 33).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def count(self) -> int:
+        registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / registers)
+        estimate = alpha * registers ** 2 / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * registers and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = registers * math.log(registers / zeros)
+        return int(round(estimate))
+
+
+class SpaceSaving:
+    """
+    Top-k sketch keeping `capacity` counters. Batches are summarized exactly and
+    merged into the running summary; items missing from a full summary are
+    assumed to have its smallest count, which bounds the overestimate.
+    """
+
+    def __init__(self, capacity: int = TOP_K_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+
+    def _floor(self, counts: dict) -> int:
+        return min(counts.values()) if len(counts) >= self.capacity else 0
+
+    def add_counts(self, value_counts: pd.Series):
+        batch = dict(value_counts.nlargest(self.capacity).items())
+        batch_floor = int(value_counts.iloc[self.capacity]) if len(value_counts) > self.capacity else 0
+        floor = self._floor(self.counts)
+        merged = {
+            value: self.counts.get(value, floor) + batch.get(value, batch_floor)
+            for value in set(self.counts) | set(batch)
+        }
+        top = sorted(merged.items(), key=lambda item: -item[1])[: self.capacity]
+        self.counts = dict(top)
+
+    def top(self, k: int = TOP_K_REPORTED) -> list:
+        return sorted(self.counts.items(), key=lambda item: -item[1])[:k]
+
+
+class QuantileSketch:
+    """
+    KLL-style quantile sketch: items are buffered in compactors of bounded size;
+    a full compactor keeps every other sorted item at twice the weight.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(0)
+
+    def add(self, values: np.ndarray):
+        self.levels[0] = np.concatenate([self.levels[0], values.astype(np.float64)])
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.capacity:
+                items = np.sort(items)
+                if len(self.levels) == level + 1:
+                    self.levels.append(np.empty(0))
+                # An odd item out stays at this level
+                keep = items[-1:] if len(items) % 2 else items[:0]
+                paired = items[: len(items) - len(keep)]
+                promoted = paired[self._rng.integers(2)::2]
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def quantiles(self, fractions=QUANTILES) -> dict:
+        values = np.concatenate(self.levels)
+        if not len(values):
+            return {}
+        weights = np.concatenate([np.full(len(items), 2.0 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(values)
+        values, cumulative = values[order], np.cumsum(weights[order])
+        total = cumulative[-1]
+        return {
+            str(fraction): float(values[min(np.searchsorted(cumulative, fraction * total), len(values) - 1)])
+            for fraction in fractions
+        }
+
+
+class ColumnStatistics:
+    """Streaming statistics of one column, updated one batch at a time."""
+
+    def __init__(self, name: str, declared_type: str):
+        self.name = name
+        self.declared_type = declared_type or ""
+        self.numeric = any(kind in self.declared_type.upper() for kind in ("INT", "REAL", "FLOA", "DOUB", "NUM"))
+        self.rows = 0
+        self.nulls = 0
+        self.minimum = None
+        self.maximum = None
+        # Running mean and sum of squared deviations, merged batch by batch (Chan et al.)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.distinct = HyperLogLog()
+        self.top_values = SpaceSaving()
+        self.quantiles = QuantileSketch() if self.numeric else None
+
+    def update(self, values: pd.Series):
+        self.rows += len(values)
+        present = values.dropna()
+        self.nulls += len(values) - len(present)
+        if not len(present):
+            return
+
+        if self.numeric:
+            numbers = pd.to_numeric(present, errors="coerce").dropna().astype(np.float64)
+            if len(numbers):
+                self._update_moments(numbers.to_numpy())
+                self._update_range(float(numbers.min()), float(numbers.max()))
+        else:
+            text = present.astype(str)
+            self._update_range(text.min(), text.max())
+
+        self.distinct.add_hashes(pd.util.hash_pandas_object(present.astype(str), index=False).to_numpy())
+        self.top_values.add_counts(present.astype(str).value_counts())
+
+    def _update_range(self, minimum, maximum):
+        self.minimum = minimum if self.minimum is None else min(self.minimum, minimum)
+        self.maximum = maximum if self.maximum is None else max(self.maximum, maximum)
+
+    def _update_moments(self, numbers: np.ndarray):
+        batch_count = len(numbers)
+        batch_mean = float(numbers.mean())
+        batch_m2 = float(((numbers - batch_mean) ** 2).sum())
+        total = self.count + batch_count
+        delta = batch_mean - self.mean
+        self.mean += delta * batch_count / total
+        self.m2 += batch_m2 + delta ** 2 * self.count * batch_count / total
+        self.count = total
+        self.quantiles.add(numbers)
+
+    def as_row(self, table_name: str) -> tuple:
+        std = math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else None
+        if "INT" in self.declared_type.upper() and self.minimum is not None:
+            self.minimum, self.maximum = int(self.minimum), int(self.maximum)
+        return (
+            table_name,
+            self.name,
+            self.declared_type,
+            self.rows,
+            self.nulls,
+            min(self.distinct.count(), self.rows - self.nulls),
+            self.minimum,
+            self.maximum,
+            self.mean if self.count else None,
+            std,
+            json.dumps(self.quantiles.quantiles()) if self.quantiles else None,
+            json.dumps(self.top_values.top()),
+            time.time(),
+        )
+
+
+def compute_table_stats(db_path: str, table_name: str) -> list:
+    """Compute the statistics of every column of a table in one streaming pass."""
+    with pool.connection(db_path) as conn:
+        columns_info = conn.execute(f"PRAGMA table_info({quote_identifier(table_name)})").fetchall()
+        if not columns_info:
+            raise ValueError(f"Table {table_name} does not exist in the database")
+        statistics = [ColumnStatistics(column[1], column[2]) for column in columns_info]
+        names = [column[1] for column in columns_info]
+        with closing(conn.execute(f"SELECT * FROM {quote_identifier(table_name)}")) as cursor:
+            while True:
+                rows = cursor.fetchmany(STATS_BATCH_SIZE)
+                if not rows:
+                    break
+                batch = pd.DataFrame.from_records(rows, columns=range(len(names)))
+                for position, column in enumerate(statistics):
+                    column.update(batch[position])
+    return [column.as_row(table_name) for column in statistics]
+
+
+def write_table_stats(db_path: str, table_name: str):
+    """(Re)compute the statistics of a table and store them in its database's `_column_stats`."""
+    rows = compute_table_stats(db_path, table_name)
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {COLUMN_STATS_TABLE} ("
+            "table_name TEXT NOT NULL, column_name TEXT NOT NULL, declared_type TEXT, "
+            "row_count INTEGER, null_count INTEGER, distinct_count INTEGER, min, max, "
+            "mean REAL, std REAL, quantiles TEXT, top_values TEXT, updated_at REAL, "
+            "PRIMARY KEY (table_name, column_name))"
+        )
+        conn.execute(f"DELETE FROM {COLUMN_STATS_TABLE} WHERE table_name = ?", (table_name,))
+        conn.executemany(f"INSERT INTO {COLUMN_STATS_TABLE} VALUES ({', '.join('?' * 13)})", rows)
+        conn.commit()
+    finally:
+        conn.close()
+    logger.info(f"Computed column statistics of {table_name} in {db_path}")
+
+
+def refresh_table_stats(db_path: str, table_name: str):
+    """Best-effort statistics refresh after a table is written; readers compute them lazily on failure."""
+    try:
+        write_table_stats(db_path, table_name)
+    except Exception:
+        logger.exception(f"Failed to compute column statistics of {table_name} in {db_path}")
+
+
+def _stats_from_rows(rows) -> list:
+    return [
+        {
+            "column": row[0],
+            "type": row[1],
+            "row_count": row[2],
+            "null_count": row[3],
+            "distinct_count": row[4],
+            "min": row[5],
+            "max": row[6],
+            "mean": row[7],
+            "std": row[8],
+            "quantiles": json.loads(row[9]) if row[9] else None,
+            "top_values": json.loads(row[10]) if row[10] else [],
+        }
+        for row in rows
+    ]
+
+
+def read_table_stats(conn, table_name: str, schema: str = "main"):
+    """Stored statistics of a table, or None when they have not been computed."""
+    try:
+        rows = conn.execute(
+            f"SELECT column_name, declared_type, row_count, null_count, distinct_count, min, max, "
+            f"mean, std, quantiles, top_values FROM {quote_identifier(schema)}.{COLUMN_STATS_TABLE} "
+            "WHERE table_name = ? ORDER BY rowid",
+            (table_name,),
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return None
+    return _stats_from_rows(rows) or None
+
+
+def load_table_stats(db_path: str, table_name: str) -> list:
+    """Statistics of a table, computing and storing them first if they are missing."""
+    with pool.connection(db_path) as conn:
+        stats = read_table_stats(conn, table_name)
+    if stats is None:
+        write_table_stats(db_path, table_name)
+        with pool.connection(db_path) as conn:
+            stats = read_table_stats(conn, table_name)
+    return stats
+
+
+def describe_table_stats(stats: list, top_values: int = 5) -> list[str]:
+    """One line per column summarizing its statistics, for the schema prompt."""
+    lines = []
+    for column in stats:
+        parts = [f"{column['null_count']} nulls of {column['row_count']}", f"~{column['distinct_count']} distinct"]
+        declared_type = (column["type"] or "").upper()
+        if column["min"] is not None and (column["mean"] is not None or "DATE" in declared_type or "TIME" in declared_type):
+            parts.append(f"range {column['min']} .. {column['max']}")
+        if column["quantiles"]:
+            parts.append(f"median {column['quantiles']['0.5']:g}")
+        # Top values of (nearly) unique columns are noise
+        if column["top_values"] and column["top_values"][0][1] > 1:
+            parts.append("top: " + ", ".join(f"{value!r} ({count})" for value, count in column["top_values"][:top_values]))
+        lines.append(f'- "{column["column"]}" {column["type"]}: ' + ", ".join(parts))
+    return lines
@@ -0,0 +1,151 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+# Memory-mapped I/O and page cache applied to every pooled connection
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+# Prepared statements kept per connection
+SQLITE_CACHED_STATEMENTS = 256
+# Idle connections kept per database, and how long they may stay unused
+POOL_MAX_IDLE_PER_DB = int(os.getenv("POOL_MAX_IDLE_PER_DB", "8"))
+POOL_IDLE_TIMEOUT_SECONDS = int(os.getenv("POOL_IDLE_TIMEOUT_SECONDS", "300"))
+
+
+def pool_key(db_path: str) -> str:
+    return os.path.realpath(db_path)
+
+
+def is_wal(db_path: str) -> bool:
+    # Bytes 18 and 19 of the database header are the file format versions, 2 in WAL mode
+    try:
+        with open(db_path, "rb") as file:
+            return file.read(20)[18:20] == b"\x02\x02"
+    except OSError:
+        return False
+
+
+def ensure_wal(db_path: str):
+    """Switch a database to WAL so pooled readers never block (or get blocked by) writers."""
+    if is_wal(db_path):
+        # Closing a writable connection would checkpoint the WAL and change the file
+        return
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+    finally:
+        conn.close()
+
+
+class ConnectionPool:
+    """
+    Per-database pool of tuned, read-only SQLite connections.
+    Connections keep their parsed schema and prepared statements between requests;
+    idle ones are closed after POOL_IDLE_TIMEOUT_SECONDS.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {}  # pool key -> list of (connection, last used)
+        self._generations = {}  # pool key -> bumped whenever the database is discarded
+        self._checked_out = {}  # id(connection) -> generation it was handed out in
+        self._wal_checked = set()
+        self._open_hooks = []
+
+    def add_open_hook(self, hook):
+        """Register `hook(conn)`, run on every new connection before it is handed out."""
+        self._open_hooks.append(hook)
+
+    def _open(self, key: str) -> sqlite3.Connection:
+        if key not in self._wal_checked:
+            try:
+                ensure_wal(key)
+            except sqlite3.Error:
+                logger.warning(f"Could not enable WAL for {key}")
+            self._wal_checked.add(key)
+
+        conn = sqlite3.connect(
+            f"file:{quote(key)}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+            cached_statements=SQLITE_CACHED_STATEMENTS,
+        )
+        conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        try:
+            for hook in self._open_hooks:
+                hook(conn)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def acquire(self, db_path: str) -> sqlite3.Connection:
+        key = pool_key(db_path)
+        with self._lock:
+            generation = self._generations.get(key, 0)
+            idle = self._idle.get(key)
+            conn = idle.pop()[0] if idle else None
+        if conn is None:
+            conn = self._open(key)
+        with self._lock:
+            self._checked_out[id(conn)] = generation
+        return conn
+
+    def release(self, db_path: str, conn: sqlite3.Connection):
+        key = pool_key(db_path)
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            generation = self._checked_out.pop(id(conn), None)
+            idle = self._idle.setdefault(key, [])
+            if generation == self._generations.get(key, 0) and len(idle) < POOL_MAX_IDLE_PER_DB:
+                idle.append((conn, now))
+            else:
+                expired.append(conn)
+
+            # Evict connections that have not been used for a while, across all databases
+            for other_key, connections in list(self._idle.items()):
+                fresh = [(c, used) for c, used in connections if now - used < POOL_IDLE_TIMEOUT_SECONDS]
+                expired.extend(c for c, used in connections if now - used >= POOL_IDLE_TIMEOUT_SECONDS)
+                if fresh:
+                    self._idle[other_key] = fresh
+                else:
+                    del self._idle[other_key]
+        for connection in expired:
+            connection.close()
+
+    @contextmanager
+    def connection(self, db_path: str):
+        conn = self.acquire(db_path)
+        try:
+            yield conn
+        finally:
+            self.release(db_path, conn)
+
+    def discard(self, db_path: str):
+        """Close the idle connections of a database that is about to be replaced or removed."""
+        key = pool_key(db_path)
+        with self._lock:
+            connections = self._idle.pop(key, [])
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self._wal_checked.discard(key)
+        for conn, _ in connections:
+            conn.close()
+
+    def close_all(self):
+        with self._lock:
+            connections = [conn for idle in self._idle.values() for conn, _ in idle]
+            self._idle.clear()
+        for conn in connections:
+            conn.close()
+
+
+pool = ConnectionPool()
@@ -0,0 +1,288 @@
+import datetime
+import logging
+import multiprocessing
+import os
+import re
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from backend.sqlite_server.ingest import (
+    DEFAULT_CHUNK_SIZE,
+    INGEST_PRAGMAS,
+    analyze,
+    create_table,
+    infer_column_types,
+    quote_identifier,
+    typed_rows,
+    write_dataframe,
+)
+
+logger = logging.getLogger(__name__)
+
+# Processes converting sheets of one workbook in parallel; openpyxl parsing holds the GIL
+EXCEL_INGEST_PROCESSES = int(os.getenv("EXCEL_INGEST_PROCESSES", str(min(4, os.cpu_count() or 1))))
+
+# Maps each sheet to its table; the cleaning pipeline writes one cleaned table per sheet
+SHEETS_TABLE = "_sheets"
+SOURCE_TABLE_NAME = "data"
+CLEANED_TABLE_NAME = "data_cleaned"
+
+
+def sheet_tables(sheets: list[tuple[int, str]]) -> list[tuple[str, str]]:
+    """
+    (table, cleaned table) of each (index, name) of the sheets with data. The first
+    of them keeps the usual `data` table; the others become `data_<sheet>`, whose
+    cleaned tables `data_cleaned_<sheet>` are picked up wherever `data_cleaned` tables are.
+    A sheet's table only depends on the sheets before it.
+    """
+    tables = []
+    taken = set()
+    for index, sheet_name in sheets:
+        if not tables:
+            suffix = ""
+        else:
+            slug = re.sub(r"\W+", "_", str(sheet_name)).strip("_").lower()
+            # Source tables must never look like cleaned or analysed tables
+            if not slug or slug.startswith(("cleaned", "analysed")) or f"_{slug}" in taken:
+                slug = f"sheet{index}"
+            suffix = f"_{slug}"
+        taken.add(suffix)
+        tables.append((SOURCE_TABLE_NAME + suffix, CLEANED_TABLE_NAME + suffix))
+    return tables
+
+
+def _column_names(header) -> list[str]:
+    # Name unnamed and duplicated columns the way pandas.read_excel does
+    names = []
+    seen = {}
+    for index, value in enumerate(header):
+        name = f"Unnamed: {index}" if value is None else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _cell_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return str(value)
+    return value
+
+
+def ingest_sheet(
+    excel_path: str, sheet_name: str, sqlite_file_path: str, table_name: str, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> int:
+    """
+    Stream one sheet of an .xlsx workbook into `table_name` of a database.
+    Rows are read with openpyxl's read-only reader and inserted in batches of
+    `chunk_size`, normalized to the column types inferred from the first batch.
+    Returns the number of rows ingested, or None for an empty sheet.
+    """
+    workbook = load_workbook(excel_path, read_only=True, data_only=True)
+    conn = sqlite3.connect(sqlite_file_path, isolation_level=None)
+    rows = 0
+    try:
+        for pragma in INGEST_PRAGMAS:
+            conn.execute(pragma)
+        worksheet = workbook[sheet_name]
+        # Workbooks written by other tools often record wrong dimensions; read until the end
+        worksheet.reset_dimensions()
+        sheet_rows = worksheet.iter_rows(values_only=True)
+        header = next(sheet_rows, None)
+        if header is None or all(value is None for value in header):
+            return None
+        names = _column_names(header)
+        width = len(names)
+
+        conn.execute("BEGIN")
+        column_types = None
+        batch = []
+        for row in sheet_rows:
+            # Skip blank rows and pad the short rows of sparse sheets
+            if all(value is None for value in row):
+                continue
+            batch.append(tuple(row[:width]) + (None,) * (width - len(row)))
+            if len(batch) < chunk_size:
+                continue
+            column_types = _insert_batch(conn, table_name, names, batch, column_types)
+            rows += len(batch)
+            batch = []
+        _insert_batch(conn, table_name, names, batch, column_types)
+        rows += len(batch)
+        conn.execute("COMMIT")
+        return rows
+    finally:
+        conn.close()
+        workbook.close()
+
+
+def _insert_batch(conn, table_name: str, names: list[str], batch: list, column_types: dict) -> dict:
+    df = pd.DataFrame([[_cell_value(value) for value in row] for row in batch], columns=names, dtype=object)
+    df = df.infer_objects()
+    if column_types is None:
+        # The first batch is the sample the column types are inferred from
+        column_types = infer_column_types(df)
+        create_table(conn, table_name, df, column_types)
+    placeholders = ", ".join("?" for _ in names)
+    conn.executemany(
+        f"INSERT INTO {quote_identifier(table_name)} VALUES ({placeholders})", typed_rows(df, column_types)
+    )
+    return column_types
+
+
+def _write_sheets_table(conn, sheets: list):
+    conn.execute(
+        f"CREATE TABLE {SHEETS_TABLE} (sheet_index INTEGER PRIMARY KEY, sheet_name TEXT NOT NULL, "
+        "table_name TEXT NOT NULL, cleaned_table_name TEXT NOT NULL)"
+    )
+    conn.executemany(f"INSERT INTO {SHEETS_TABLE} VALUES (?, ?, ?, ?)", sheets)
+
+
+def _ingest_xlsx(excel_path: str, sqlite_file_path: str) -> list:
+    workbook = load_workbook(excel_path, read_only=True)
+    sheet_names = workbook.sheetnames
+    workbook.close()
+
+    if len(sheet_names) == 1:
+        count = ingest_sheet(excel_path, sheet_names[0], sqlite_file_path, SOURCE_TABLE_NAME)
+        return [] if count is None else [(0, sheet_names[0], SOURCE_TABLE_NAME, CLEANED_TABLE_NAME, count)]
+
+    # Each process streams its sheet into its own database; they are merged below, once
+    # the empty sheets are known and the tables can be named
+    temp_paths = [f"{sqlite_file_path}.{uuid.uuid4().hex}.tmp" for _ in sheet_names]
+    try:
+        with ProcessPoolExecutor(
+            max_workers=min(EXCEL_INGEST_PROCESSES, len(sheet_names)),
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            counts = list(executor.map(
+                ingest_sheet,
+                [excel_path] * len(sheet_names),
+                sheet_names,
+                temp_paths,
+                [SOURCE_TABLE_NAME] * len(sheet_names),
+            ))
+        sheets = [
+            (index, sheet_name, temp_path, count)
+            for index, (sheet_name, temp_path, count) in enumerate(zip(sheet_names, temp_paths, counts))
+            if count is not None
+        ]
+        tables = sheet_tables([(index, sheet_name) for index, sheet_name, _, _ in sheets])
+        _merge_databases(sqlite_file_path, [
+            (temp_path, table) for (_, _, temp_path, _), (table, _) in zip(sheets, tables)
+        ])
+    finally:
+        for temp_path in temp_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    return [
+        (index, sheet_name, table, cleaned_table, count)
+        for (index, sheet_name, _, count), (table, cleaned_table) in zip(sheets, tables)
+    ]
+
+
+def _merge_databases(sqlite_file_path: str, parts: list):
+    # Copy each sheet's `data` table to its table inside SQLite, without materializing rows in Python
+    conn = sqlite3.connect(sqlite_file_path, isolation_level=None)
+    try:
+        for pragma in INGEST_PRAGMAS:
+            conn.execute(pragma)
+        for temp_path, table in parts:
+            conn.execute("ATTACH DATABASE ? AS sheet", (temp_path,))
+            try:
+                if table != SOURCE_TABLE_NAME:
+                    conn.execute(
+                        f"ALTER TABLE sheet.{quote_identifier(SOURCE_TABLE_NAME)} RENAME TO {quote_identifier(table)}"
+                    )
+                create_statement = conn.execute(
+                    "SELECT sql FROM sheet.sqlite_master WHERE type='table' AND name=?", (table,)
+                ).fetchone()[0]
+                conn.execute("BEGIN")
+                conn.execute(create_statement)
+                conn.execute(f"INSERT INTO main.{quote_identifier(table)} SELECT * FROM sheet.{quote_identifier(table)}")
+                conn.execute("COMMIT")
+            finally:
+                conn.execute("DETACH DATABASE sheet")
+    finally:
+        conn.close()
+
+
+def _ingest_xls(excel_path: str, sqlite_file_path: str) -> list:
+    # openpyxl cannot read the legacy format; pandas parses it one sheet at a time,
+    # so only the sheet being written is held as a DataFrame
+    conn = sqlite3.connect(sqlite_file_path, isolation_level=None)
+    try:
+        for pragma in INGEST_PRAGMAS:
+            conn.execute(pragma)
+        ingested = []
+        with pd.ExcelFile(excel_path) as workbook:
+            sheet_names = workbook.sheet_names
+            for index, sheet_name in enumerate(sheet_names):
+                df = workbook.parse(sheet_name)
+                if df.columns.empty:
+                    continue
+                table, cleaned_table = sheet_tables(
+                    [(sheet[0], sheet[1]) for sheet in ingested] + [(index, sheet_name)]
+                )[-1]
+                conn.execute("BEGIN")
+                write_dataframe(conn, table, df)
+                conn.execute("COMMIT")
+                ingested.append((index, sheet_name, table, cleaned_table, len(df)))
+        return ingested
+    finally:
+        conn.close()
+
+
+def stream_excel_to_sqlite(excel_path: str, sqlite_file_path: str) -> dict:
+    """
+    Ingest every sheet of an Excel workbook into its own table of a new database.
+    .xlsx sheets are streamed row by row, in parallel processes when there are several;
+    the `_sheets` table records which table holds which sheet.
+    Returns ingest statistics: rows, seconds, rows_per_sec and per-sheet tables
+    """
+    started = time.perf_counter()
+    try:
+        if excel_path.lower().endswith(".xls"):
+            sheets = _ingest_xls(excel_path, sqlite_file_path)
+        else:
+            sheets = _ingest_xlsx(excel_path, sqlite_file_path)
+        if not sheets:
+            raise ValueError("Excel file has no data")
+
+        conn = sqlite3.connect(sqlite_file_path)
+        try:
+            _write_sheets_table(conn, [sheet[:4] for sheet in sheets])
+            conn.commit()
+            analyze(conn)
+            # Readers share the database through WAL once the ingest is done
+            conn.execute("PRAGMA journal_mode=WAL")
+        finally:
+            conn.close()
+    except Exception:
+        if os.path.exists(sqlite_file_path):
+            os.remove(sqlite_file_path)
+        raise
+
+    seconds = time.perf_counter() - started
+    rows = sum(sheet[4] for sheet in sheets)
+    stats = {
+        "rows": rows,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(rows / seconds) if seconds > 0 else rows,
+        "sheets": [{"sheet": sheet[1], "table": sheet[2], "rows": sheet[4]} for sheet in sheets],
+    }
+    logger.info(f"Ingested {rows} rows from {len(sheets)} sheets into {sqlite_file_path}")
+    return stats
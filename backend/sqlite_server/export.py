@@ -0,0 +1,105 @@
+import csv
+import os
+import zlib
+from io import BytesIO, StringIO
+
+import pyarrow.parquet as pq
+
+from backend.sqlite_server.connection_pool import pool
+from backend.sqlite_server.ingest import quote_identifier
+from backend.sqlite_server.sidecar import SIDECAR_BATCH_SIZE, load_table
+
+# Rows encoded per CSV block; bounds the memory of an export regardless of table size
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "10000"))
+
+# format -> (media type, file extension)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+}
+EXPORT_COMPRESSIONS = {
+    "gzip": ("application/gzip", ".gz"),
+}
+
+
+def _csv_blocks(cursor, names):
+    buffer = StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(names)
+    while True:
+        rows = cursor.fetchmany(EXPORT_BATCH_ROWS)
+        if not rows:
+            break
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    # A table without rows still gets its header
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _parquet_blocks(table):
+    # Encode from the memory-mapped sidecar one row group at a time, draining the sink
+    buffer = BytesIO()
+    with pq.ParquetWriter(buffer, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=SIDECAR_BATCH_SIZE):
+            writer.write_batch(batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _gzip_blocks(blocks):
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for block in blocks:
+        compressed = compressor.compress(block)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class TableExport:
+    """
+    A table exported as encoded blocks, pulled one call to next_block at a time so
+    each block can be produced on a worker thread. CSV rows are read straight from
+    a pooled connection, which is held until close; Parquet is written from the
+    table's columnar sidecar.
+    """
+
+    def __init__(self, db_path: str, table_name: str, format: str = "csv", compression: str = None):
+        self.db_path = db_path
+        self.conn = None
+        self.cursor = None
+
+        if format == "parquet":
+            blocks = _parquet_blocks(load_table(db_path, table_name))
+        else:
+            self.conn = pool.acquire(db_path)
+            try:
+                names = [
+                    column[1]
+                    for column in self.conn.execute(f"PRAGMA table_info({quote_identifier(table_name)})").fetchall()
+                ]
+                if not names:
+                    raise ValueError(f"Table {table_name} does not exist in the database")
+                self.cursor = self.conn.execute(f"SELECT * FROM {quote_identifier(table_name)}")
+            except Exception:
+                self.close()
+                raise
+            blocks = _csv_blocks(self.cursor, names)
+
+        self._blocks = _gzip_blocks(blocks) if compression == "gzip" else blocks
+
+    def next_block(self):
+        """Next encoded block, or None when the export is complete."""
+        return next(self._blocks, None)
+
+    def close(self):
+        if self.conn is not None:
+            if self.cursor is not None:
+                self.cursor.close()
+            pool.release(self.db_path, self.conn)
+            self.conn = None
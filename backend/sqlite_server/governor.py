@@ -0,0 +1,105 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from backend.sqlite_server.query_results import QUERY_ROW_LIMIT
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CALLER = "interactive"
+# SQLite virtual machine instructions between deadline checks
+PROGRESS_HANDLER_INSTRUCTIONS = 10000
+
+
+@dataclass(frozen=True)
+class QueryBudget:
+    timeout_seconds: float  # wall-clock time SQLite may spend executing and fetching
+    max_rows: int  # rows per response
+    max_bytes: int  # approximate size of the rows per response
+
+
+_DEFAULT_BUDGETS = {
+    DEFAULT_CALLER: {"timeout_seconds": 30, "max_rows": QUERY_ROW_LIMIT, "max_bytes": 64 * 1024 * 1024},
+    # Generated SQL gets less room so it cannot starve the interactive endpoints
+    "agent": {"timeout_seconds": 10, "max_rows": 10000, "max_bytes": 8 * 1024 * 1024},
+}
+
+
+def load_budgets() -> dict:
+    """
+    Budgets per caller. QUERY_BUDGETS may hold a JSON object of
+    {caller: {"timeout_seconds", "max_rows", "max_bytes"}} overriding or adding callers.
+    """
+    budgets = {caller: dict(budget) for caller, budget in _DEFAULT_BUDGETS.items()}
+    overrides = os.getenv("QUERY_BUDGETS")
+    if overrides:
+        for caller, budget in json.loads(overrides).items():
+            budgets.setdefault(caller, dict(budgets[DEFAULT_CALLER])).update(budget)
+    return {caller: QueryBudget(**budget) for caller, budget in budgets.items()}
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+class QueryGovernor:
+    """
+    Enforces the budget of a caller on its queries: SQLite is interrupted through
+    its progress handler once the time budget is spent, and responses are cut off
+    at the row and byte caps. Cut-offs are counted per caller and reason.
+    """
+
+    def __init__(self, budgets: dict = None):
+        self.budgets = budgets or load_budgets()
+        self._lock = threading.Lock()
+        self.cutoffs = {}  # caller -> reason -> count
+
+    def budget(self, caller: str = None) -> QueryBudget:
+        # Unknown callers get the interactive budget
+        return self.budgets.get(caller or DEFAULT_CALLER, self.budgets[DEFAULT_CALLER])
+
+    @contextmanager
+    def deadline(self, conn, budget: QueryBudget):
+        """
+        Interrupt whatever `conn` executes once the time budget is spent; an interrupted
+        statement raises QueryTimeout.
+        """
+        expires = time.perf_counter() + budget.timeout_seconds
+        timed_out = []
+
+        def check():
+            if time.perf_counter() > expires:
+                timed_out.append(True)
+                return 1
+            return 0
+
+        conn.set_progress_handler(check, PROGRESS_HANDLER_INSTRUCTIONS)
+        try:
+            yield
+        except Exception as e:
+            if timed_out:
+                raise QueryTimeout(f"Query exceeded its time budget of {budget.timeout_seconds}s") from e
+            raise
+        finally:
+            conn.set_progress_handler(None, 0)
+
+    def record_cutoff(self, caller: str, reason: str, query: str):
+        caller = caller or DEFAULT_CALLER
+        with self._lock:
+            reasons = self.cutoffs.setdefault(caller, {})
+            reasons[reason] = reasons.get(reason, 0) + 1
+        logger.warning(f"Cut off a query of {caller} ({reason}): {query[:200]}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "budgets": {caller: vars(budget) for caller, budget in self.budgets.items()},
+                "cutoffs": {caller: dict(reasons) for caller, reasons in self.cutoffs.items()},
+            }
+
+
+governor = QueryGovernor()
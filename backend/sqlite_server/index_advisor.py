@@ -0,0 +1,320 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from backend.sqlite_server.connection_pool import pool, pool_key
+from backend.sqlite_server.ingest import quote_identifier
+
+logger = logging.getLogger(__name__)
+
+INDEX_ADVISOR_ENABLED = os.getenv("INDEX_ADVISOR_ENABLED", "1") == "1"
+# Seconds between background analyses of the query log
+INDEX_ADVISOR_INTERVAL_SECONDS = int(os.getenv("INDEX_ADVISOR_INTERVAL_SECONDS", "60"))
+# Logged executions of full-scanning queries a column needs before it is indexed
+INDEX_MIN_QUERY_COUNT = int(os.getenv("INDEX_MIN_QUERY_COUNT", "2"))
+# Indexes that do not make their queries at least this much faster are dropped again
+INDEX_MIN_SPEEDUP = float(os.getenv("INDEX_MIN_SPEEDUP", "1.5"))
+# Automatic indexes no logged query has used for this long are retired
+INDEX_RETIRE_AFTER_SECONDS = int(os.getenv("INDEX_RETIRE_AFTER_SECONDS", str(24 * 60 * 60)))
+# Rejected and retired indexes are evaluated again after this long, and rejected ones
+# sooner once their queries have run this many times as often as when they were rejected
+INDEX_REEVALUATE_AFTER_SECONDS = int(os.getenv("INDEX_REEVALUATE_AFTER_SECONDS", str(24 * 60 * 60)))
+INDEX_REEVALUATE_QUERY_GROWTH = float(os.getenv("INDEX_REEVALUATE_QUERY_GROWTH", "2"))
+# Distinct queries remembered per database, and the time budget of one timing run
+QUERY_LOG_SIZE = 200
+MEASURE_TIMEOUT_SECONDS = 10
+
+AUTO_INDEX_PREFIX = "_auto_idx_"
+
+_IDENTIFIER = re.compile(r'"((?:[^"]|"")+)"|\[([^\]]+)\]|`([^`]+)`|([A-Za-z_]\w*)')
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_CLAUSES = re.compile(
+    r"\b(?:WHERE|ON)\b(.*?)(?=\bGROUP\s+BY\b|\bORDER\s+BY\b|\bHAVING\b|\bLIMIT\b|\bJOIN\b|\bWHERE\b|$)"
+    r"|\bGROUP\s+BY\b(.*?)(?=\bHAVING\b|\bORDER\s+BY\b|\bLIMIT\b|$)"
+    r"|\bSELECT\s+DISTINCT\b(.*?)(?=\bFROM\b)",
+    re.IGNORECASE | re.DOTALL,
+)
+_TABLE_REFERENCE = re.compile(
+    r'\b(?:FROM|JOIN)\s+((?:\w+\.)?(?:"(?:[^"]|"")+"|\[[^\]]+\]|`[^`]+`|\w+))(?:\s+(?:AS\s+)?(\w+))?',
+    re.IGNORECASE,
+)
+_SCAN = re.compile(r"^SCAN (\S+)(?: USING (?:COVERING )?INDEX (\S+))?")
+_SEARCH = re.compile(r"^SEARCH (\S+) USING (?:AUTOMATIC (?:PARTIAL )?COVERING INDEX \((\w+)=|(?:COVERING )?INDEX (\S+))")
+
+
+def _unquote(name: str) -> str:
+    if name[:1] in ('"', "[", "`"):
+        return name[1:-1].replace('""', '"')
+    return name
+
+
+def _referenced_identifiers(query: str) -> set:
+    query = _STRING_LITERAL.sub("''", query)
+    identifiers = set()
+    for match in _CLAUSES.finditer(query):
+        clause = next(group for group in match.groups() if group is not None)
+        for identifier in _IDENTIFIER.finditer(clause):
+            identifiers.add(next(group for group in identifier.groups() if group is not None).replace('""', '"'))
+    return identifiers
+
+
+def _table_aliases(query: str) -> dict:
+    aliases = {}
+    for reference, alias in _TABLE_REFERENCE.findall(_STRING_LITERAL.sub("''", query)):
+        schema, _, table = reference.rpartition(".")
+        target = (schema or None, _unquote(table))
+        aliases[_unquote(table)] = target
+        if alias and alias.upper() not in ("WHERE", "ON", "JOIN", "INNER", "LEFT", "CROSS", "GROUP", "ORDER", "LIMIT", "NATURAL"):
+            aliases[alias] = target
+    return aliases
+
+
+class IndexAdvisor:
+    """
+    Logs the queries executed against each database and, in a background thread,
+    indexes the columns that frequently filtered, grouped or distinct full scans
+    use. Every index is timed against the queries that asked for it and dropped
+    when it does not pay off; automatic indexes that stop being used are retired.
+    Rejected and retired candidates are evaluated again once their verdict is old.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._analysis_lock = threading.Lock()
+        self._log = {}  # pool key -> OrderedDict(query -> execution count)
+        self._dirty = set()
+        self._recommendations = {}  # (file, table, column) -> recommendation
+        self._last_used = {}  # (file, index name) -> last time a logged query used it
+        self._thread = None
+        self._stop = threading.Event()
+
+    def record_query(self, db_path: str, query: str):
+        """Log a successfully executed query."""
+        if not INDEX_ADVISOR_ENABLED:
+            return
+        key = pool_key(db_path)
+        with self._lock:
+            log = self._log.setdefault(key, OrderedDict())
+            log[query] = log.pop(query, 0) + 1
+            while len(log) > QUERY_LOG_SIZE:
+                log.popitem(last=False)
+            self._dirty.add(key)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="index-advisor", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(INDEX_ADVISOR_INTERVAL_SECONDS):
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+            for key in dirty:
+                try:
+                    self.analyze(key)
+                except Exception:
+                    logger.exception(f"Index analysis of {key} failed")
+
+    def stop(self):
+        self._stop.set()
+
+    def _resolve(self, conn, files: dict, aliases: dict, name: str):
+        """Map a table, alias or project view named in a query plan to (database file, table)."""
+        schema, _, table = name.rpartition(".")
+        if not schema:
+            schema, table = aliases.get(table, (None, table))
+        if not schema:
+            view = conn.execute(
+                "SELECT sql FROM sqlite_temp_master WHERE type='view' AND name=?", (table,)
+            ).fetchone()
+            if view:
+                # Project views select everything from one attached member table
+                match = re.search(r'FROM "((?:[^"]|"")+)"\."((?:[^"]|"")+)"', view[0])
+                if not match:
+                    return None
+                schema, table = (group.replace('""', '"') for group in match.groups())
+        file = files.get(schema or "main")
+        return (schema or "main", file, table) if file else None
+
+    def _plan_candidates(self, conn, query: str) -> tuple:
+        """Columns worth indexing for a query, and the automatic indexes its plan uses."""
+        candidates = set()
+        used = set()
+        try:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+        except sqlite3.Error:
+            return candidates, used
+        files = {row[1]: row[2] for row in conn.execute("PRAGMA database_list").fetchall() if row[2]}
+        aliases = _table_aliases(query)
+        identifiers = _referenced_identifiers(query)
+        for row in plan:
+            detail = row[3]
+            match = _SCAN.match(detail) or _SEARCH.match(detail)
+            if not match:
+                continue
+            resolved = self._resolve(conn, files, aliases, match.group(1))
+            if resolved is None:
+                continue
+            schema, file, table = resolved
+
+            index_name = match.group(2) if match.re is _SCAN else match.group(3)
+            if index_name:
+                used.add((file, index_name))
+                continue
+
+            columns = {
+                column[1]
+                for column in conn.execute(
+                    f"PRAGMA {quote_identifier(schema)}.table_info({quote_identifier(table)})"
+                ).fetchall()
+            }
+            # A full scan may use any filtered or grouped column; an automatic index names its column
+            wanted = identifiers if match.re is _SCAN else {match.group(2)}
+            candidates.update((file, table, column) for column in wanted & columns)
+        return candidates, used
+
+    def _time_query(self, db_path: str, query: str):
+        with pool.connection(db_path) as conn:
+            deadline = time.perf_counter() + MEASURE_TIMEOUT_SECONDS
+            conn.set_progress_handler(lambda: time.perf_counter() > deadline, 10000)
+            try:
+                best = None
+                for _ in range(2):
+                    started = time.perf_counter()
+                    conn.execute(query).fetchall()
+                    elapsed = time.perf_counter() - started
+                    best = elapsed if best is None else min(best, elapsed)
+                return best
+            except sqlite3.OperationalError:
+                # Interrupted by the deadline
+                return None
+            finally:
+                conn.set_progress_handler(None, 0)
+
+    def analyze(self, db_path: str):
+        """Analyze the logged queries of a database, creating and retiring indexes."""
+        key = pool_key(db_path)
+        with self._analysis_lock:
+            with self._lock:
+                queries = list(self._log.get(key, {}).items())
+
+            counts = {}
+            queries_for = {}
+            now = time.time()
+            with pool.connection(key) as conn:
+                for query, count in queries:
+                    candidates, used = self._plan_candidates(conn, query)
+                    for candidate in candidates:
+                        counts[candidate] = counts.get(candidate, 0) + count
+                        queries_for.setdefault(candidate, []).append(query)
+                    for file, index_name in used:
+                        if index_name.startswith(AUTO_INDEX_PREFIX):
+                            self._last_used[(file, index_name)] = now
+                files = {row[2] for row in conn.execute("PRAGMA database_list").fetchall() if row[2]}
+
+            for candidate, count in sorted(counts.items(), key=lambda item: -item[1]):
+                if count < INDEX_MIN_QUERY_COUNT:
+                    continue
+                recommendation = self._recommendations.get(candidate)
+                if recommendation is not None and not _due(recommendation, count, now):
+                    continue
+                self._evaluate(key, candidate, queries_for[candidate], count)
+            for file in files:
+                self._retire_unused(file, now)
+
+    def _evaluate(self, db_path: str, candidate: tuple, queries: list, count: int):
+        file, table, column = candidate
+        index_name = AUTO_INDEX_PREFIX + re.sub(r"\W", "_", f"{table}_{column}")
+        query = queries[0]
+        before = self._time_query(db_path, query)
+
+        conn = sqlite3.connect(file, timeout=30)
+        try:
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {quote_identifier(index_name)} "
+                f"ON {quote_identifier(table)} ({quote_identifier(column)})"
+            )
+            conn.execute(f"ANALYZE {quote_identifier(index_name)}")
+            conn.commit()
+            after = self._time_query(db_path, query)
+            speedup = before / after if before and after else None
+            status = "created"
+            if speedup is not None and speedup < INDEX_MIN_SPEEDUP:
+                conn.execute(f"DROP INDEX {quote_identifier(index_name)}")
+                conn.commit()
+                status = "rejected"
+        finally:
+            conn.close()
+
+        if status == "created":
+            self._last_used[(file, index_name)] = time.time()
+        recommendation = {
+            "file": file,
+            "table": table,
+            "column": column,
+            "index_name": index_name,
+            "status": status,
+            "queries": count,
+            "example_query": query,
+            "before_ms": round(before * 1000, 3) if before is not None else None,
+            "after_ms": round(after * 1000, 3) if after is not None else None,
+            "speedup": round(speedup, 2) if speedup is not None else None,
+            "evaluated_at": time.time(),
+        }
+        with self._lock:
+            self._recommendations[candidate] = recommendation
+        logger.info(f"Index {index_name} on {file}: {status} (speedup {speedup})")
+
+    def _retire_unused(self, file: str, now: float):
+        conn = sqlite3.connect(file, timeout=30)
+        try:
+            indexes = conn.execute(
+                "SELECT name, tbl_name FROM sqlite_master WHERE type='index' AND name LIKE ? ESCAPE '\\'",
+                (AUTO_INDEX_PREFIX.replace("_", "\\_") + "%",),
+            ).fetchall()
+            for index_name, table in indexes:
+                # Indexes created before a restart start their idle time from now
+                last_used = self._last_used.setdefault((file, index_name), now)
+                if now - last_used < INDEX_RETIRE_AFTER_SECONDS:
+                    continue
+                conn.execute(f"DROP INDEX {quote_identifier(index_name)}")
+                conn.commit()
+                del self._last_used[(file, index_name)]
+                with self._lock:
+                    for recommendation in self._recommendations.values():
+                        if recommendation["file"] == file and recommendation["index_name"] == index_name:
+                            recommendation["status"] = "retired"
+                            recommendation["evaluated_at"] = now
+                logger.info(f"Retired unused index {index_name} on {file}")
+        finally:
+            conn.close()
+
+    def recommendations(self, db_path: str) -> dict:
+        """Indexes evaluated for a database, including those of the files a project attaches."""
+        key = pool_key(db_path)
+        with pool.connection(key) as conn:
+            files = {row[2] for row in conn.execute("PRAGMA database_list").fetchall() if row[2]}
+        with self._lock:
+            return {
+                "queries_logged": len(self._log.get(key, {})),
+                "indexes": [
+                    dict(recommendation)
+                    for recommendation in self._recommendations.values()
+                    if recommendation["file"] in files
+                ],
+            }
+
+
+def _due(recommendation: dict, count: int, now: float) -> bool:
+    """Whether a candidate that already has a verdict is evaluated again."""
+    if recommendation["status"] == "created":
+        return False
+    if now - recommendation["evaluated_at"] >= INDEX_REEVALUATE_AFTER_SECONDS:
+        return True
+    # Queries that became much more frequent may now pay for an index that was rejected
+    return recommendation["status"] == "rejected" and count >= recommendation["queries"] * INDEX_REEVALUATE_QUERY_GROWTH
+
+
+advisor = IndexAdvisor()
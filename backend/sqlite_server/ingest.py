@@ -0,0 +1,245 @@
+import logging
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Number of CSV rows parsed and inserted per batch; bounds peak memory of an ingest
+DEFAULT_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "50000"))
+
+# Applied to the freshly created database only: nothing else can see the file until
+# the upload finishes, and a failed ingest removes it, so durability is not needed
+INGEST_PRAGMAS = (
+    "PRAGMA journal_mode=OFF",
+    "PRAGMA synchronous=OFF",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+)
+
+
+def quote_identifier(name) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+# Date formats tried, in order, on the values of text columns; a column is a date
+# column only when every sampled value parses with the same one of them
+DATE_FORMATS = (
+    "%Y-%m-%d",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y/%m/%d",
+    "%m/%d/%Y",
+    "%d/%m/%Y",
+    "%m/%d/%Y %H:%M",
+    "%m/%d/%Y %H:%M:%S",
+    "%d-%m-%Y",
+    "%d.%m.%Y",
+    "%b %d, %Y",
+    "%d %b %Y",
+)
+
+# Currency symbols and spaces around a number; spaces inside a value (phone numbers) keep it text
+_LEADING_CURRENCY = r"^\s*([-+]?)\s*[$€£¥₹]?\s*"
+_TRAILING_CURRENCY = r"\s*[$€£¥₹]?\s*$"
+_THOUSANDS = r"[-+]?\d{1,3}(?:,\d{3})+(?:\.\d*)?"
+_LEADING_ZERO = r"[-+]?0\d+"
+
+
+def sqlite_type(dtype) -> str:
+    """Map a pandas dtype to the column type `df.to_sql` would have used."""
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "TIMESTAMP"
+    return "TEXT"
+
+
+def parse_numbers(series: pd.Series) -> pd.Series:
+    """Parse text such as "$1,234.50" or "(12)" as numbers; unparseable values become NaN."""
+    text = series.astype(str).str.strip()
+    negative = text.str.fullmatch(r"\(.*\)")
+    text = (
+        text.str.replace(r"^\((.*)\)$", r"\1", regex=True)
+        .str.replace(_LEADING_CURRENCY, r"\1", regex=True)
+        .str.replace(_TRAILING_CURRENCY, "", regex=True)
+    )
+    text = text.where(~text.str.fullmatch(_THOUSANDS), text.str.replace(",", "", regex=False))
+    numbers = pd.to_numeric(text, errors="coerce")
+    return numbers.where(~negative, -numbers)
+
+
+def _is_integral(numbers: pd.Series) -> bool:
+    return bool(((numbers % 1 == 0) & (numbers.abs() < 2 ** 63)).all())
+
+
+def parse_dates(series: pd.Series, date_format: str) -> pd.Series:
+    """Parse text as dates in `date_format`; unparseable values become NaT."""
+    return pd.to_datetime(series.astype(str).str.strip(), format=date_format, errors="coerce")
+
+
+def date_format_of(values: pd.Series):
+    """
+    The first of DATE_FORMATS that parses every value, or None. One format per column,
+    so "03/04/2024" is not read as month/day next to a "13/04/2024" read as day/month.
+    """
+    for date_format in DATE_FORMATS:
+        if parse_dates(values, date_format).notna().all():
+            return date_format
+    return None
+
+
+def infer_column_types(sample: pd.DataFrame) -> dict:
+    """
+    Infer the SQLite type of every column from a sample of its values.
+    Text columns become INTEGER or REAL when every sampled value is a number once
+    currency symbols and thousands separators are stripped, and DATE or TIMESTAMP
+    when every value is a date in the same one of DATE_FORMATS. Float columns that
+    only hold whole numbers (integers with missing values) become INTEGER.
+    Returns column -> (type, format of the dates held as text, or None)
+    """
+    column_types = {}
+    for column, dtype in sample.dtypes.items():
+        values = sample[column].dropna()
+        column_type = (sqlite_type(dtype), None)
+        if pd.api.types.is_float_dtype(dtype):
+            if len(values) and _is_integral(values):
+                column_type = ("INTEGER", None)
+        elif column_type[0] == "TEXT" and len(values):
+            values = values.astype(str).str.strip()
+            numbers = parse_numbers(values)
+            if numbers.notna().all():
+                # Codes with leading zeros (zip codes, ids) stay text
+                if not values.str.fullmatch(_LEADING_ZERO).any():
+                    column_type = ("INTEGER" if _is_integral(numbers) else "REAL", None)
+            else:
+                date_format = date_format_of(values)
+                if date_format is not None:
+                    parsed = parse_dates(values, date_format)
+                    is_date = bool((parsed == parsed.dt.normalize()).all())
+                    column_type = ("DATE" if is_date else "TIMESTAMP", date_format)
+        column_types[column] = column_type
+    return column_types
+
+
+def _normalized_column(series: pd.Series, column_type: tuple) -> pd.Series:
+    declared_type, date_format = column_type
+    values = series.astype(object)
+    if declared_type in ("INTEGER", "REAL") and not pd.api.types.is_numeric_dtype(series.dtype):
+        numbers = parse_numbers(series)
+    elif declared_type == "INTEGER" and pd.api.types.is_float_dtype(series.dtype):
+        numbers = series
+    elif pd.api.types.is_datetime64_any_dtype(series.dtype):
+        text_format = "%Y-%m-%d" if declared_type == "DATE" else "%Y-%m-%d %H:%M:%S"
+        return series.dt.strftime(text_format).astype(object)
+    elif date_format:
+        parsed = parse_dates(series, date_format)
+        text_format = "%Y-%m-%d" if declared_type == "DATE" else "%Y-%m-%d %H:%M:%S"
+        # Values that do not parse are kept as they are
+        return parsed.dt.strftime(text_format).astype(object).where(parsed.notna(), values)
+    else:
+        return values
+
+    if declared_type == "INTEGER":
+        integral = numbers.notna() & (numbers % 1 == 0)
+        parsed = numbers.where(integral).astype("Int64").astype(object)
+        return parsed.where(integral, values.where(numbers.isna(), numbers.astype(object)))
+    return numbers.astype(object).where(numbers.notna(), values)
+
+
+def create_table(conn, table_name: str, df: pd.DataFrame, column_types: dict = None) -> str:
+    """Create `table_name` with a schema inferred from `df` and return its INSERT statement."""
+    if column_types is None:
+        column_types = {column: (sqlite_type(dtype), None) for column, dtype in df.dtypes.items()}
+    columns_definition = ", ".join(
+        f"{quote_identifier(column)} {column_types[column][0]}"
+        for column in df.columns
+    )
+    conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(table_name)}")
+    conn.execute(f"CREATE TABLE {quote_identifier(table_name)} ({columns_definition})")
+
+    placeholders = ", ".join("?" for _ in df.columns)
+    return f"INSERT INTO {quote_identifier(table_name)} VALUES ({placeholders})"
+
+
+def typed_rows(df: pd.DataFrame, column_types: dict):
+    """Yield the rows of `df` normalized to the inferred column types, with missing values as None."""
+    normalized = pd.DataFrame(
+        {column: _normalized_column(df[column], column_types[column]) for column in df.columns},
+        index=df.index,
+    )
+    normalized.columns = df.columns
+    values = normalized.where(df.notna(), None)
+    return values.itertuples(index=False, name=None)
+
+
+def write_dataframe(conn, table_name: str, df: pd.DataFrame):
+    """Create `table_name` with the column types inferred from `df` and insert its rows."""
+    column_types = infer_column_types(df)
+    conn.executemany(create_table(conn, table_name, df, column_types), typed_rows(df, column_types))
+
+
+def analyze(conn):
+    """Gather planner statistics, sampling large tables so ingest stays fast."""
+    conn.execute("PRAGMA analysis_limit=1000")
+    conn.execute("ANALYZE")
+
+
+def stream_csv_to_sqlite(
+    source, sqlite_file_path: str, table_name: str = "data", chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> dict:
+    """
+    Stream a CSV into a new SQLite table without materializing the whole file.
+    Column types are inferred from the first chunk, every chunk is normalized to
+    them and bulk inserted inside a single transaction, and the table is analyzed.
+    Arguments:
+    :source: path or binary file object of the CSV
+    :sqlite_file_path: database to create
+    :table_name: table the rows are written to
+    :chunk_size: number of rows parsed and inserted per batch
+    Returns ingest statistics: rows, seconds and rows_per_sec
+    """
+    started = time.perf_counter()
+    rows = 0
+    conn = sqlite3.connect(sqlite_file_path, isolation_level=None)
+    try:
+        for pragma in INGEST_PRAGMAS:
+            conn.execute(pragma)
+
+        conn.execute("BEGIN")
+        insert_statement = None
+        column_types = None
+        for chunk in pd.read_csv(source, chunksize=chunk_size):
+            if insert_statement is None:
+                # The first chunk is the sample the column types are inferred from
+                column_types = infer_column_types(chunk)
+                insert_statement = create_table(conn, table_name, chunk, column_types)
+            conn.executemany(insert_statement, typed_rows(chunk, column_types))
+            rows += len(chunk)
+
+        if insert_statement is None:
+            raise ValueError("CSV file has no columns")
+        conn.execute("COMMIT")
+        analyze(conn)
+        # Readers share the database through WAL once the ingest is done
+        conn.execute("PRAGMA journal_mode=WAL")
+    except Exception:
+        conn.close()
+        if os.path.exists(sqlite_file_path):
+            os.remove(sqlite_file_path)
+        raise
+    conn.close()
+
+    seconds = time.perf_counter() - started
+    stats = {
+        "rows": rows,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(rows / seconds) if seconds > 0 else rows,
+    }
+    logger.info(f"Ingested {rows} rows into {sqlite_file_path} ({stats['rows_per_sec']} rows/sec)")
+    return stats
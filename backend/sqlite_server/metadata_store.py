@@ -1,78 +1,243 @@
+import json
 import os
 import sqlite3
+import threading
+import time
 
-def store_metadata(
-    file_uuid: str, project_uuid: str, user_uuid: str, upload_dir: str, file_path: str
-):
-    file_size = os.path.getsize(file_path)
-    file_name = os.path.basename(file_path)
-    metadata_db_path = os.path.join(upload_dir, "metadata.sqlite")
+from backend.sqlite_server.connection_pool import pool
+from backend.sqlite_server.ingest import quote_identifier
 
-    with sqlite3.connect(metadata_db_path) as conn:
-        cursor = conn.cursor()
+CLEANED_TABLE_NAME = "data_cleaned"
+ANALYSED_TABLE_NAME = "data_analysed"
 
-        # Create table if it doesn't exist
-        cursor.execute(
+# Rows of a file and of every file deduplicated onto the same database
+_SAME_CONTENT = (
+    "file_uuid = ? OR content_hash = (SELECT content_hash FROM file_metadata WHERE file_uuid = ?)"
+)
+
+_COLUMNS = (
+    "file_uuid", "project_uuid", "user_uuid", "file_name", "file_size", "row_count", "columns",
+    "tables", "table_rows", "is_cleaned", "is_analysed", "content_hash", "created_at", "updated_at",
+)
+
+
+class MetadataStore:
+    """
+    Catalog of uploaded files in `metadata.sqlite`, kept on one shared connection.
+    Sizes, tables, row counts and cleaning/analysis status are maintained when files
+    are written, so lookups never open or scan the file databases.
+    """
+
+    def __init__(self, metadata_db_path: str):
+        self.metadata_db_path = metadata_db_path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.metadata_db_path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._create_table(conn)
+            self._conn = conn
+        return self._conn
+
+    def _create_table(self, conn):
+        existing = [column[1] for column in conn.execute("PRAGMA table_info(file_metadata)").fetchall()]
+        if existing and "table_rows" not in existing:
+            # Catalogs written before file_uuid was the key: keep the latest row per file
+            conn.execute("ALTER TABLE file_metadata RENAME TO file_metadata_old")
+        conn.execute(
             """
             CREATE TABLE IF NOT EXISTS file_metadata (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                file_uuid TEXT NOT NULL,
+                file_uuid TEXT PRIMARY KEY,
                 project_uuid TEXT,
                 user_uuid TEXT,
                 file_name TEXT,
-                file_size INTEGER
+                file_size INTEGER,
+                row_count INTEGER,
+                columns TEXT,
+                tables TEXT,
+                table_rows TEXT,
+                is_cleaned INTEGER NOT NULL DEFAULT 0,
+                is_analysed INTEGER NOT NULL DEFAULT 0,
+                created_at REAL,
+                updated_at REAL,
+                content_hash TEXT
             )
             """
         )
-
-        # Insert or replace metadata
-        cursor.execute(
-            """
-            INSERT OR REPLACE INTO file_metadata (file_uuid, project_uuid, user_uuid, file_name, file_size)
-            VALUES (?, ?, ?, ?, ?)
-        """,
-            (file_uuid, project_uuid, user_uuid, file_name, file_size),
+        if existing and "table_rows" in existing and "content_hash" not in existing:
+            conn.execute("ALTER TABLE file_metadata ADD COLUMN content_hash TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS file_metadata_project ON file_metadata (project_uuid)")
+        conn.execute("CREATE INDEX IF NOT EXISTS file_metadata_content ON file_metadata (content_hash)")
+        # Deduplicated uploads share one converted database per content hash
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs (content_hash TEXT PRIMARY KEY, refcount INTEGER NOT NULL)"
         )
-
+        if existing and "table_rows" not in existing:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO file_metadata (file_uuid, project_uuid, user_uuid, file_name, file_size)
+                SELECT file_uuid, project_uuid, user_uuid, file_name, file_size FROM file_metadata_old ORDER BY id
+                """
+            )
+            conn.execute("DROP TABLE file_metadata_old")
         conn.commit()
 
+    def register_file(
+        self, file_uuid: str, file_name: str, project_uuid: str = None, user_uuid: str = None, content_hash: str = None
+    ):
+        """Record a new upload; its tables are cataloged by refresh_file."""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                """
+                INSERT INTO file_metadata (file_uuid, project_uuid, user_uuid, file_name, content_hash, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (file_uuid) DO UPDATE SET
+                    project_uuid = excluded.project_uuid, user_uuid = excluded.user_uuid,
+                    file_name = excluded.file_name, content_hash = excluded.content_hash,
+                    updated_at = excluded.updated_at
+                """,
+                (file_uuid, project_uuid, user_uuid, file_name, content_hash, now, now),
+            )
+            conn.commit()
+
+    def blob_refcount(self, content_hash: str) -> int:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT refcount FROM blobs WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+        return row[0] if row else 0
 
-def query_metadata(file_uuid: str, upload_dir: str):
-    metadata_db_path = os.path.join(upload_dir, "metadata.sqlite")
+    def add_blob_reference(self, content_hash: str):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT INTO blobs VALUES (?, 1) ON CONFLICT (content_hash) DO UPDATE SET refcount = refcount + 1",
+                (content_hash,),
+            )
+            conn.commit()
 
-    with sqlite3.connect(metadata_db_path) as conn:
-        cursor = conn.cursor()
+    def release_blob(self, content_hash: str) -> int:
+        """Drop one reference to a blob and return how many remain."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("UPDATE blobs SET refcount = refcount - 1 WHERE content_hash = ?", (content_hash,))
+            row = conn.execute("SELECT refcount FROM blobs WHERE content_hash = ?", (content_hash,)).fetchone()
+            remaining = row[0] if row else 0
+            if remaining <= 0:
+                conn.execute("DELETE FROM blobs WHERE content_hash = ?", (content_hash,))
+            conn.commit()
+        return max(remaining, 0)
 
-        cursor.execute(
-            """
-            SELECT project_uuid, user_uuid, file_name, file_size FROM file_metadata
-            WHERE file_uuid = ?
-        """,
-            (file_uuid,),
+    def refresh_file(self, file_uuid: str, db_path: str, written_table: str = None):
+        """
+        Update the catalog entry of a file after it was written. Only the written table
+        (and tables not counted yet) are counted; the other counts are kept.
+        """
+        # Files sharing a deduplicated database share their counts
+        with self._lock:
+            row = self._connection().execute(
+                f"SELECT table_rows FROM file_metadata WHERE ({_SAME_CONTENT}) AND table_rows IS NOT NULL "
+                "ORDER BY updated_at DESC LIMIT 1",
+                (file_uuid, file_uuid),
+            ).fetchone()
+        table_rows = json.loads(row[0]) if row and row[0] else {}
+
+        with pool.connection(db_path) as file_conn:
+            tables = [
+                table[0]
+                for table in file_conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite\\_%' ESCAPE '\\' "
+                    "AND name NOT LIKE '\\_%' ESCAPE '\\' ORDER BY rowid"
+                ).fetchall()
+            ]
+            table_rows = {
+                table: (
+                    table_rows[table]
+                    if table in table_rows and table != written_table
+                    else file_conn.execute(f"SELECT COUNT(*) FROM {quote_identifier(table)}").fetchone()[0]
+                )
+                for table in tables
+            }
+            columns = [
+                column[1] for column in file_conn.execute("PRAGMA table_info(data)").fetchall()
+            ]
+
+        real_path = os.path.realpath(db_path)
+        file_size = sum(
+            os.path.getsize(path) for path in (real_path, f"{real_path}-wal") if os.path.exists(path)
+        )
+        values = (
+            file_size,
+            table_rows.get("data"),
+            json.dumps(columns),
+            json.dumps(tables),
+            json.dumps(table_rows),
+            int(any(CLEANED_TABLE_NAME in table for table in tables)),
+            int(ANALYSED_TABLE_NAME in tables),
+            time.time(),
         )
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                """
+                INSERT INTO file_metadata (file_uuid, file_size, row_count, columns, tables, table_rows,
+                                           is_cleaned, is_analysed, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (file_uuid) DO UPDATE SET
+                    file_size = excluded.file_size, row_count = excluded.row_count,
+                    columns = excluded.columns, tables = excluded.tables,
+                    table_rows = excluded.table_rows, is_cleaned = excluded.is_cleaned,
+                    is_analysed = excluded.is_analysed, updated_at = excluded.updated_at
+                """,
+                (file_uuid, *values, time.time()),
+            )
+            conn.execute(
+                f"""
+                UPDATE file_metadata SET file_size = ?, row_count = ?, columns = ?, tables = ?, table_rows = ?,
+                    is_cleaned = ?, is_analysed = ?, updated_at = ?
+                WHERE {_SAME_CONTENT}
+                """,
+                (*values, file_uuid, file_uuid),
+            )
+            conn.commit()
+
+    def remove_file(self, file_uuid: str):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM file_metadata WHERE file_uuid = ?", (file_uuid,))
+            conn.commit()
+
+    def query_many(self, file_uuids: list[str]) -> dict:
+        """Catalog entries of several files in one indexed lookup, keyed by file_uuid."""
+        if not file_uuids:
+            return {}
+        placeholders = ", ".join("?" for _ in file_uuids)
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM file_metadata WHERE file_uuid IN ({placeholders})",
+                list(file_uuids),
+            ).fetchall()
+        results = {}
+        for row in rows:
+            result = dict(zip(_COLUMNS, row))
+            for key in ("columns", "tables"):
+                result[key] = json.loads(result[key]) if result[key] else []
+            result["table_rows"] = json.loads(result["table_rows"]) if result["table_rows"] else {}
+            result["is_cleaned"] = bool(result["is_cleaned"])
+            result["is_analysed"] = bool(result["is_analysed"])
+            results[result["file_uuid"]] = result
+        return results
+
+    def query(self, file_uuid: str):
+        return self.query_many([file_uuid]).get(file_uuid)
 
-        result = cursor.fetchone()
-        file_path = os.path.join(upload_dir, f"{file_uuid}.sqlite")
-        project_uuid, user_uuid, file_name, file_size = result
-
-    with sqlite3.connect(file_path) as conn:
-        cursor = conn.cursor()
-        # fetch n_rows from the file
-        cursor.execute("SELECT COUNT(*) FROM data;")
-        row_count = cursor.fetchone()[0]
-
-        # fetch columns list
-        cursor.execute("PRAGMA table_info(data);")
-        columns = cursor.fetchall()
-
-    result = {
-        "file_uuid": file_uuid,
-        "project_uuid": project_uuid,
-        "user_uuid": user_uuid,
-        "file_name": file_name,
-        "file_size": file_size,
-        "row_count": row_count,
-        "columns": [column[1] for column in columns],
-    }
-
-    return result
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from urllib.parse import quote
+
+from backend.sqlite_server.connection_pool import pool
+from backend.sqlite_server.ingest import quote_identifier
+from backend.sqlite_server.sidecar import database_version, stamp_table_version
+
+logger = logging.getLogger(__name__)
+
+PROJECT_META_TABLE = "_project_meta"
+PROJECT_MEMBERS_TABLE = "_project_members"
+PROJECT_VIEWS_TABLE = "_project_views"
+
+# SQLite's default compile-time limit on attached databases; larger projects
+# fall back to copying the member tables into the project database
+MAX_ATTACHED = 10
+
+_build_locks = {}
+_build_locks_guard = threading.Lock()
+
+
+def _build_lock(project_path: str) -> threading.Lock:
+    with _build_locks_guard:
+        return _build_locks.setdefault(os.path.realpath(project_path), threading.Lock())
+
+
+def _member_tables(source_path: str, table_filter: str) -> list[str]:
+    with pool.connection(source_path) as conn:
+        tables = conn.execute("SELECT name FROM sqlite_master WHERE type='table';").fetchall()
+    return [table[0] for table in tables if table_filter in table[0]]
+
+
+def stored_fingerprint(project_path: str):
+    if not os.path.exists(project_path):
+        return None
+    try:
+        with pool.connection(project_path) as conn:
+            row = conn.execute(
+                f"SELECT value FROM {PROJECT_META_TABLE} WHERE key = 'fingerprint'"
+            ).fetchone()
+        return row[0] if row else None
+    except sqlite3.Error:
+        return None
+
+
+def project_fingerprint(members: list) -> str:
+    """
+    Fingerprint of a project's members and their tables. Attached members are read
+    live, so their data versions only matter when the tables have to be copied.
+    """
+    copy_mode = len(members) > MAX_ATTACHED
+    parts = [
+        [position, os.path.realpath(source_path), tables,
+         database_version(source_path) if copy_mode else None]
+        for position, source_path, tables in members
+    ]
+    return hashlib.sha1(json.dumps(parts).encode("utf-8")).hexdigest()
+
+
+def _write_meta(conn, fingerprint: str, mode: str):
+    conn.execute(f"CREATE TABLE {PROJECT_META_TABLE} (key TEXT PRIMARY KEY, value TEXT)")
+    conn.executemany(
+        f"INSERT INTO {PROJECT_META_TABLE} VALUES (?, ?)",
+        [("fingerprint", fingerprint), ("mode", mode)],
+    )
+
+
+def _write_attached(conn, members: list):
+    conn.execute(f"CREATE TABLE {PROJECT_MEMBERS_TABLE} (alias TEXT PRIMARY KEY, db_path TEXT NOT NULL)")
+    conn.execute(
+        f"CREATE TABLE {PROJECT_VIEWS_TABLE} (view_name TEXT PRIMARY KEY, alias TEXT NOT NULL, table_name TEXT NOT NULL)"
+    )
+    for position, source_path, tables in members:
+        alias = f"f{position}"
+        conn.execute(
+            f"INSERT INTO {PROJECT_MEMBERS_TABLE} VALUES (?, ?)",
+            (alias, os.path.realpath(source_path)),
+        )
+        conn.executemany(
+            f"INSERT OR IGNORE INTO {PROJECT_VIEWS_TABLE} VALUES (?, ?, ?)",
+            [(table + str(position), alias, table) for table in tables],
+        )
+
+
+def _write_copied(conn, members: list):
+    # Copy one member at a time inside SQLite, without materializing rows in Python
+    for position, source_path, tables in members:
+        conn.execute("ATTACH DATABASE ? AS source", (source_path,))
+        try:
+            for table in tables:
+                columns_info = conn.execute(
+                    f"PRAGMA source.table_info({quote_identifier(table)})"
+                ).fetchall()
+                columns_definition = ', '.join([f'"{column[1]}" {column[2]}' for column in columns_info])
+                target = table + str(position)
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {target} ({columns_definition})")
+                conn.execute(f"INSERT INTO {quote_identifier(target)} SELECT * FROM source.{quote_identifier(table)}")
+                # Copies of a rebuilt project are new tables to the data derived from them
+                stamp_table_version(conn, target)
+            conn.commit()
+        finally:
+            conn.execute("DETACH DATABASE source")
+
+
+def build_project_database(project_path: str, sources: list, table_filter: str) -> bool:
+    """
+    Make sure the project database at `project_path` reflects its member files.
+    Arguments:
+    :project_path: path of the project database
+    :sources: (position, source database path) of each member file
+    :table_filter: only member tables whose name contains it are exposed
+    Projects of up to MAX_ATTACHED files are thin databases whose pooled connections
+    ATTACH the member files and expose their tables as views, so no data is copied.
+    The database is only rebuilt when the fingerprint of its members changes.
+    Returns whether the database was rebuilt.
+    """
+    with _build_lock(project_path):
+        members = [
+            (position, source_path, _member_tables(source_path, table_filter))
+            for position, source_path in sources
+        ]
+        fingerprint = project_fingerprint(members)
+        if stored_fingerprint(project_path) == fingerprint:
+            return False
+
+        mode = "copy" if len(members) > MAX_ATTACHED else "attach"
+        temp_path = f"{project_path}.{uuid.uuid4().hex}.tmp"
+        conn = sqlite3.connect(temp_path)
+        try:
+            _write_meta(conn, fingerprint, mode)
+            if mode == "attach":
+                _write_attached(conn, members)
+            else:
+                _write_copied(conn, members)
+            conn.commit()
+            conn.close()
+
+            pool.discard(project_path)
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(project_path + suffix):
+                    os.remove(project_path + suffix)
+            os.replace(temp_path, project_path)
+        finally:
+            conn.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    logger.info(f"Built project database {project_path} ({mode} mode, {len(members)} files)")
+    return True
+
+
+_members_by_version = {}  # project path -> (database version, member paths)
+
+
+def _attached_members(project_path: str, version: tuple) -> list:
+    cached = _members_by_version.get(project_path)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    members = []
+    conn = sqlite3.connect(f"file:{quote(project_path)}?mode=ro", uri=True)
+    try:
+        members = [
+            row[0] for row in conn.execute(f"SELECT db_path FROM {PROJECT_MEMBERS_TABLE}").fetchall()
+        ]
+    except sqlite3.Error:
+        # Plain databases and copied projects have no attached members
+        pass
+    finally:
+        conn.close()
+    _members_by_version[project_path] = (version, members)
+    return members
+
+
+def combined_version(db_path: str) -> tuple:
+    """Version of a database including the member files a project database attaches."""
+    key = os.path.realpath(db_path)
+    version = database_version(key)
+    members = _attached_members(key, version) if version[0] is not None else []
+    return version, tuple(database_version(member) for member in members)
+
+
+def attach_project_members(conn):
+    """Pool open hook: attach the member files of a project database and create its views."""
+    is_project = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (PROJECT_MEMBERS_TABLE,)
+    ).fetchone()
+    if not is_project:
+        return
+
+    members = conn.execute(f"SELECT alias, db_path FROM {PROJECT_MEMBERS_TABLE}").fetchall()
+    views = conn.execute(f"SELECT view_name, alias, table_name FROM {PROJECT_VIEWS_TABLE}").fetchall()
+    for alias, db_path in members:
+        conn.execute(
+            f"ATTACH DATABASE ? AS {quote_identifier(alias)}", (f"file:{quote(db_path)}?mode=ro",)
+        )
+    for view_name, alias, table_name in views:
+        conn.execute(
+            f"CREATE TEMP VIEW {quote_identifier(view_name)} AS "
+            f"SELECT * FROM {quote_identifier(alias)}.{quote_identifier(table_name)}"
+        )
+
+
+pool.add_open_hook(attach_project_members)
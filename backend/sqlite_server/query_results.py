@@ -0,0 +1,125 @@
+import base64
+import hashlib
+import json
+import os
+
+# Upper bound on the rows a single /execute-query response (or page) may carry
+QUERY_ROW_LIMIT = int(os.getenv("QUERY_ROW_LIMIT", "100000"))
+
+# Rows pulled from the SQLite cursor per fetchmany call
+FETCH_SIZE = 1000
+
+_SQLITE_TYPE_NAMES = {int: "INTEGER", float: "REAL", str: "TEXT", bytes: "BLOB"}
+
+
+def _query_fingerprint(query: str) -> str:
+    return hashlib.sha1(query.encode("utf-8")).hexdigest()[:16]
+
+
+def encode_cursor(query: str, offset: int) -> str:
+    """Opaque continuation token pointing `offset` rows into the result of `query`."""
+    payload = json.dumps({"q": _query_fingerprint(query), "o": offset}).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii")
+
+
+def decode_cursor(token: str, query: str) -> int:
+    """Return the row offset stored in `token`; raises ValueError if it doesn't belong to `query`."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+        offset = int(payload["o"])
+        fingerprint = payload["q"]
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if fingerprint != _query_fingerprint(query) or offset < 0:
+        raise ValueError("Cursor does not belong to this query")
+    return offset
+
+
+def execute_from(cursor, query: str, token: str = None, rewritten: str = None) -> int:
+    """
+    Execute `query` (or an equivalent `rewritten` form of it) and skip the rows
+    already returned before `token`. Returns the offset.
+    """
+    offset = decode_cursor(token, query) if token else 0
+    cursor.execute(rewritten or query)
+    skipped = 0
+    while skipped < offset:
+        rows = cursor.fetchmany(min(FETCH_SIZE, offset - skipped))
+        if not rows:
+            break
+        skipped += len(rows)
+    return offset
+
+
+def row_size(row) -> int:
+    """Approximate encoded size of a result row."""
+    return sum(len(value) if isinstance(value, (str, bytes)) else 8 for value in row) + 2 * len(row)
+
+
+def fetch_rows(cursor, limit: int, max_bytes: int = None) -> tuple:
+    """
+    Fetch up to `limit` rows in FETCH_SIZE batches, stopping once they exceed `max_bytes`.
+    Returns the rows and "max_bytes" when the byte limit stopped the fetch, else None.
+    Rows of the batch left behind by the byte limit are gone from the cursor, so
+    callers must not probe it for more rows in that case.
+    """
+    rows = []
+    size = 0
+    while len(rows) < limit:
+        batch = cursor.fetchmany(min(FETCH_SIZE, limit - len(rows)))
+        if not batch:
+            break
+        for row in batch:
+            if max_bytes is not None:
+                size += row_size(row)
+                if size > max_bytes and rows:
+                    return rows, "max_bytes"
+            rows.append(list(row))
+    return rows, None
+
+
+def has_more_rows(cursor) -> bool:
+    return cursor.description is not None and cursor.fetchone() is not None
+
+
+def describe_columns(cursor, rows: list) -> tuple:
+    """Column names from the cursor and SQLite storage types of the first non-null values."""
+    if cursor.description is None:
+        return [], []
+    names = [column[0] for column in cursor.description]
+    types = []
+    for index in range(len(names)):
+        value = next((row[index] for row in rows if row[index] is not None), None)
+        types.append(_SQLITE_TYPE_NAMES.get(type(value), "NULL"))
+    return names, types
+
+
+def iter_ndjson(
+    cursor, query: str, offset: int, limit: int, first_rows: list, max_bytes: int = None, limit_reason: str = "page_size"
+):
+    """
+    Yield the result as NDJSON, one JSON array per row, pulling rows with fetchmany.
+    When the row limit (or `max_bytes`) cuts the result off a final
+    {"truncated": true, "truncated_reason": ..., "next_cursor": ...} line tells the
+    client why and where to resume.
+    """
+    sent = 0
+    sent_bytes = 0
+    rows = first_rows
+    reason = None
+    while rows:
+        block = "".join(json.dumps(row, default=str) + "\n" for row in rows)
+        yield block
+        sent += len(rows)
+        sent_bytes += len(block)
+        if sent >= limit:
+            reason = limit_reason
+            break
+        if max_bytes is not None and sent_bytes >= max_bytes:
+            reason = "byte_limit"
+            break
+        rows, _ = fetch_rows(cursor, min(FETCH_SIZE, limit - sent))
+
+    if reason and has_more_rows(cursor):
+        trailer = {"truncated": True, "truncated_reason": reason, "next_cursor": encode_cursor(query, offset + sent)}
+        yield json.dumps(trailer) + "\n"
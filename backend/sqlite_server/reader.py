@@ -0,0 +1,215 @@
+"""
+Read-only access to the uploaded databases: schemas and query pages through the
+connection pool and its caches. Importing it has no side effects beyond registering
+the pool's open hooks, so the ai-server can read the shared uploads directory in
+process. Writes, the index advisor and rollup maintenance stay in the sqlite-server.
+"""
+import json
+import logging
+import os
+import sqlite3
+
+from fastapi import HTTPException
+
+from backend.sqlite_server.column_stats import describe_table_stats, read_table_stats
+from backend.sqlite_server.connection_pool import pool
+from backend.sqlite_server.governor import QueryBudget, QueryTimeout, governor
+from backend.sqlite_server.ingest import quote_identifier
+from backend.sqlite_server.projects import PROJECT_VIEWS_TABLE
+from backend.sqlite_server.query_results import (
+    QUERY_ROW_LIMIT,
+    describe_columns,
+    encode_cursor,
+    execute_from,
+    fetch_rows,
+    has_more_rows,
+)
+from backend.sqlite_server.result_cache import result_cache
+from backend.sqlite_server.rollups import rollups
+from backend.sqlite_server.schema_cache import schema_cache
+
+logger = logging.getLogger(__name__)
+
+# Shared with the ai-server when its DatabaseManager runs in direct mode
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+CLEANED_TABLE_NAME = "data_cleaned"
+# Example rows per table in schema descriptions, fewer when column statistics are available
+SCHEMA_EXAMPLE_ROWS = 10
+SCHEMA_EXAMPLE_ROWS_WITH_STATS = 3
+
+
+def db_path_for(uuid: str) -> str:
+    return os.path.join(UPLOAD_DIR, f"{uuid}.sqlite")
+
+
+def table_exists(conn, table_name):
+    cursor = conn.cursor()
+    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table';")
+    tables = cursor.fetchall()
+
+    has_cleaned_table = False
+    for table in tables:
+        table_name, create_statement = table
+        if table_name in table_name:
+            has_cleaned_table = True
+
+    if has_cleaned_table is False:
+        raise HTTPException(status_code=404, detail=f"Cleaned Table does not exist in the database")
+
+    return True
+
+
+
+def execute_query(cursor, db_path: str, query: str, cursor_token: str = None) -> int:
+    """
+    Execute a query on a pooled cursor, answering it from a rollup table when one
+    can. Returns the offset.
+    """
+    rewritten = rollups.rewrite(cursor.connection, db_path, query)
+    offset = None
+    if rewritten is not None:
+        try:
+            offset = execute_from(cursor, query, cursor_token, rewritten)
+        except sqlite3.DatabaseError:
+            logger.warning(f"Rollup rewrite failed, running the original query: {rewritten}")
+    if offset is None:
+        offset = execute_from(cursor, query, cursor_token)
+    return offset
+
+
+
+def _truncation_reason(stop_reason: str, limit: int, budget: QueryBudget) -> str:
+    if stop_reason == "max_bytes":
+        return "byte_limit"
+    return "row_limit" if limit == budget.max_rows else "page_size"
+
+
+
+def run_query(
+    db_path: str, query: str, limit: int = QUERY_ROW_LIMIT, cursor_token: str = None, caller: str = None
+) -> dict:
+    """
+    Execute a query on a pooled connection and return one page of its results,
+    within the time, row and byte budget of `caller`.
+    """
+    budget = governor.budget(caller)
+    limit = min(limit, budget.max_rows)
+    conn = pool.acquire(db_path)
+    cursor = conn.cursor()
+    try:
+        with governor.deadline(conn, budget):
+            # Execute the SQL query, resuming after the rows already sent
+            offset = execute_query(cursor, db_path, query, cursor_token)
+            rows, stop_reason = fetch_rows(cursor, limit, budget.max_bytes)
+            columns, column_types = describe_columns(cursor, rows)
+            # The byte limit leaves rows behind that were already taken from the cursor
+            truncated = stop_reason is not None or has_more_rows(cursor)
+    except QueryTimeout:
+        governor.record_cutoff(caller, "timeout", query)
+        raise
+    finally:
+        cursor.close()
+        pool.release(db_path, conn)
+
+    truncated_reason = _truncation_reason(stop_reason, limit, budget) if truncated else None
+    if truncated_reason in ("row_limit", "byte_limit"):
+        governor.record_cutoff(caller, truncated_reason, query)
+    return {
+        "results": rows,
+        "columns": columns,
+        "column_types": column_types,
+        "truncated": truncated,
+        "truncated_reason": truncated_reason,
+        "next_cursor": encode_cursor(query, offset + len(rows)) if truncated else None,
+    }
+
+
+
+def query_response(
+    db_path: str, query: str, limit: int = QUERY_ROW_LIMIT, cursor_token: str = None, caller: str = None
+) -> bytes:
+    """JSON body of one page of a query's results, served from the versioned result cache."""
+    return result_cache.get(
+        db_path,
+        query,
+        (limit, cursor_token, governor.budget(caller)),
+        lambda: _encode_json(run_query(db_path, query, limit, cursor_token, caller)),
+    )
+
+
+
+def _encode_json(content) -> bytes:
+    # Same encoding as FastAPI's JSONResponse
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+
+def read_schema(db_path: str) -> str:
+    """Schema description of a database, served from the versioned schema cache."""
+    return schema_cache.get(db_path, lambda: _read_schema(db_path))
+
+
+def _table_stats(conn, table_name: str, table_type: str):
+    if table_type != "view":
+        return read_table_stats(conn, table_name)
+    # Project views read the statistics stored in the attached member file
+    try:
+        member = conn.execute(
+            f"SELECT alias, table_name FROM {PROJECT_VIEWS_TABLE} WHERE view_name = ?", (table_name,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return read_table_stats(conn, member[1], schema=member[0]) if member else None
+
+
+def _read_schema(db_path: str) -> str:
+    # Borrow a pooled read-only connection
+    conn = pool.acquire(db_path)
+    cursor = None
+    try:
+        table_exists(conn=conn, table_name=CLEANED_TABLE_NAME)
+        cursor = conn.cursor()
+
+        # Get the table schema from sqlite_master, plus the views of attached project files
+        cursor.execute(
+            "SELECT name, sql, type FROM sqlite_master WHERE type='table' "
+            "UNION ALL SELECT name, sql, type FROM sqlite_temp_master WHERE type='view';"
+        )
+        tables = cursor.fetchall()
+
+        schema = []
+
+        # Function to process each table and fetch its schema and example rows
+        for table in tables:
+            table_name, create_statement, table_type = table
+            if CLEANED_TABLE_NAME in table_name:
+                if table_type == "view":
+                    # Describe views like the tables they expose
+                    columns_info = cursor.execute(f"PRAGMA table_info({quote_identifier(table_name)})").fetchall()
+                    columns_definition = ', '.join([f'"{column[1]}" {column[2]}' for column in columns_info])
+                    create_statement = f"CREATE TABLE {table_name} ({columns_definition})"
+                schema.append(f"Table: {table_name}")
+                schema.append(f"CREATE statement: {create_statement}\n")
+
+                # Precomputed column statistics describe the table better than raw rows
+                stats = _table_stats(conn, table_name, table_type)
+                if stats:
+                    schema.append("Column statistics:")
+                    schema.extend(describe_table_stats(stats))
+                    schema.append("")
+
+                # Fetch only a few rows from the table as this is an example schema for model to generate sql query
+                example_rows = SCHEMA_EXAMPLE_ROWS_WITH_STATS if stats else SCHEMA_EXAMPLE_ROWS
+                cursor.execute(f"SELECT * FROM '{table_name}' LIMIT {example_rows};")
+                rows = cursor.fetchall()
+                if rows:
+                    schema.append("Example rows:")
+                    for row in rows:
+                        schema.append(str(row))
+                schema.append("")  # Blank line between tables
+
+        return "\n".join(schema)
+    finally:
+        if cursor is not None:
+            cursor.close()
+        pool.release(db_path, conn)
@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import markdown2
+
+from backend.sqlite_server.connection_pool import pool
+
+logger = logging.getLogger(__name__)
+
+# Rendered PDFs are cached on disk, keyed by the sha256 of their markdown
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", os.path.join("uploads", "_reports"))
+REPORT_CACHE_MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Processes running markdown2 + WeasyPrint, so layout never holds the GIL of the server
+REPORT_RENDER_PROCESSES = int(os.getenv("REPORT_RENDER_PROCESSES", "2"))
+
+os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+
+_executor = None
+_executor_lock = threading.Lock()
+_inflight = {}  # cache path -> future of the render writing it
+
+
+def _styled_html(markdown_content: str) -> str:
+    # Convert markdown to HTML
+    html_content = markdown2.markdown(markdown_content)
+
+    # Add some basic styling
+    return f"""
+    <html>
+        <head>
+            <style>
+                body {{ font-family: Arial, sans-serif; line-height: 1.6; padding: 20px; }}
+                h1, h2, h3 {{ color: #333; }}
+                table {{ border-collapse: collapse; width: 100%; }}
+                th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
+                th {{ background-color: #f2f2f2; }}
+            </style>
+        </head>
+        <body>
+            {html_content}
+        </body>
+    </html>
+    """
+
+
+def render_pdf_file(markdown_content: str, path: str):
+    """Render markdown to a PDF at `path`. Runs in a render process; the file is swapped in atomically."""
+    # Only render processes load WeasyPrint and its native libraries
+    from weasyprint import HTML
+
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        HTML(string=_styled_html(markdown_content)).write_pdf(temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _render_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn, since forking a threaded server can copy held locks into the child
+            _executor = ProcessPoolExecutor(
+                max_workers=REPORT_RENDER_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def report_cache_path(markdown_content: str) -> str:
+    digest = hashlib.sha256(markdown_content.encode("utf-8")).hexdigest()
+    return os.path.join(REPORT_CACHE_DIR, f"{digest}.pdf")
+
+
+def _evict():
+    """Remove the least recently used PDFs until the cache fits REPORT_CACHE_MAX_BYTES."""
+    entries = []
+    for entry in os.scandir(REPORT_CACHE_DIR):
+        if entry.name.endswith(".pdf"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries)[:-1]:
+        if total <= REPORT_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except FileNotFoundError:
+            pass
+
+
+def _on_rendered(path: str, future):
+    with _executor_lock:
+        _inflight.pop(path, None)
+    if future.exception() is not None:
+        logger.error(f"Failed to render report {path}: {future.exception()}")
+        return
+    _evict()
+
+
+def schedule_render(markdown_content: str):
+    """
+    Make sure the PDF of a report is cached, rendering it in a render process if needed.
+    Returns the cache path and the future of a pending render (None on a cache hit).
+    """
+    path = report_cache_path(markdown_content)
+    executor = _render_executor()
+    with _executor_lock:
+        future = _inflight.get(path)
+        if future is not None:
+            return path, future
+        if os.path.exists(path):
+            # Mark as recently used for eviction
+            os.utime(path)
+            return path, None
+        future = _inflight[path] = executor.submit(render_pdf_file, markdown_content, path)
+    future.add_done_callback(lambda done: _on_rendered(path, done))
+    return path, future
+
+
+def report_markdown(db_path: str, table_name: str) -> str:
+    with pool.connection(db_path) as conn:
+        row = conn.execute(f"SELECT markdown_content FROM {table_name} ORDER BY id LIMIT 1").fetchone()
+    if row is None:
+        raise ValueError("No analysis report has been stored for this file")
+    return row[0]
+
+
+def report_pdf(db_path: str, table_name: str) -> str:
+    """Path of the rendered PDF of a database's analysis report, waiting for a pending render."""
+    path, future = schedule_render(report_markdown(db_path, table_name))
+    if future is not None:
+        future.result()
+    return path
+
+
+def refresh_report(db_path: str, table_name: str):
+    """Best-effort eager render after a report is stored; downloads render on a miss."""
+    try:
+        schedule_render(report_markdown(db_path, table_name))
+    except Exception:
+        logger.exception(f"Failed to schedule the report render of {db_path}")
+
+
+def shutdown():
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,116 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from backend.sqlite_server.connection_pool import pool_key
+from backend.sqlite_server.projects import combined_version
+
+# Total size of the cached (JSON encoded) query results, and the largest single result kept
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESULT_CACHE_MAX_ENTRY_BYTES", str(8 * 1024 * 1024)))
+
+# String literals and quoted identifiers are kept verbatim by normalize_sql
+_QUOTED = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])""")
+# Queries whose result can change without the database changing
+_NONDETERMINISTIC = re.compile(
+    r"\b(random|randomblob|changes|total_changes|last_insert_rowid)\s*\(|"
+    r"\bcurrent_(date|time|timestamp)\b|'now'",
+    re.IGNORECASE,
+)
+
+
+def normalize_sql(query: str) -> str:
+    """Collapse whitespace outside quotes and drop trailing semicolons."""
+    parts = _QUOTED.split(query.strip().rstrip(";").strip())
+    return "".join(
+        part if index % 2 else re.sub(r"\s+", " ", part)
+        for index, part in enumerate(parts)
+    ).strip()
+
+
+def is_cacheable(query: str) -> bool:
+    return _NONDETERMINISTIC.search(query) is None
+
+
+class ResultCache:
+    """
+    Encoded /execute-query responses in an LRU bounded by total bytes. Entries are
+    keyed by database path, normalized SQL and page, and validated against the
+    current version of the database (and of the files a project attaches), so
+    rewriting a table makes them stale.
+    """
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES, max_entry_bytes: int = RESULT_CACHE_MAX_ENTRY_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries = OrderedDict()  # (pool key, sql, page) -> (version, body)
+        self._keys_by_db = {}  # pool key -> keys of its entries
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self.evictions = 0
+
+    def _remove(self, key):
+        _, body = self._entries.pop(key)
+        self._bytes -= len(body)
+        keys = self._keys_by_db[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_db[key[0]]
+
+    def get(self, db_path: str, query: str, page: tuple, loader) -> bytes:
+        """Return the cached response of `query`, calling `loader()` when it is missing or stale."""
+        if not is_cacheable(query):
+            with self._lock:
+                self.uncacheable += 1
+            return loader()
+
+        db_key = pool_key(db_path)
+        key = (db_key, normalize_sql(query), page)
+        # Read the version before loading so a concurrent write makes the entry stale
+        version = combined_version(db_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        body = loader()
+        if len(body) > self.max_entry_bytes:
+            return body
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (version, body)
+            self._keys_by_db.setdefault(db_key, set()).add(key)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return body
+
+    def invalidate(self, db_path: str):
+        with self._lock:
+            for key in list(self._keys_by_db.get(pool_key(db_path), ())):
+                self._remove(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "uncacheable": self.uncacheable,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+result_cache = ResultCache()
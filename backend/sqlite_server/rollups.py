@@ -0,0 +1,566 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+
+from backend.sqlite_server.connection_pool import pool, pool_key
+from backend.sqlite_server.ingest import quote_identifier
+from backend.sqlite_server.projects import PROJECT_MEMBERS_TABLE, PROJECT_VIEWS_TABLE
+from backend.sqlite_server.sidecar import database_version, read_table_version, table_version
+
+logger = logging.getLogger(__name__)
+
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "1") == "1"
+# Seconds between background builds and refreshes of rollup tables
+ROLLUP_INTERVAL_SECONDS = int(os.getenv("ROLLUP_INTERVAL_SECONDS", "60"))
+# Logged executions of an aggregate shape before it gets a rollup
+ROLLUP_MIN_QUERY_COUNT = int(os.getenv("ROLLUP_MIN_QUERY_COUNT", "3"))
+# Rollups keeping more than this fraction of the base table's rows are dropped again
+ROLLUP_MAX_ROW_RATIO = float(os.getenv("ROLLUP_MAX_ROW_RATIO", "0.5"))
+# Distinct aggregate shapes remembered per database
+SHAPE_LOG_SIZE = 100
+
+ROLLUP_SCHEMA = "_rollups"
+ROLLUP_META_TABLE = "_rollup_meta"
+ROW_COUNT_COLUMN = "__count__"
+
+_AGGREGATES = ("SUM", "COUNT", "AVG", "MIN", "MAX", "TOTAL")
+_AGGREGATE_NAMES = _AGGREGATES + ("GROUP_CONCAT", "STRING_AGG", "JSON_GROUP_ARRAY", "JSON_GROUP_OBJECT")
+_NAME = r'(?:"(?:[^"]|"")+"|\[[^\]]+\]|`[^`]+`|[A-Za-z_]\w*)'
+_AGGREGATE_CALL = re.compile(rf"\b({'|'.join(_AGGREGATES)})\s*\(\s*(\*|{_NAME})\s*\)", re.IGNORECASE)
+_ANY_AGGREGATE = re.compile(rf"\b(?:{'|'.join(_AGGREGATE_NAMES)})\s*\(", re.IGNORECASE)
+_UNSUPPORTED = re.compile(r"\b(?:JOIN|UNION|INTERSECT|EXCEPT|OVER|WITH)\b", re.IGNORECASE)
+_FROM = re.compile(rf"\bFROM\s+((?:main\.)?{_NAME})(\s+(?:AS\s+)?(?!WHERE\b|GROUP\b|ORDER\b|LIMIT\b|HAVING\b)\w+)?", re.IGNORECASE)
+_SELECT_LIST = re.compile(r"^\s*SELECT\s+(?:DISTINCT\s+|ALL\s+)?(.*?)\bFROM\b", re.IGNORECASE | re.DOTALL)
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_IDENTIFIER = re.compile(r'"((?:[^"]|"")+)"|\[([^\]]+)\]|`([^`]+)`|\b([A-Za-z_]\w*)\b(?!\s*\()')
+_ALIAS = re.compile(rf"(?:\bAS\s+|[)\]\"`\w]\s+)(?!END\s*$)({_NAME})\s*$", re.IGNORECASE)
+
+
+def _unquote(name: str) -> str:
+    if name[:1] in ('"', "[", "`"):
+        return name[1:-1].replace('""', '"')
+    return name
+
+
+def _column_of(name: str, columns: set):
+    """The column a (quoted) name refers to, matched case-insensitively like SQLite does, or None."""
+    name = _unquote(name).lower()
+    return next((column for column in columns if column.lower() == name), None)
+
+
+def _mask_literals(query: str) -> str:
+    # Keep offsets so spans found in the masked query apply to the original
+    return _STRING_LITERAL.sub(lambda match: "'" + " " * (len(match.group(0)) - 2) + "'", query)
+
+
+def _split_top_level(text: str) -> list:
+    """(start, end) spans of the comma separated items of `text`, ignoring nested commas."""
+    spans, depth, start = [], 0, 0
+    for position, character in enumerate(text):
+        if character == "(":
+            depth += 1
+        elif character == ")":
+            depth -= 1
+        elif character == "," and depth == 0:
+            spans.append((start, position))
+            start = position + 1
+    spans.append((start, len(text)))
+    return spans
+
+
+class AggregateShape:
+    """
+    The table, grouping/filter columns (dimensions) and aggregated columns (measures)
+    of a single-table aggregate query, parsed from its text.
+    """
+
+    def __init__(
+        self, query: str, table: str, table_span: tuple, calls: list, select_span: tuple,
+        identifiers: set, selected: set,
+    ):
+        self.query = query
+        self.table = table
+        self.table_span = table_span
+        self.calls = calls  # (function, argument, span) of every aggregate call
+        self.select_span = select_span
+        self.identifiers = identifiers  # names used outside aggregate calls
+        self.selected = selected  # names the select list uses outside aggregate calls
+
+    @classmethod
+    def parse(cls, query: str):
+        query = query.strip().rstrip(";")
+        masked = _mask_literals(query)
+        select = _SELECT_LIST.match(masked)
+        if not select or _UNSUPPORTED.search(masked) or len(re.findall(r"\bSELECT\b", masked, re.IGNORECASE)) != 1:
+            return None
+        source = _FROM.search(masked)
+        # Aliased tables are left alone rather than resolving their qualifiers, and comma joins are not supported
+        if not source or source.group(2) or masked[source.end():].lstrip().startswith(","):
+            return None
+
+        calls = [
+            (match.group(1).upper(), match.group(2), match.span())
+            for match in _AGGREGATE_CALL.finditer(masked)
+        ]
+        if not calls or len(calls) != len(_ANY_AGGREGATE.findall(masked)):
+            return None
+        if any(argument == "*" and function != "COUNT" for function, argument, _ in calls):
+            return None
+
+        outside = list(masked)
+        for _, _, (start, end) in calls:
+            outside[start:end] = " " * (end - start)
+        outside = "".join(outside)
+        select_list = outside[select.start(1):select.end(1)]
+        items = [masked[select.start(1) + start:select.start(1) + end].strip() for start, end in _split_top_level(select_list)]
+        if "*" in items:
+            return None
+        # Result aliases (e.g. ORDER BY total) are not columns of the table
+        aliases = {_unquote(match.group(1)) for match in map(_ALIAS.search, items) if match}
+        table = source.group(1)
+        if table.lower().startswith("main."):
+            table = table[len("main."):]
+        return cls(
+            query,
+            _unquote(table),
+            source.span(1),
+            calls,
+            select.span(1),
+            _identifiers(outside[:source.start()] + outside[source.end():]) - aliases,
+            _identifiers(select_list) - aliases,
+        )
+
+    def dimensions(self, columns: set) -> frozenset:
+        return frozenset(filter(None, (_column_of(name, columns) for name in self.identifiers)))
+
+    def measures(self, columns: set):
+        """Aggregated columns, or None when an aggregate is not over a plain column."""
+        measures = set()
+        for _, argument, _ in self.calls:
+            if argument == "*":
+                continue
+            column = _column_of(argument, columns)
+            if column is None:
+                return None
+            measures.add(column)
+        return frozenset(measures)
+
+    def is_supported(self, columns: set) -> bool:
+        # Without GROUP BY, columns outside aggregates would pick values of arbitrary rows
+        grouped = re.search(r"\bGROUP\s+BY\b", _mask_literals(self.query), re.IGNORECASE) is not None
+        selects_columns = any(_column_of(name, columns) for name in self.selected)
+        return bool(columns) and self.measures(columns) is not None and (grouped or not selects_columns)
+
+
+def _identifiers(text: str) -> set:
+    return {
+        next(group for group in match.groups() if group is not None).replace('""', '"')
+        for match in _IDENTIFIER.finditer(text)
+    }
+
+
+def _measure_column(function: str, column: str) -> str:
+    return f"__{function.lower()}__{column}"
+
+
+def _aggregate_over_rollup(function: str, column: str) -> str:
+    if column is None:
+        return f"COALESCE(SUM({quote_identifier(ROW_COUNT_COLUMN)}), 0)"
+    sums = quote_identifier(_measure_column("sum", column))
+    counts = quote_identifier(_measure_column("count", column))
+    if function == "COUNT":
+        return f"COALESCE(SUM({counts}), 0)"
+    if function == "AVG":
+        return f"(SUM({sums}) * 1.0 / SUM({counts}))"
+    if function in ("SUM", "TOTAL"):
+        return f"{function}({sums})"
+    return f"{function}({quote_identifier(_measure_column(function, column))})"
+
+
+def rewrite_query(shape: AggregateShape, rollup_name: str, columns: set, schema: str = ROLLUP_SCHEMA) -> str:
+    """Rewrite an aggregate query to re-aggregate the partial aggregates of a rollup table in `schema`."""
+    query = shape.query
+    replacements = [
+        (span, _aggregate_over_rollup(function, None if argument == "*" else _column_of(argument, columns)))
+        for function, argument, span in shape.calls
+    ]
+    replacements.append((shape.table_span, f"{quote_identifier(schema)}.{quote_identifier(rollup_name)}"))
+
+    # Result columns are named after their expression, so unaliased items keep their original text as alias
+    select_start, select_end = shape.select_span
+    masked_select = _mask_literals(query)[select_start:select_end]
+    for start, end in _split_top_level(masked_select):
+        has_call = any(select_start + start <= span[0] < select_start + end for _, _, span in shape.calls)
+        if has_call and not _ALIAS.search(masked_select[start:end].strip()):
+            original = query[select_start + start:select_start + end]
+            position = select_start + start + len(original.rstrip())
+            replacements.append(((position, position), f" AS {quote_identifier(original.strip())}"))
+
+    for (start, end), replacement in sorted(replacements, key=lambda item: item[0], reverse=True):
+        query = query[:start] + replacement + query[end:]
+    return query
+
+
+def rollup_path(db_path: str) -> str:
+    return os.path.splitext(os.path.realpath(db_path))[0] + ".rollups.sqlite"
+
+
+class RollupManager:
+    """
+    Materialized pre-aggregations of recurring aggregate queries. Single-table
+    SUM/COUNT/AVG/MIN/MAX queries are logged by shape; shapes queried often get a
+    rollup table (row counts plus per-measure sums, counts, minimums and maximums
+    grouped by the shape's dimensions) in `<file>.rollups.sqlite`, which pooled
+    connections attach. Matching queries are rewritten to re-aggregate the rollup
+    while it was built from the current version of its table; stale rollups are
+    refreshed in the background. Queries on the views of a project use the rollups
+    of the member file behind the view.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._shapes = {}  # pool key -> {(table, dimensions, measures): count}
+        self._rollups = {}  # pool key -> {name: rollup}
+        self._sources = {}  # (pool key, queried table) -> (database version, source)
+        self._columns = {}  # (pool key, table) -> (table version, columns)
+        self._dirty = set()
+        self._thread = None
+        self._stop = threading.Event()
+        self.rewrites = 0
+
+    def _source(self, conn, key: str, table: str):
+        """
+        (pool key, table, schema) of the rows behind a queried table: the table itself,
+        or the member file and table behind a view of a project, attached under the
+        member's alias. Names match case-insensitively; None for other views and unknown names.
+        """
+        version = database_version(key)
+        cached = self._sources.get((key, table))
+        if cached and cached[0] == version:
+            return cached[1]
+        row = conn.execute(
+            "SELECT name FROM main.sqlite_master WHERE type='table' AND name=? COLLATE NOCASE", (table,)
+        ).fetchone()
+        source = (key, row[0], "main") if row else None
+        if source is None:
+            try:
+                member = conn.execute(
+                    f"SELECT members.db_path, views.table_name, views.alias FROM main.{PROJECT_VIEWS_TABLE} AS views "
+                    f"JOIN main.{PROJECT_MEMBERS_TABLE} AS members ON members.alias = views.alias "
+                    "WHERE views.view_name = ? COLLATE NOCASE",
+                    (table,),
+                ).fetchone()
+            except sqlite3.OperationalError:
+                # Not a project database
+                member = None
+            if member:
+                source = (pool_key(member[0]), member[1], member[2])
+        self._sources[(key, table)] = (version, source)
+        return source
+
+    def _table_columns(self, conn, source: tuple) -> set:
+        key, table, schema = source
+        version = read_table_version(conn, table, schema)
+        cached = self._columns.get((key, table))
+        if cached and cached[0] == version:
+            return cached[1]
+        columns = {
+            column[1] for column in conn.execute(
+                f"PRAGMA {quote_identifier(schema)}.table_info({quote_identifier(table)})"
+            ).fetchall()
+        }
+        self._columns[(key, table)] = (version, columns)
+        return columns
+
+    def _rollup_schema(self, conn, source: tuple):
+        """Schema the rollups of a source are attached as on `conn`, or None when they cannot be read."""
+        key, _, schema = source
+        rollup_schema = ROLLUP_SCHEMA if schema == "main" else f"{ROLLUP_SCHEMA}_{schema}"
+        if conn.execute("SELECT 1 FROM pragma_database_list WHERE name=?", (rollup_schema,)).fetchone():
+            return rollup_schema
+        if schema == "main":
+            # Attached by the pool when it opens a connection
+            return None
+        try:
+            conn.execute(
+                f"ATTACH DATABASE ? AS {quote_identifier(rollup_schema)}", (f"file:{quote(rollup_path(key))}?mode=ro",)
+            )
+        except sqlite3.Error:
+            # Projects may already attach as many files as SQLite allows
+            return None
+        return rollup_schema
+
+    def _loaded(self, key: str) -> dict:
+        with self._lock:
+            rollups = self._rollups.get(key)
+        if rollups is not None:
+            return rollups
+        rollups = {}
+        path = rollup_path(key)
+        if os.path.exists(path):
+            conn = sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True)
+            try:
+                for row in conn.execute(
+                    f"SELECT name, table_name, dimensions, measures, version, rows, base_rows, status FROM {ROLLUP_META_TABLE}"
+                ).fetchall():
+                    rollups[row[0]] = {
+                        "name": row[0],
+                        "table": row[1],
+                        "dimensions": frozenset(json.loads(row[2])),
+                        "measures": frozenset(json.loads(row[3])),
+                        "version": json.loads(row[4]),
+                        "rows": row[5],
+                        "base_rows": row[6],
+                        "status": row[7],
+                        "hits": 0,
+                    }
+            except sqlite3.Error:
+                logger.warning(f"Could not read the rollups of {key}")
+            finally:
+                conn.close()
+        with self._lock:
+            return self._rollups.setdefault(key, rollups)
+
+    def record_query(self, db_path: str, query: str):
+        """Log the shape of a successfully executed aggregate query."""
+        if not ROLLUPS_ENABLED:
+            return
+        shape = AggregateShape.parse(query)
+        if shape is None:
+            return
+        with pool.connection(db_path) as conn:
+            source = self._source(conn, pool_key(db_path), shape.table)
+            if source is None:
+                return
+            columns = self._table_columns(conn, source)
+        if not shape.is_supported(columns):
+            return
+        key, table, _ = source
+        signature = (table, shape.dimensions(columns), shape.measures(columns))
+        with self._lock:
+            shapes = self._shapes.setdefault(key, {})
+            shapes[signature] = shapes.pop(signature, 0) + 1
+            while len(shapes) > SHAPE_LOG_SIZE:
+                shapes.pop(next(iter(shapes)))
+            if shapes[signature] >= ROLLUP_MIN_QUERY_COUNT:
+                self._dirty.add(key)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rollups", daemon=True)
+                self._thread.start()
+
+    def rewrite(self, conn, db_path: str, query: str):
+        """The query rewritten against a fresh rollup that can answer it, or None."""
+        if not ROLLUPS_ENABLED:
+            return None
+        shape = AggregateShape.parse(query)
+        if shape is None:
+            return None
+        source = self._source(conn, pool_key(db_path), shape.table)
+        if source is None:
+            return None
+        key, table, _ = source
+        rollups = self._loaded(key)
+        if not rollups:
+            return None
+        version = read_table_version(conn, table, source[2])
+        columns = self._table_columns(conn, source)
+        if not shape.is_supported(columns):
+            return None
+
+        dimensions = shape.dimensions(columns)
+        measures = shape.measures(columns)
+        candidates = [
+            rollup for rollup in rollups.values()
+            if rollup["status"] == "ready"
+            and rollup["table"] == table
+            and dimensions <= rollup["dimensions"]
+            and measures <= rollup["measures"]
+        ]
+        if not candidates:
+            return None
+        rollup = min(candidates, key=lambda rollup: rollup["rows"])
+        if rollup["version"] != version:
+            with self._lock:
+                self._dirty.add(key)
+            return None
+        schema = self._rollup_schema(conn, source)
+        if schema is None:
+            return None
+        with self._lock:
+            rollup["hits"] += 1
+            self.rewrites += 1
+        return rewrite_query(shape, rollup["name"], columns, schema)
+
+    def refresh_later(self, db_path: str):
+        """Schedule the rollups of a database for a refresh, e.g. after a table was rewritten."""
+        key = pool_key(db_path)
+        with self._lock:
+            if self._rollups.get(key) or self._shapes.get(key):
+                self._dirty.add(key)
+
+    def _run(self):
+        while not self._stop.wait(ROLLUP_INTERVAL_SECONDS):
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+            for key in dirty:
+                try:
+                    self.maintain(key)
+                except Exception:
+                    logger.exception(f"Rollup maintenance of {key} failed")
+
+    def stop(self):
+        self._stop.set()
+
+    def maintain(self, db_path: str):
+        """Build rollups for recurring shapes and rebuild the stale ones."""
+        key = pool_key(db_path)
+        rollups = self._loaded(key)
+        with self._lock:
+            shapes = [
+                signature for signature, count in self._shapes.get(key, {}).items()
+                if count >= ROLLUP_MIN_QUERY_COUNT
+            ]
+        wanted = {}
+        for table, dimensions, measures in shapes:
+            name = _rollup_name(table, dimensions, measures)
+            # Rejected shapes are not retried
+            covered = name in rollups or any(
+                rollup["status"] == "ready" and rollup["table"] == table
+                and dimensions <= rollup["dimensions"] and measures <= rollup["measures"]
+                for rollup in rollups.values()
+            )
+            if not covered:
+                wanted[name] = (table, dimensions, measures)
+        for rollup in rollups.values():
+            if rollup["status"] == "ready" and rollup["version"] != table_version(key, rollup["table"]):
+                wanted[rollup["name"]] = (rollup["table"], rollup["dimensions"], rollup["measures"])
+
+        for name, (table, dimensions, measures) in wanted.items():
+            self._build(key, name, table, dimensions, measures)
+
+    def _build(self, key: str, name: str, table: str, dimensions: frozenset, measures: frozenset):
+        path = rollup_path(key)
+        created = not os.path.exists(path)
+        # Read the version first so writes during the build leave the rollup stale
+        version = table_version(key, table)
+        select = [quote_identifier(dimension) for dimension in sorted(dimensions)]
+        select.append(f"COUNT(*) AS {quote_identifier(ROW_COUNT_COLUMN)}")
+        for measure in sorted(measures):
+            column = quote_identifier(measure)
+            select.append(f"SUM({column}) AS {quote_identifier(_measure_column('sum', measure))}")
+            select.append(f"COUNT({column}) AS {quote_identifier(_measure_column('count', measure))}")
+            select.append(f"MIN({column}) AS {quote_identifier(_measure_column('min', measure))}")
+            select.append(f"MAX({column}) AS {quote_identifier(_measure_column('max', measure))}")
+        group_by = f" GROUP BY {', '.join(quote_identifier(d) for d in sorted(dimensions))}" if dimensions else ""
+
+        with self._build_lock:
+            started = time.perf_counter()
+            conn = sqlite3.connect(f"file:{quote(path)}", uri=True, timeout=30, isolation_level=None)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("ATTACH DATABASE ? AS base", (f"file:{quote(key)}?mode=ro",))
+                conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {ROLLUP_META_TABLE} (name TEXT PRIMARY KEY, table_name TEXT, "
+                    "dimensions TEXT, measures TEXT, version TEXT, rows INTEGER, base_rows INTEGER, status TEXT)"
+                )
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(f"DROP TABLE IF EXISTS main.{quote_identifier(name)}")
+                conn.execute(
+                    f"CREATE TABLE main.{quote_identifier(name)} AS "
+                    f"SELECT {', '.join(select)} FROM base.{quote_identifier(table)}{group_by}"
+                )
+                rows = conn.execute(f"SELECT COUNT(*) FROM main.{quote_identifier(name)}").fetchone()[0]
+                base_rows = conn.execute(f"SELECT SUM({quote_identifier(ROW_COUNT_COLUMN)}) FROM main.{quote_identifier(name)}").fetchone()[0] or 0
+                status = "ready"
+                if base_rows and rows > base_rows * ROLLUP_MAX_ROW_RATIO:
+                    # Too little aggregation to pay off; keep the shape recorded so it is not retried
+                    conn.execute(f"DROP TABLE main.{quote_identifier(name)}")
+                    status = "rejected"
+                conn.execute(
+                    f"INSERT OR REPLACE INTO {ROLLUP_META_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (name, table, json.dumps(sorted(dimensions)), json.dumps(sorted(measures)),
+                     json.dumps(version), rows, base_rows, status),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+
+        rollup = {
+            "name": name,
+            "table": table,
+            "dimensions": dimensions,
+            "measures": measures,
+            "version": version,
+            "rows": rows,
+            "base_rows": base_rows,
+            "status": status,
+            "hits": 0,
+        }
+        with self._lock:
+            previous = self._rollups.setdefault(key, {}).get(name)
+            rollup["hits"] = previous["hits"] if previous else 0
+            self._rollups[key][name] = rollup
+        if created:
+            # Pooled connections attach the rollup database when they are opened
+            pool.discard(key)
+        logger.info(
+            f"Rollup {name} of {key}: {status}, {rows} rows from {base_rows} "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+
+    def forget(self, db_path: str):
+        """Drop the state of a database that is being removed."""
+        key = pool_key(db_path)
+        with self._lock:
+            self._rollups.pop(key, None)
+            self._shapes.pop(key, None)
+            self._dirty.discard(key)
+
+    def describe(self, db_path: str) -> dict:
+        rollups = self._loaded(pool_key(db_path))
+        with self._lock:
+            return {
+                "rollups": [
+                    {
+                        "name": rollup["name"],
+                        "table": rollup["table"],
+                        "dimensions": sorted(rollup["dimensions"]),
+                        "measures": sorted(rollup["measures"]),
+                        "rows": rollup["rows"],
+                        "base_rows": rollup["base_rows"],
+                        "status": rollup["status"],
+                        "hits": rollup["hits"],
+                    }
+                    for rollup in rollups.values()
+                ],
+            }
+
+
+def _rollup_name(table: str, dimensions: frozenset, measures: frozenset) -> str:
+    digest = hashlib.sha1(json.dumps([table, sorted(dimensions), sorted(measures)]).encode("utf-8")).hexdigest()[:12]
+    return f"rollup_{re.sub(r'[^0-9A-Za-z_]', '_', table)}_{digest}"
+
+
+def attach_rollups(conn):
+    """Pool open hook: attach the rollup database of a file, if it has one."""
+    main_file = conn.execute("SELECT file FROM pragma_database_list WHERE name='main'").fetchone()
+    if not main_file or not main_file[0]:
+        return
+    path = rollup_path(main_file[0])
+    if os.path.exists(path):
+        conn.execute(f"ATTACH DATABASE ? AS {ROLLUP_SCHEMA}", (f"file:{quote(path)}?mode=ro",))
+
+
+pool.add_open_hook(attach_rollups)
+rollups = RollupManager()
@@ -0,0 +1,61 @@
+import threading
+from collections import OrderedDict
+
+from backend.sqlite_server.connection_pool import pool_key
+from backend.sqlite_server.projects import combined_version
+
+# Number of database schemas kept in memory
+SCHEMA_CACHE_SIZE = 256
+
+
+class SchemaCache:
+    """
+    Schema descriptions keyed by database path and validated against the current
+    version of the database (and of the files a project attaches), so rewriting
+    a table invalidates its entry without any explicit bookkeeping.
+    """
+
+    def __init__(self, max_entries: int = SCHEMA_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # pool key -> (version, schema)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, db_path: str, loader):
+        """Return the cached schema of `db_path`, calling `loader()` when it is missing or stale."""
+        key = pool_key(db_path)
+        # Read the version before loading so a concurrent write makes the entry stale
+        version = combined_version(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        schema = loader()
+        with self._lock:
+            self._entries[key] = (version, schema)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return schema
+
+    def invalidate(self, db_path: str):
+        with self._lock:
+            self._entries.pop(pool_key(db_path), None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+schema_cache = SchemaCache()
@@ -0,0 +1,221 @@
+import logging
+import os
+from contextlib import closing
+from io import BytesIO
+import re
+import sqlite3
+import uuid
+
+import pyarrow as pa
+
+from backend.sqlite_server.connection_pool import pool
+from backend.sqlite_server.ingest import quote_identifier
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched from SQLite per record batch while writing a sidecar
+SIDECAR_BATCH_SIZE = 65536
+
+# Arrow types tried in order for each declared SQLite type; SQLite columns may hold
+# mixed values, so a column falls back to the next type if a batch does not fit
+_TYPE_LADDERS = {
+    "INTEGER": [pa.int64(), pa.float64(), pa.string()],
+    "REAL": [pa.float64(), pa.string()],
+}
+_DEFAULT_LADDER = [pa.string()]
+
+# Version stamp of each table, replaced whenever the table is rewritten; data derived
+# from a table compares against it, so writes to other tables (automatic indexes,
+# column statistics, analysis reports) leave it fresh
+TABLE_VERSIONS_TABLE = "_table_versions"
+_VERSION_METADATA_KEY = b"table_version"
+
+
+def database_version(db_path: str) -> tuple:
+    """Cheap fingerprint of a database file that changes whenever it is written."""
+    # SQLite keeps the WAL next to the resolved file of symlinked (deduplicated) uploads
+    db_path = os.path.realpath(db_path)
+    version = []
+    for path in (db_path, f"{db_path}-wal"):
+        try:
+            stat = os.stat(path)
+            version.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            version.append(None)
+    return tuple(version)
+
+
+def read_table_version(conn, table_name: str, schema: str = "main") -> str:
+    """Version stamp of a table on an open connection; "" for tables not rewritten since ingest."""
+    try:
+        row = conn.execute(
+            f"SELECT version FROM {quote_identifier(schema)}.{TABLE_VERSIONS_TABLE} WHERE table_name = ?",
+            (table_name,),
+        ).fetchone()
+    except sqlite3.OperationalError:
+        # No table has been rewritten yet
+        return ""
+    return row[0] if row else ""
+
+
+def table_version(db_path: str, table_name: str) -> str:
+    with pool.connection(db_path) as conn:
+        return read_table_version(conn, table_name)
+
+
+def stamp_table_version(conn, table_name: str) -> str:
+    """Give a table a new version stamp within the open transaction of `conn`."""
+    version = uuid.uuid4().hex
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {TABLE_VERSIONS_TABLE} (table_name TEXT PRIMARY KEY, version TEXT NOT NULL)"
+    )
+    conn.execute(f"INSERT OR REPLACE INTO {TABLE_VERSIONS_TABLE} VALUES (?, ?)", (table_name, version))
+    return version
+
+
+def bump_table_version(db_path: str, table_name: str) -> str:
+    """Give a table a new version stamp after it has been (re)written."""
+    conn = sqlite3.connect(os.path.realpath(db_path), timeout=30)
+    try:
+        with conn:
+            return stamp_table_version(conn, table_name)
+    finally:
+        conn.close()
+
+
+def sidecar_path(db_path: str, table_name: str) -> str:
+    stem = os.path.splitext(os.path.realpath(db_path))[0]
+    safe_table_name = re.sub(r"[^\w.-]", "_", table_name)
+    return f"{stem}.{safe_table_name}.arrow"
+
+
+def sidecar_is_fresh(db_path: str, table_name: str) -> bool:
+    path = sidecar_path(db_path, table_name)
+    if not os.path.exists(path):
+        return False
+    try:
+        metadata = pa.ipc.open_file(pa.memory_map(path, "r")).schema.metadata or {}
+    except pa.ArrowInvalid:
+        return False
+    # Sidecars written before versions were stamped have no version and are rebuilt
+    written_version = metadata.get(_VERSION_METADATA_KEY)
+    return written_version is not None and written_version.decode("utf-8") == table_version(db_path, table_name)
+
+
+def _ladder(declared_type: str):
+    declared_type = (declared_type or "").upper()
+    if "INT" in declared_type:
+        return _TYPE_LADDERS["INTEGER"]
+    if any(name in declared_type for name in ("REAL", "FLOA", "DOUB")):
+        return _TYPE_LADDERS["REAL"]
+    return _DEFAULT_LADDER
+
+
+def _to_array(values, arrow_type):
+    if arrow_type == pa.string():
+        values = [None if value is None else str(value) for value in values]
+    return pa.array(values, type=arrow_type)
+
+
+class _ColumnTypeMismatch(Exception):
+    def __init__(self, index: int):
+        super().__init__(index)
+        self.index = index
+
+
+def _write_batches(conn, table_name: str, names, types, target: str, version: str):
+    cursor = conn.execute(f"SELECT * FROM {quote_identifier(table_name)}")
+    schema = pa.schema(list(zip(names, types)), metadata={_VERSION_METADATA_KEY: version.encode("utf-8")})
+    with closing(cursor), pa.OSFile(target, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        while True:
+            rows = cursor.fetchmany(SIDECAR_BATCH_SIZE)
+            if not rows:
+                break
+            columns = list(zip(*rows))
+            arrays = []
+            for index, arrow_type in enumerate(types):
+                try:
+                    arrays.append(_to_array(columns[index], arrow_type))
+                except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+                    raise _ColumnTypeMismatch(index)
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+
+
+def write_sidecar(db_path: str, table_name: str) -> str:
+    """
+    Write an Arrow IPC sidecar for a table of the given database.
+    The file is written next to the database and swapped in atomically.
+    Returns the path of the sidecar.
+    """
+    path = sidecar_path(db_path, table_name)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+
+    conn = pool.acquire(db_path)
+    try:
+        # Read before the rows, so a rewrite during the export leaves the sidecar stale
+        version = read_table_version(conn, table_name)
+        columns_info = conn.execute(f"PRAGMA table_info({quote_identifier(table_name)})").fetchall()
+        if not columns_info:
+            raise ValueError(f"Table {table_name} does not exist in the database")
+        names = [column[1] for column in columns_info]
+        ladders = [_ladder(column[2]) for column in columns_info]
+        positions = [0] * len(columns_info)
+
+        while True:
+            types = [ladder[position] for ladder, position in zip(ladders, positions)]
+            try:
+                _write_batches(conn, table_name, names, types, temp_path, version)
+                break
+            except _ColumnTypeMismatch as mismatch:
+                # Widen the offending column and rewrite from the start
+                positions[mismatch.index] += 1
+        os.replace(temp_path, path)
+    finally:
+        pool.release(db_path, conn)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    logger.info(f"Wrote columnar sidecar {path}")
+    return path
+
+
+def read_sidecar(db_path: str, table_name: str, columns: list[str] = None) -> pa.Table:
+    """
+    Memory-map the sidecar of a table and project the requested columns.
+    Only the projected columns are ever paged in from disk.
+    """
+    source = pa.memory_map(sidecar_path(db_path, table_name), "r")
+    table = pa.ipc.open_file(source).read_all()
+    if columns:
+        missing = [column for column in columns if column not in table.column_names]
+        if missing:
+            raise KeyError(f"Unknown columns: {', '.join(missing)}")
+        table = table.select(columns)
+    return table
+
+
+def load_table(db_path: str, table_name: str, columns: list[str] = None) -> pa.Table:
+    """Read a table through its sidecar, (re)building the sidecar when it is missing or stale."""
+    if not sidecar_is_fresh(db_path, table_name):
+        write_sidecar(db_path, table_name)
+    return read_sidecar(db_path, table_name, columns)
+
+
+def iter_ipc_stream(table: pa.Table):
+    """Yield a table encoded as an Arrow IPC stream, one record batch at a time."""
+    buffer = BytesIO()
+    with pa.ipc.new_stream(buffer, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=SIDECAR_BATCH_SIZE):
+            writer.write_batch(batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def refresh_sidecar(db_path: str, table_name: str):
+    """Best-effort sidecar rebuild after a table is written; readers rebuild lazily on failure."""
+    try:
+        write_sidecar(db_path, table_name)
+    except Exception:
+        logger.exception(f"Failed to write sidecar for {table_name} of {db_path}")
@@ -0,0 +1,70 @@
+import difflib
+import re
+import sqlite3
+
+from backend.sqlite_server.connection_pool import pool
+
+# Markdown code fences models like to wrap generated SQL in
+_CODE_FENCE = re.compile(r"^\s*```[\w-]*\s*\n?(.*?)\n?\s*```\s*$", re.DOTALL)
+_READ_ONLY = re.compile(r"^\s*(?:SELECT|WITH|VALUES)\b", re.IGNORECASE)
+_UNRESOLVED = re.compile(r"no such (table|column): (\S+)")
+# Close matches offered for an unresolved name
+MAX_SUGGESTIONS = 3
+
+
+def clean_sql(query: str) -> str:
+    """Strip a surrounding code fence, whitespace and trailing semicolons."""
+    match = _CODE_FENCE.match(query)
+    if match:
+        query = match.group(1)
+    return query.strip().rstrip(";").strip()
+
+
+def _schema_names(conn) -> dict:
+    """Columns of every table and view, including the views of attached project files."""
+    names = {}
+    for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%' "
+        "UNION ALL SELECT name FROM sqlite_temp_master WHERE type = 'view'"
+    ):
+        names[name] = [row[1] for row in conn.execute("SELECT * FROM pragma_table_info(?)", (name,))]
+    return names
+
+
+def _suggestions(conn, error: str) -> list:
+    match = _UNRESOLVED.search(error)
+    if match is None:
+        return []
+    kind, name = match.groups()
+    names = _schema_names(conn)
+    if kind == "table":
+        candidates = list(names)
+    else:
+        # Qualified references match columns of the named table; aliases match every column
+        table, _, name = name.rpartition(".")
+        tables = [table_name for table_name in names if table_name.lower() == table.lower()] or list(names)
+        candidates = [column for table_name in tables for column in names[table_name]]
+    by_lower = {candidate.lower(): candidate for candidate in candidates}
+    matches = difflib.get_close_matches(name.lower(), list(by_lower), n=MAX_SUGGESTIONS, cutoff=0.6)
+    return [by_lower[match] for match in matches]
+
+
+def validate_query(db_path: str, query: str) -> dict:
+    """
+    Check a query without running it: SQLite compiles it with EXPLAIN QUERY PLAN,
+    which resolves every table and column against the live schema. Unresolved names
+    come back with the closest names that do exist.
+    """
+    query = clean_sql(query)
+    if not _READ_ONLY.match(query):
+        return {"query": query, "valid": False, "issues": "Only SELECT statements can be executed", "suggestions": []}
+
+    conn = pool.acquire(db_path)
+    try:
+        try:
+            plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}")]
+        except sqlite3.Error as e:
+            return {"query": query, "valid": False, "issues": str(e), "suggestions": _suggestions(conn, str(e))}
+    finally:
+        pool.release(db_path, conn)
+    return {"query": query, "valid": True, "issues": None, "suggestions": [], "plan": plan}
@@ -1,21 +1,44 @@
+import json
 import os
-import shutil
 import sqlite3
 import uuid
-from io import BytesIO
-import markdown2
-from weasyprint import HTML
 
-import pandas as pd
-from typing import List
-from fastapi import APIRouter, FastAPI, File, HTTPException, UploadFile, Query
+from typing import Dict, List, Optional
+from fastapi import APIRouter, FastAPI, File, HTTPException, UploadFile, Query, Request
 from fastapi.responses import JSONResponse
-# from metadata_store import query_metadata, store_metadata
 from pydantic import BaseModel
-from io import StringIO
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
+from backend.sqlite_server import reports, storage, workers
+from backend.sqlite_server.chunked_upload import UPLOAD_MAX_CHUNK_BYTES, uploads
+from backend.sqlite_server.column_stats import load_table_stats
+from backend.sqlite_server.connection_pool import pool
+from backend.sqlite_server.export import EXPORT_COMPRESSIONS, EXPORT_FORMATS, TableExport
+from backend.sqlite_server.governor import QueryTimeout, governor
+from backend.sqlite_server.index_advisor import advisor
+from backend.sqlite_server.query_results import QUERY_ROW_LIMIT
+from backend.sqlite_server.result_cache import result_cache
+from backend.sqlite_server.rollups import rollups
+from backend.sqlite_server.schema_cache import schema_cache
+from backend.sqlite_server.sql_validator import validate_query
+from backend.sqlite_server.value_dictionary import match_values
+from backend.sqlite_server.sidecar import (
+    iter_ipc_stream,
+    load_table,
+    sidecar_is_fresh,
+    sidecar_path,
+    write_sidecar,
+)
+from backend.sqlite_server.storage import (
+    ANALYSED_TABLE_NAME,
+    CLEANED_TABLE_NAME,
+    UPLOAD_DIR,
+    create_multi_file_dataframe,
+    on_table_written,
+)
+from backend.sqlite_server.workers import continue_blocking, run_blocking
+
 # Create FastAPI router
 router = FastAPI()
 
@@ -27,48 +50,49 @@ router.add_middleware(
     allow_headers=["*"],
 )
 
-UPLOAD_DIR = "uploads"
-CLEANED_TABLE_NAME = "data_cleaned"
-ANALYSED_TABLE_NAME = "data_analysed"
-os.makedirs(
-    UPLOAD_DIR, exist_ok=True
-)  # Create the uploads directory if it doesn't exist
-
-
 # Data model for the SQL query execution request
 class QueryRequest(BaseModel):
     file_uuid: str
     query: str
+    stream: bool = False  # stream rows as NDJSON instead of one JSON body
+    page_size: Optional[int] = None  # rows per response, capped by QUERY_ROW_LIMIT
+    cursor: Optional[str] = None  # continuation token returned as next_cursor
+    caller: Optional[str] = None  # budget to run under, e.g. "agent"; defaults to "interactive"
 
 
-# Helper function to convert CSV to SQLite
-def convert_dataframe_to_sqlite(df, sqlite_file_path: str):
-    try:
-        # Write DataFrame to SQLite database
-        with sqlite3.connect(sqlite_file_path) as conn:
-            df.to_sql("data", conn, if_exists="replace", index=False)
-    except Exception as e:
-        raise RuntimeError(f"Error converting CSV to SQLite: {str(e)}")
+# Data model for checking a query without running it
+class ExplainRequest(BaseModel):
+    file_uuid: str
+    query: str
 
-def table_exists(conn, table_name):
-    cursor = conn.cursor()
-    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table';")
-    tables = cursor.fetchall()
 
-    has_cleaned_table = False
-    for table in tables:
-        table_name, create_statement = table
-        if table_name in table_name:
-            has_cleaned_table = True
+# Data model for matching question words against the value dictionary
+class MatchValuesRequest(BaseModel):
+    file_uuid: str
+    question: str
+    columns: Dict[str, List[str]]  # table -> columns whose values may be named in the question
+    limit: int = 20
+
+
+# Data model for reporting queries the ai-server ran in direct mode
+class RecordQueriesRequest(BaseModel):
+    file_uuid: str
+    queries: List[str]
+
+
+# Data model for starting a chunked upload
+class UploadInitRequest(BaseModel):
+    filename: str
+    total_size: Optional[int] = None  # bytes; completion is refused until all arrived
+    project_uuid: Optional[str] = None
+    user_uuid: Optional[str] = None
 
-    if has_cleaned_table is False:
-        raise HTTPException(status_code=404, detail=f"Cleaned Table does not exist in the database")
-    
-    return True
 
 @router.post("/upload-file", description="Allowed file formats: csv, xls, xlsx, sqlite ")
 async def upload_file(
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    project_uuid: Optional[str] = None,
+    user_uuid: Optional[str] = None,
 ):
     # Check if both uuid and query are provided
     if not file:
@@ -86,66 +110,61 @@ async def upload_file(
 
         # Generate a UUID for the file
         file_uuid = str(uuid.uuid4())
-        file_extension = os.path.splitext(file.filename)[1].lower()
-        new_file_path = None
-
-        # Handle .sqlite file
-        if file_extension == ".sqlite":
-            new_file_path = os.path.join(UPLOAD_DIR, f"{file_uuid}.sqlite")
-            # Save the uploaded file to the new path
-            with open(new_file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-
-        # Handle .csv file
-        elif file_extension == ".csv":
-            csv_file_path = os.path.join(UPLOAD_DIR, file.filename)
-            new_file_path = os.path.join(UPLOAD_DIR, f"{file_uuid}.sqlite")
-
-            # Save the CSV temporarily
-            with open(csv_file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-
-            # Convert CSV to SQLite
-            try:
-                df = pd.read_csv(csv_file_path)
-                convert_dataframe_to_sqlite(df, new_file_path)
-                os.remove(csv_file_path)  # Remove the CSV file after conversion
-            except Exception as e:
-                raise HTTPException(
-                    status_code=500, detail=f"Error converting CSV to SQLite: {str(e)}"
-                )
-        # Handle .xls and .xlsx files
-        elif file_extension in [".xls", ".xlsx"]:
-            excel_file_path = os.path.join(UPLOAD_DIR, file.filename)
-            new_file_path = os.path.join(UPLOAD_DIR, f"{file_uuid}.sqlite")
-
-            # Save the Excel file temporarily
-            with open(excel_file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-
-            # Convert Excel to SQLite
-            try:
-                df = pd.read_excel(excel_file_path)
-                convert_dataframe_to_sqlite(df, new_file_path)
-                os.remove(excel_file_path)  # Remove the Excel file after conversion
-            except Exception as e:
-                raise HTTPException(
-                    status_code=500, detail=f"Error converting Excel to SQLite: {str(e)}"
-                )
-        else:
-            raise HTTPException(
-                status_code=400,
-                detail="Invalid file type. Only .sqlite and .csv files are supported.",
-            )
+        # Metadata is stored in the catalog as part of the upload
+        new_file_path, ingest_stats = await run_blocking(
+            None, storage.save_upload, file.file, file.filename, file_uuid, project_uuid, user_uuid
+        )
 
-        # Store metadata in the metadata SQLite database
-        # store_metadata(file_uuid, project_uuid, user_uuid, UPLOAD_DIR, new_file_path)
         # Return the UUID of the uploaded file
-        return JSONResponse(content={"file_uuid": file_uuid})
+        response = {"file_uuid": file_uuid}
+        if ingest_stats:
+            response["ingest"] = ingest_stats
+        return JSONResponse(content=response)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@router.post("/upload-init")
+async def upload_init(request: UploadInitRequest):
+    return await run_blocking(
+        None, uploads.init, request.filename, request.total_size, request.project_uuid, request.user_uuid
+    )
+
+
+@router.put("/upload-chunk/{upload_id}")
+async def upload_chunk(upload_id: str, offset: int, request: Request):
+    too_large = HTTPException(status_code=413, detail=f"Chunks are limited to {UPLOAD_MAX_CHUNK_BYTES} bytes")
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > UPLOAD_MAX_CHUNK_BYTES:
+        raise too_large
+
+    # A chunk is only written once its whole body arrived, so a dropped request resumes at the same offset
+    data = bytearray()
+    async for part in request.stream():
+        data += part
+        # Chunked bodies carry no length, so the limit is enforced while they arrive
+        if len(data) > UPLOAD_MAX_CHUNK_BYTES:
+            raise too_large
+    return await run_blocking(None, uploads.write_chunk, upload_id, offset, data)
 
+
+@router.get("/upload-status/{upload_id}")
+async def upload_status(upload_id: str):
+    return await run_blocking(None, uploads.status, upload_id)
+
+
+@router.post("/upload-complete/{upload_id}")
+async def upload_complete(upload_id: str):
+    try:
+        return JSONResponse(content=await run_blocking(None, uploads.complete, upload_id))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+
 # Endpoint for retrieving the schema of the database
 @router.get("/get-uploads-dir")
 async def get_uploads_dir():
@@ -155,44 +174,52 @@ async def get_uploads_dir():
 
     return "Uploads directory doesn't exists."
 
-async def get_table_as_csv(file_uuid: str, table_name: str):
+@router.get("/download_cleaned_data/{file_uuid}")
+async def download_tables_as_csv(
+    file_uuid: str,
+    format: str = Query("csv", description="Export format: csv or parquet"),
+    compression: Optional[str] = Query(None, description="gzip, for csv exports"),
+):
     upload_dir = await get_uploads_dir()
-    # Connect to the SQLite database
     db_file_path = os.path.join(upload_dir, f"{file_uuid}.sqlite")
-    conn = sqlite3.connect(db_file_path)
-    
-    try:
-        # Query the table data into a pandas dataframe
-        table_exists(conn=conn, table_name=table_name)
-        df = pd.read_sql_query(f"SELECT * FROM {table_name}", conn)
-        
-        # Use StringIO to hold CSV data in memory
-        csv_buffer = StringIO()
-        df.to_csv(csv_buffer, index=False)
-        
-        # Reset the pointer of the buffer to the beginning
-        csv_buffer.seek(0)
-        
-        return csv_buffer
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error exporting table {table_name}: {str(e)}")
-    finally:
-        # Always close the database connection
-        conn.close()
 
-@router.get("/download_cleaned_data/{file_uuid}")
-async def download_tables_as_csv(file_uuid: str):
-    
+    if not os.path.exists(db_file_path):
+        raise HTTPException(status_code=404, detail="Database not found")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid format. Allowed formats are: csv, parquet")
+    if compression is not None and (compression not in EXPORT_COMPRESSIONS or format != "csv"):
+        raise HTTPException(status_code=400, detail="Invalid compression. Only gzip is supported, for csv exports")
+
+    media_type, extension = EXPORT_FORMATS[format]
+    if compression:
+        media_type, compressed_extension = EXPORT_COMPRESSIONS[compression]
+        extension += compressed_extension
+
     try:
-        data_cleaned_csv = await get_table_as_csv(file_uuid, CLEANED_TABLE_NAME)
-        
-        # Stream the cleaned data CSV back as a response
-        return StreamingResponse(data_cleaned_csv, media_type="text/csv", headers={
-            "Content-Disposition": f"attachment; filename={file_uuid}_{CLEANED_TABLE_NAME}.csv"
+        export = await run_blocking(
+            db_file_path, TableExport, db_file_path, CLEANED_TABLE_NAME, format, compression
+        )
+
+        async def stream_export():
+            # Rows are encoded block by block on a worker, so the download starts immediately
+            try:
+                while True:
+                    block = await continue_blocking(db_file_path, export.next_block)
+                    if block is None:
+                        break
+                    yield block
+            finally:
+                export.close()
+
+        # Stream the cleaned data back as a response
+        return StreamingResponse(stream_export(), media_type=media_type, headers={
+            "Content-Disposition": f"attachment; filename={file_uuid}_{CLEANED_TABLE_NAME}{extension}"
         })
-    
+
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to download CSV: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to download {format}: {str(e)}")
 
 
 @router.get("/download_data_analysis/{file_uuid}")
@@ -202,47 +229,20 @@ async def download_data_insights_as_pdf(file_uuid: str):
         upload_dir = await get_uploads_dir()
         # Connect to the SQLite database
         db_file_path = os.path.join(upload_dir, f"{file_uuid}.sqlite")
-        conn = sqlite3.connect(db_file_path)
 
-        # Query the table data into a pandas dataframe
-        table_exists(conn=conn, table_name=ANALYSED_TABLE_NAME)
-        df = pd.read_sql_query(f"SELECT * FROM {ANALYSED_TABLE_NAME}", conn)
-        print(df)
-    
-        # Convert markdown to HTML
-        html_content = markdown2.markdown(df["markdown_content"].iloc[0])
-        
-        # Add some basic styling
-        styled_html = f"""
-        <html>
-            <head>
-                <style>
-                    body {{ font-family: Arial, sans-serif; line-height: 1.6; padding: 20px; }}
-                    h1, h2, h3 {{ color: #333; }}
-                    table {{ border-collapse: collapse; width: 100%; }}
-                    th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
-                    th {{ background-color: #f2f2f2; }}
-                </style>
-            </head>
-            <body>
-                {html_content}
-            </body>
-        </html>
-        """
-        
-        # Convert HTML to PDF
-        pdf_buffer = BytesIO()
-        HTML(string=styled_html).write_pdf(pdf_buffer)
-        pdf_buffer.seek(0)
-        
+        # Reports are rendered in a render process and cached on disk, so this is usually a file send
+        pdf_path = await run_blocking(db_file_path, storage.analysis_as_pdf, db_file_path)
+
         # Return PDF as a downloadable file
-        return StreamingResponse(
-            pdf_buffer, 
+        return FileResponse(
+            pdf_path,
             media_type="application/pdf",
-            headers={
-                "Content-Disposition": f"attachment; filename={file_uuid}_{ANALYSED_TABLE_NAME}.pdf"
-            }
+            filename=f"{file_uuid}_{ANALYSED_TABLE_NAME}.pdf",
         )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
     
@@ -262,23 +262,84 @@ async def execute_query(request: QueryRequest):
     if not os.path.exists(db_path):
         raise HTTPException(status_code=404, detail="Database not found")
 
+    if request.page_size is not None and request.page_size <= 0:
+        raise HTTPException(status_code=400, detail="page_size must be positive")
+    limit = min(request.page_size or QUERY_ROW_LIMIT, QUERY_ROW_LIMIT)
+
     try:
-        # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        if request.stream:
+            query_stream = await run_blocking(
+                db_path, storage.QueryStream, db_path, query, limit, request.cursor, request.caller
+            )
 
-        # Execute the SQL query
-        cursor.execute(query)
-        results = cursor.fetchall()
+            async def stream_results():
+                # Each block is pulled on a worker so slow results don't hold the event loop
+                try:
+                    while True:
+                        block = await continue_blocking(db_path, query_stream.next_block)
+                        if block is None:
+                            break
+                        yield block
+                finally:
+                    query_stream.close()
+
+            return StreamingResponse(
+                stream_results(),
+                media_type="application/x-ndjson",
+                headers={
+                    "X-Columns": json.dumps(query_stream.columns),
+                    "X-Column-Types": json.dumps(query_stream.column_types),
+                },
+            )
 
-        # Convert the results to JSON-friendly format
-        result_list = [list(row) for row in results]
-        return JSONResponse(content={"results": result_list})
+        # Identical queries against an unchanged database are answered from the result cache
+        body = await run_blocking(
+            db_path, storage.query_response, db_path, query, limit, request.cursor, request.caller
+        )
+        return Response(content=body, media_type="application/json")
+    except QueryTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except sqlite3.Error as e:
         raise HTTPException(status_code=400, detail=f"SQL error: {e}")
-    finally:
-        cursor.close()
-        conn.close()
+
+# Endpoint for checking a query without running it
+@router.post("/explain-query")
+async def explain_query(request: ExplainRequest):
+    if not request.file_uuid or not request.query:
+        raise HTTPException(status_code=400, detail="Missing uuid or query")
+
+    db_path = os.path.join(UPLOAD_DIR, f"{request.file_uuid}.sqlite")
+    if not os.path.exists(db_path):
+        raise HTTPException(status_code=404, detail="Database not found")
+
+    try:
+        return await run_blocking(db_path, validate_query, db_path, request.query)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+# Endpoint for finding the values a question refers to
+@router.post("/match-values")
+async def match_values_endpoint(request: MatchValuesRequest):
+    if not request.file_uuid or not request.question:
+        raise HTTPException(status_code=400, detail="Missing uuid or question")
+
+    db_path = os.path.join(UPLOAD_DIR, f"{request.file_uuid}.sqlite")
+    if not os.path.exists(db_path):
+        raise HTTPException(status_code=404, detail="Database not found")
+
+    try:
+        values = await run_blocking(
+            db_path, match_values, db_path, request.question, request.columns, request.limit
+        )
+        return {"values": values}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 # Endpoint for retrieving the schema of the database
 @router.get("/get-schema/{uuid}")
@@ -294,41 +355,13 @@ async def get_schema(uuid: str):
         raise HTTPException(status_code=404, detail="Database not found")
 
     try:
-        # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
-        table_exists(conn=conn, table_name=CLEANED_TABLE_NAME)
-        cursor = conn.cursor()
-
-        # Get the table schema from sqlite_master
-        cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
-
-        schema = []
-
-        # Function to process each table and fetch its schema and example rows
-        for table in tables:
-            table_name, create_statement = table
-            if CLEANED_TABLE_NAME in table_name:
-                schema.append(f"Table: {table_name}")
-                schema.append(f"CREATE statement: {create_statement}\n")
-
-                # Fetch only 5 rows from the table as this is an example schema for model to generate sql query
-                cursor.execute(f"SELECT * FROM '{table_name}' LIMIT 10;")
-                rows = cursor.fetchall()
-                if rows:
-                    schema.append("Example rows:")
-                    for row in rows:
-                        schema.append(str(row))
-                schema.append("")  # Blank line between tables
+        schema = await run_blocking(db_path, storage.read_schema, db_path)
 
         # Return the schema as a single response
-        return JSONResponse(content={"schema": "\n".join(schema)})
+        return JSONResponse(content={"schema": schema})
 
     except sqlite3.Error as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving schema: {e}")
-    finally:
-        cursor.close()
-        conn.close()
 
 # Endpoint for retrieving the schema of the database
 @router.get("/get-schemas")
@@ -338,115 +371,227 @@ async def get_schemas(file_uuids:  List[str] = Query(..., description="List of f
         raise HTTPException(status_code=400, detail="Missing uuid")
 
     try:
-        await create_multi_file_dataframe(file_uuids=file_uuids, project_uuid=project_uuid)
+        project_db_path = os.path.join(UPLOAD_DIR, f"{project_uuid}.sqlite")
+        await run_blocking(
+            project_db_path, create_multi_file_dataframe, file_uuids=file_uuids, project_uuid=project_uuid
+        )
         return await get_schema(uuid=project_uuid)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
 
+@router.get("/cache-stats")
+async def cache_stats():
+    return {"schema_cache": schema_cache.stats(), "result_cache": result_cache.stats()}
+
+
+@router.get("/query-governor")
+async def query_governor():
+    return governor.stats()
+
+
+@router.on_event("shutdown")
+def close_connections():
+    advisor.stop()
+    rollups.stop()
+    uploads.shutdown()
+    workers.shutdown()
+    reports.shutdown()
+    pool.close_all()
+    storage.catalog.close()
+
+
 # Basic hello world endpoint
 @router.get("/")
 async def root():
     return {"message": "This is a sqlite-server"}
 
 
-# @router.get("/get-file-metadata/{file_uuid}")
-# async def get_file_metadata(file_uuid: str):
-#     try:
-#         # Query metadata from the metadata SQLite database
-#         result: dict = query_metadata(file_uuid, UPLOAD_DIR)
+@router.get("/get-file-metadata/{file_uuid}")
+async def get_file_metadata(file_uuid: str):
+    try:
+        # Query metadata from the catalog
+        result = (await run_blocking(None, storage.files_metadata, [file_uuid])).get(file_uuid)
 
-#         if not result:
-#             raise HTTPException(status_code=404, detail="File metadata not found")
+        if not result:
+            raise HTTPException(status_code=404, detail="File metadata not found")
 
-#         return JSONResponse(content=result)
+        return JSONResponse(content=result)
 
-#     except Exception as e:
-#         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@router.get("/get-files-metadata")
+async def get_files_metadata(file_uuids: List[str] = Query(..., description="List of file UUIDs")):
+    try:
+        # One indexed lookup for all files, e.g. to validate the files of a question
+        results = await run_blocking(None, storage.files_metadata, file_uuids)
+        return JSONResponse(content={
+            "files": results,
+            "missing": [file_uuid for file_uuid in file_uuids if file_uuid not in results],
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
 @router.get("/get-file-dataframe/{file_uuid}")
-async def get_file_dataframe(file_uuid: str, table_name: str = 'data'):
+async def get_file_dataframe(
+    file_uuid: str,
+    table_name: str = 'data',
+    columns: List[str] = Query(None, description="Columns to load, all columns when omitted"),
+    format: str = Query("json", description="Response format: json or arrow (Arrow IPC stream)"),
+):
     db_path = os.path.join(UPLOAD_DIR, f"{file_uuid}.sqlite")
 
     # Check if the database file exists
     if not os.path.exists(db_path):
         raise HTTPException(status_code=404, detail="Database not found")
 
+    if format not in ("json", "arrow"):
+        raise HTTPException(status_code=400, detail="Invalid format. Allowed formats are: json, arrow")
+
     try:
-        # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
+        # Read the projected columns from the memory-mapped sidecar
+        table = await run_blocking(db_path, load_table, db_path, table_name, columns)
 
-        # Read the database into a pandas DataFrame
-        df = pd.read_sql_query(f"SELECT * FROM {table_name};", conn)
+        # Send the columns as binary Arrow record batches, preserving dtypes
+        if format == "arrow":
+            return StreamingResponse(
+                iter_ipc_stream(table), media_type="application/vnd.apache.arrow.stream"
+            )
 
         # Convert the DataFrame to JSON
-        df_json = df.to_json(orient="records")
+        df_json = await run_blocking(None, lambda: table.to_pandas().to_json(orient="records"))
 
         return JSONResponse(content=df_json)
 
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=e.args[0])
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@router.get("/get-file-sidecar/{file_uuid}")
+async def get_file_sidecar(file_uuid: str, table_name: str = 'data'):
+    """Path of a table's Arrow sidecar, for clients that share the uploads directory."""
+    db_path = os.path.join(UPLOAD_DIR, f"{file_uuid}.sqlite")
+
+    # Check if the database file exists
+    if not os.path.exists(db_path):
+        raise HTTPException(status_code=404, detail="Database not found")
+
+    try:
+        if not sidecar_is_fresh(db_path, table_name):
+            await run_blocking(db_path, write_sidecar, db_path, table_name)
+        return JSONResponse(content={"path": os.path.abspath(sidecar_path(db_path, table_name))})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@router.post("/notify-table-updated/{file_uuid}")
+async def notify_table_updated(file_uuid: str, table_name: str = CLEANED_TABLE_NAME):
+    db_path = os.path.join(UPLOAD_DIR, f"{file_uuid}.sqlite")
+
+    # Check if the database file exists
+    if not os.path.exists(db_path):
+        raise HTTPException(status_code=404, detail="Database not found")
+
+    await run_blocking(db_path, on_table_written, file_uuid, table_name)
+    return {"message": f"Refreshed data derived from {table_name}."}
+
+
+@router.post("/record-queries")
+async def record_queries(request: RecordQueriesRequest):
+    db_path = os.path.join(UPLOAD_DIR, f"{request.file_uuid}.sqlite")
+
+    # Check if the database file exists
+    if not os.path.exists(db_path):
+        raise HTTPException(status_code=404, detail="Database not found")
+
+    # Queries answered outside this process still feed the index advisor and rollups
+    for query in request.queries:
+        await run_blocking(db_path, storage.record_query, db_path, query)
+    return {"message": f"Recorded {len(request.queries)} queries."}
+
+
+@router.get("/index-recommendations/{file_uuid}")
+async def index_recommendations(file_uuid: str, analyze: bool = False):
+    db_path = os.path.join(UPLOAD_DIR, f"{file_uuid}.sqlite")
+
+    # Check if the database file exists
+    if not os.path.exists(db_path):
+        raise HTTPException(status_code=404, detail="Database not found")
+
+    try:
+        # Analysis normally runs in the background; analyze=true runs it right away
+        if analyze:
+            await run_blocking(db_path, advisor.analyze, db_path)
+        return await run_blocking(db_path, advisor.recommendations, db_path)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@router.get("/rollups/{file_uuid}")
+async def get_rollups(file_uuid: str, refresh: bool = False):
+    db_path = os.path.join(UPLOAD_DIR, f"{file_uuid}.sqlite")
+
+    # Check if the database file exists
+    if not os.path.exists(db_path):
+        raise HTTPException(status_code=404, detail="Database not found")
+
+    try:
+        if refresh:
+            # Build and refresh now instead of waiting for the background thread
+            await run_blocking(db_path, rollups.maintain, db_path)
+        return await run_blocking(db_path, rollups.describe, db_path)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@router.get("/get-column-stats/{file_uuid}")
+async def get_column_stats(file_uuid: str, table_name: str = CLEANED_TABLE_NAME):
+    db_path = os.path.join(UPLOAD_DIR, f"{file_uuid}.sqlite")
+
+    # Check if the database file exists
+    if not os.path.exists(db_path):
+        raise HTTPException(status_code=404, detail="Database not found")
+
+    try:
+        # Statistics are computed at ingest and after cleaning; older files are computed on first use
+        stats = await run_blocking(db_path, load_table_stats, db_path, table_name)
+        return {"table_name": table_name, "columns": stats}
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@router.delete("/delete-file/{file_uuid}")
+async def delete_file(file_uuid: str):
+    try:
+        # Deduplicated uploads release their reference to the shared database
+        await run_blocking(None, storage.delete_file, file_uuid)
+        return {"file_uuid": file_uuid, "deleted": True}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
-    finally:
-        conn.close()
-
-
-# @router.get("/create-multi-file-dataframe/{project_uuid}")
-async def create_multi_file_dataframe(file_uuids: list[str], project_uuid: str = None):
-    """
-    This function creates a dataframe for a project from its csv files.
-    Arguments:
-    :project_uuids: uuid of the selected project
-    :file_uuids: list of all uuids belonging to the given project
-    """
-    # Create a new merged database
-    merged_db_name = os.path.join(UPLOAD_DIR, f"{project_uuid}.sqlite")
-
-    # Check if the file already exists, and if so, delete it
-    if os.path.exists(merged_db_name):
-        os.remove(merged_db_name)
-
-    merged_conn = sqlite3.connect(merged_db_name)
-
-    for i, file_uuid in enumerate(file_uuids):
-        source_file = os.path.join(UPLOAD_DIR, f"{file_uuid}.sqlite")
-        if os.path.exists(source_file) is False:
-            continue
-        # Connect to the source database
-        source_conn = sqlite3.connect(source_file)
-        source_cursor = source_conn.cursor()
-        
-        # Get all table names from the source database
-        source_cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = source_cursor.fetchall()
-        
-        for table in tables:
-            source_table_name = table[0]
-            if CLEANED_TABLE_NAME in source_table_name:
-                # Read data from the source table
-                source_cursor.execute(f"SELECT * FROM {source_table_name}")
-                data = source_cursor.fetchall()
-                
-                # Get column names
-                source_cursor.execute(f"PRAGMA table_info({source_table_name})")
-                # columns = [column[1] for column in source_cursor.fetchall()]
-                columns_info = source_cursor.fetchall()
-                
-                # Create the table in the merged database
-                # columns_definition = ', '.join([f'"{col}" TEXT' for col in columns])
-                columns_definition = ', '.join([f'"{column[1]}" {column[2]}' for column in columns_info])
-                merged_conn.execute(f"CREATE TABLE IF NOT EXISTS {source_table_name+str(i)} ({columns_definition})")
-                
-                # Insert data into the merged database
-                placeholders = ', '.join(['?' for _ in columns_info])
-                merged_conn.executemany(f"INSERT INTO {source_table_name+str(i)} VALUES ({placeholders})", data)
-            
-        # Close the source connection
-        source_conn.close()
-
-    # Commit changes and close the merged connection
-    merged_conn.commit()
-    merged_conn.close()
-    return f"Project db saved to: {UPLOAD_DIR}"
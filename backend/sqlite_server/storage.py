@@ -0,0 +1,418 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from fastapi import HTTPException
+
+from backend.sqlite_server import reader
+from backend.sqlite_server.column_stats import refresh_table_stats
+from backend.sqlite_server.connection_pool import pool
+from backend.sqlite_server.excel_ingest import stream_excel_to_sqlite
+from backend.sqlite_server.governor import QueryTimeout, governor
+from backend.sqlite_server.index_advisor import advisor
+from backend.sqlite_server.ingest import analyze, stream_csv_to_sqlite
+from backend.sqlite_server.metadata_store import MetadataStore
+from backend.sqlite_server.projects import build_project_database
+from backend.sqlite_server.query_results import FETCH_SIZE, QUERY_ROW_LIMIT, describe_columns, fetch_rows, iter_ndjson
+from backend.sqlite_server.reader import (
+    CLEANED_TABLE_NAME,
+    UPLOAD_DIR,
+    db_path_for,
+    execute_query,
+    read_schema,
+)
+from backend.sqlite_server.reports import refresh_report, report_pdf
+from backend.sqlite_server.result_cache import result_cache
+from backend.sqlite_server.rollups import rollup_path, rollups
+from backend.sqlite_server.schema_cache import schema_cache
+from backend.sqlite_server.sidecar import bump_table_version, refresh_sidecar
+from backend.sqlite_server.value_dictionary import refresh_value_dictionary, value_dictionary_path
+
+logger = logging.getLogger(__name__)
+
+ANALYSED_TABLE_NAME = "data_analysed"
+# Converted databases shared by identical uploads, named by content hash
+BLOB_DIR = os.path.join(UPLOAD_DIR, "_blobs")
+HASH_CHUNK_SIZE = 1024 * 1024
+os.makedirs(
+    UPLOAD_DIR, exist_ok=True
+)  # Create the uploads directory if it doesn't exist
+os.makedirs(BLOB_DIR, exist_ok=True)
+
+# Catalog of uploaded files, maintained whenever a file is written
+catalog = MetadataStore(os.path.join(UPLOAD_DIR, "metadata.sqlite"))
+
+
+def blob_path_for(content_hash: str) -> str:
+    return os.path.join(BLOB_DIR, f"{content_hash}.sqlite")
+
+
+_blob_locks = {}
+_blob_locks_guard = threading.Lock()
+
+
+def _blob_lock(content_hash: str) -> threading.Lock:
+    with _blob_locks_guard:
+        return _blob_locks.setdefault(content_hash, threading.Lock())
+
+
+def content_digest(file_extension: str):
+    """SHA-256 hasher for an upload's content, keyed by its extension."""
+    # The extension is part of the key since it decides how the bytes are converted
+    return hashlib.sha256(file_extension.encode("utf-8"))
+
+
+def hash_upload(source, file_extension: str) -> str:
+    """Content hash of a spooled upload; the stream is rewound afterwards."""
+    digest = content_digest(file_extension)
+    for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    source.seek(0)
+    return digest.hexdigest()
+
+
+def on_table_written(file_uuid: str, table_name: str):
+    """Refresh the data derived from a table after it has been (re)written."""
+    db_path = db_path_for(file_uuid)
+    bump_table_version(db_path, table_name)
+    schema_cache.invalidate(db_path)
+    result_cache.invalidate(db_path)
+    rollups.refresh_later(db_path)
+    if table_name == ANALYSED_TABLE_NAME:
+        # Render the new report ahead of its first download
+        refresh_report(db_path, table_name)
+    else:
+        refresh_statistics(db_path)
+        refresh_table_stats(db_path, table_name)
+        refresh_sidecar(db_path, table_name)
+        if table_name == CLEANED_TABLE_NAME:
+            # Values the agent matches question words against
+            refresh_value_dictionary(db_path, table_name)
+    refresh_catalog(file_uuid, db_path, table_name)
+
+
+def analyze_database(db_path: str):
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        analyze(conn)
+    finally:
+        conn.close()
+
+
+def refresh_catalog(file_uuid: str, db_path: str, table_name: str = None):
+    """Best-effort catalog update after a file is written."""
+    try:
+        catalog.refresh_file(file_uuid, db_path, table_name)
+    except sqlite3.Error:
+        logger.exception(f"Failed to update the catalog entry of {file_uuid}")
+
+
+def files_metadata(file_uuids: list[str]) -> dict:
+    """
+    Catalog entries of several files, backfilling files uploaded before the catalog existed.
+    Entries of files not cleaned yet are refreshed too, in case the cleaned table was
+    written without being reported.
+    """
+    results = catalog.query_many(file_uuids)
+    uncataloged = [
+        file_uuid for file_uuid in file_uuids
+        if (
+            file_uuid not in results
+            or results[file_uuid]["updated_at"] is None
+            or not results[file_uuid]["is_cleaned"]
+        )
+        and os.path.exists(db_path_for(file_uuid))
+    ]
+    for file_uuid in uncataloged:
+        refresh_catalog(file_uuid, db_path_for(file_uuid))
+    if uncataloged:
+        results.update(catalog.query_many(uncataloged))
+    return results
+
+
+def refresh_statistics(db_path: str):
+    """Best-effort ANALYZE after a table is written, e.g. by the cleaning pipeline."""
+    try:
+        analyze_database(db_path)
+    except sqlite3.Error:
+        logger.exception(f"Failed to analyze {db_path}")
+
+
+UPLOAD_EXTENSIONS = [".sqlite", ".csv", ".xls", ".xlsx"]
+
+
+def check_upload_extension(filename: str) -> str:
+    file_extension = os.path.splitext(filename)[1].lower()
+    if file_extension not in UPLOAD_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid file type. Only .sqlite and .csv files are supported.",
+        )
+    return file_extension
+
+
+def save_upload(source, filename: str, file_uuid: str, project_uuid: str = None, user_uuid: str = None):
+    """
+    Make {file_uuid}.sqlite available for an uploaded file.
+    Returns the path of the new database and the ingest statistics of CSV and Excel uploads.
+    """
+    started = time.perf_counter()
+    file_extension = check_upload_extension(filename)
+    content_hash = hash_upload(source, file_extension)
+    return store_upload(
+        content_hash,
+        lambda sqlite_path: convert_upload(source, file_extension, file_uuid, sqlite_path),
+        filename,
+        file_uuid,
+        project_uuid,
+        user_uuid,
+        started,
+    )
+
+
+def store_upload(
+    content_hash: str,
+    convert,
+    filename: str,
+    file_uuid: str,
+    project_uuid: str = None,
+    user_uuid: str = None,
+    started: float = None,
+):
+    """
+    Uploads are stored by content hash: the first upload of some content is converted
+    into a blob database with `convert(sqlite_path)` and every upload of it links
+    {file_uuid}.sqlite to that blob, so duplicates share its tables (including the
+    cleaned and analysed ones) and skip the conversion. Blobs are reference counted
+    in the catalog.
+    Returns the path of the new database and the ingest statistics of the conversion.
+    """
+    started = started or time.perf_counter()
+    file_extension = os.path.splitext(filename)[1].lower()
+    blob_path = blob_path_for(content_hash)
+    new_file_path = db_path_for(file_uuid)
+    ingest_stats = None
+
+    with _blob_lock(content_hash):
+        deduplicated = catalog.blob_refcount(content_hash) > 0 and os.path.exists(blob_path)
+        if not deduplicated:
+            remove_database(blob_path)
+            try:
+                ingest_stats = convert(blob_path)
+            except Exception:
+                remove_database(blob_path)
+                raise
+        os.symlink(os.path.abspath(blob_path), new_file_path)
+        catalog.add_blob_reference(content_hash)
+        catalog.register_file(file_uuid, filename, project_uuid, user_uuid, content_hash)
+
+    if deduplicated:
+        # The shared database is already converted, analysed and cataloged
+        refresh_catalog(file_uuid, new_file_path)
+        ingest_stats = {"deduplicated": True, "seconds": round(time.perf_counter() - started, 3)}
+    elif file_extension in [".xls", ".xlsx"]:
+        for sheet in ingest_stats["sheets"]:
+            on_table_written(file_uuid, sheet["table"])
+    elif file_extension == ".csv":
+        on_table_written(file_uuid, "data")
+    else:
+        refresh_catalog(file_uuid, new_file_path)
+
+    return new_file_path, ingest_stats
+
+
+def convert_upload(source, file_extension: str, file_uuid: str, sqlite_path: str):
+    """Convert an upload into the database at sqlite_path and return its ingest statistics."""
+    ingest_stats = None
+
+    # Handle .sqlite file
+    if file_extension == ".sqlite":
+        # Save the uploaded file to the new path
+        with open(sqlite_path, "wb") as buffer:
+            shutil.copyfileobj(source, buffer)
+
+    # Handle .csv file
+    elif file_extension == ".csv":
+        # Stream the CSV into SQLite in bounded chunks instead of loading it whole
+        try:
+            ingest_stats = stream_csv_to_sqlite(source, sqlite_path)
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Error converting CSV to SQLite: {str(e)}"
+            )
+    # Handle .xls and .xlsx files
+    else:
+        excel_file_path = os.path.join(UPLOAD_DIR, f"{file_uuid}{file_extension}")
+
+        # Save the Excel file temporarily
+        with open(excel_file_path, "wb") as buffer:
+            shutil.copyfileobj(source, buffer)
+
+        # Stream every sheet of the workbook into its own table
+        try:
+            ingest_stats = stream_excel_to_sqlite(excel_file_path, sqlite_path)
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Error converting Excel to SQLite: {str(e)}"
+            )
+        finally:
+            os.remove(excel_file_path)  # Remove the Excel file after conversion
+
+    return ingest_stats
+
+
+def remove_database(db_path: str):
+    """Remove a database file with its WAL, shared memory, sidecar, rollup and value dictionary files."""
+    pool.discard(db_path)
+    schema_cache.invalidate(db_path)
+    result_cache.invalidate(db_path)
+    rollups.forget(db_path)
+    stem = os.path.splitext(db_path)[0]
+    rollup_file = rollup_path(db_path)
+    values_file = value_dictionary_path(db_path)
+    for path in [
+        db_path, f"{db_path}-wal", f"{db_path}-shm", *glob.glob(f"{glob.escape(stem)}.*.arrow"),
+        rollup_file, f"{rollup_file}-wal", f"{rollup_file}-shm",
+        values_file, f"{values_file}-wal", f"{values_file}-shm",
+    ]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def delete_file(file_uuid: str):
+    """
+    Delete an uploaded file. Deduplicated uploads only drop their link and reference;
+    the shared database is removed with its last reference.
+    """
+    db_path = db_path_for(file_uuid)
+    entry = catalog.query(file_uuid)
+    if entry is None and not os.path.lexists(db_path):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    content_hash = entry["content_hash"] if entry else None
+    if os.path.islink(db_path) and content_hash:
+        with _blob_lock(content_hash):
+            os.remove(db_path)
+            if catalog.release_blob(content_hash) == 0:
+                remove_database(blob_path_for(content_hash))
+    else:
+        remove_database(db_path)
+    catalog.remove_file(file_uuid)
+
+
+def analysis_as_pdf(db_path: str) -> str:
+    """Path of the cached PDF of the stored analysis report, rendered in a render process on a miss."""
+    return report_pdf(db_path, ANALYSED_TABLE_NAME)
+
+
+def record_query(db_path: str, query: str):
+    """Log an answered query, also when served from the result cache, for the index advisor and rollups."""
+    advisor.record_query(db_path, query)
+    rollups.record_query(db_path, query)
+
+
+def run_query(
+    db_path: str, query: str, limit: int = QUERY_ROW_LIMIT, cursor_token: str = None, caller: str = None
+) -> dict:
+    """
+    Execute a query on a pooled connection and return one page of its results,
+    within the time, row and byte budget of `caller`.
+    """
+    page = reader.run_query(db_path, query, limit, cursor_token, caller)
+    record_query(db_path, query)
+    return page
+
+
+def query_response(
+    db_path: str, query: str, limit: int = QUERY_ROW_LIMIT, cursor_token: str = None, caller: str = None
+) -> bytes:
+    """JSON body of one page of a query's results, served from the versioned result cache."""
+    body = reader.query_response(db_path, query, limit, cursor_token, caller)
+    # Cache hits count towards the recurring queries too
+    record_query(db_path, query)
+    return body
+
+
+class QueryStream:
+    """
+    A query whose rows are pulled as NDJSON blocks, one call to next_block at a time,
+    so each block can be fetched on a worker thread. The pooled connection is held
+    until close. The time budget of `caller` applies to executing the query and to
+    fetching each block; a block that runs out of time ends the stream with a
+    truncated line.
+    """
+
+    def __init__(
+        self, db_path: str, query: str, limit: int = QUERY_ROW_LIMIT, cursor_token: str = None, caller: str = None
+    ):
+        self.db_path = db_path
+        self.query = query
+        self.caller = caller
+        self.budget = governor.budget(caller)
+        limit = min(limit, self.budget.max_rows)
+        self.conn = pool.acquire(db_path)
+        self.cursor = self.conn.cursor()
+        try:
+            with governor.deadline(self.conn, self.budget):
+                offset = execute_query(self.cursor, db_path, query, cursor_token)
+                first_rows, _ = fetch_rows(self.cursor, min(limit, FETCH_SIZE))
+                self.columns, self.column_types = describe_columns(self.cursor, first_rows)
+        except Exception as e:
+            if isinstance(e, QueryTimeout):
+                governor.record_cutoff(caller, "timeout", query)
+            self.close()
+            raise
+        record_query(db_path, query)
+        limit_reason = "row_limit" if limit == self.budget.max_rows else "page_size"
+        self._blocks = iter_ndjson(
+            self.cursor, query, offset, limit, first_rows, self.budget.max_bytes, limit_reason
+        )
+
+    def next_block(self):
+        """Next NDJSON block, or None when the result is exhausted."""
+        if self._blocks is None:
+            return None
+        try:
+            with governor.deadline(self.conn, self.budget):
+                block = next(self._blocks, None)
+        except QueryTimeout:
+            governor.record_cutoff(self.caller, "timeout", self.query)
+            self._blocks = None
+            return json.dumps({"truncated": True, "truncated_reason": "timeout", "next_cursor": None}) + "\n"
+        # Rows are JSON arrays, so an object is the truncation trailer
+        if block is not None and block.startswith("{"):
+            reason = json.loads(block)["truncated_reason"]
+            if reason != "page_size":
+                governor.record_cutoff(self.caller, reason, self.query)
+        return block
+
+    def close(self):
+        if self.conn is not None:
+            self.cursor.close()
+            pool.release(self.db_path, self.conn)
+            self.conn = None
+
+
+def create_multi_file_dataframe(file_uuids: list[str], project_uuid: str = None):
+    """
+    This function creates a dataframe for a project from its csv files.
+    The project database attaches the files instead of copying them and is only
+    rebuilt when its members change.
+    Arguments:
+    :project_uuids: uuid of the selected project
+    :file_uuids: list of all uuids belonging to the given project
+    """
+    merged_db_name = db_path_for(project_uuid)
+    sources = [
+        (i, db_path_for(file_uuid))
+        for i, file_uuid in enumerate(file_uuids)
+        if os.path.exists(db_path_for(file_uuid))
+    ]
+    build_project_database(merged_db_name, sources, CLEANED_TABLE_NAME)
+    return f"Project db saved to: {UPLOAD_DIR}"
@@ -0,0 +1,263 @@
+import difflib
+import logging
+import os
+import re
+import sqlite3
+import threading
+from urllib.parse import quote
+
+from backend.sqlite_server.connection_pool import pool
+from backend.sqlite_server.ingest import quote_identifier
+from backend.sqlite_server.projects import PROJECT_MEMBERS_TABLE, PROJECT_VIEWS_TABLE
+from backend.sqlite_server.sidecar import table_version
+
+logger = logging.getLogger(__name__)
+
+# Longer texts are prose rather than names, and are left out of the dictionary
+VALUE_DICT_MAX_VALUE_LENGTH = int(os.getenv("VALUE_DICT_MAX_VALUE_LENGTH", "200"))
+# Candidates fetched from the index per question token, before fuzzy scoring
+VALUE_DICT_CANDIDATES = int(os.getenv("VALUE_DICT_CANDIDATES", "50"))
+# Lowest similarity between a question token and a word of a value that counts as a match
+VALUE_DICT_MIN_SCORE = float(os.getenv("VALUE_DICT_MIN_SCORE", "0.75"))
+
+VALUE_DICT_TABLE = "_value_dict"
+VALUE_DICT_META_TABLE = "_value_dict_meta"
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_NUMBER = re.compile(r"^[\d\s.,:/+-]*$")
+# Question words that would match half of any dictionary
+_STOP_WORDS = {
+    "all", "and", "any", "are", "average", "between", "by", "can", "count", "did", "does", "each",
+    "for", "from", "give", "has", "have", "how", "in", "is", "list", "many", "much", "number", "of",
+    "per", "plot", "show", "than", "that", "the", "there", "this", "top", "total", "was", "were",
+    "what", "which", "who", "with",
+}
+
+_build_locks = {}
+_build_locks_guard = threading.Lock()
+# (dictionary path, table) of the rebuilds running in the background
+_pending_rebuilds = set()
+
+
+def value_dictionary_path(db_path: str) -> str:
+    return os.path.splitext(os.path.realpath(db_path))[0] + ".values.sqlite"
+
+
+def _build_lock(path: str) -> threading.Lock:
+    with _build_locks_guard:
+        return _build_locks.setdefault(path, threading.Lock())
+
+
+def _create_tables(conn) -> str:
+    """Create the dictionary tables; returns the match mode, fts5 or like when trigrams are unavailable."""
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {VALUE_DICT_META_TABLE} "
+        "(table_name TEXT PRIMARY KEY, version TEXT NOT NULL, mode TEXT NOT NULL, values_count INTEGER NOT NULL)"
+    )
+    try:
+        conn.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {VALUE_DICT_TABLE} "
+            "USING fts5(value, table_name UNINDEXED, column_name UNINDEXED, tokenize='trigram')"
+        )
+        return "fts5"
+    except sqlite3.OperationalError:
+        # SQLite before 3.34 has no trigram tokenizer
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {VALUE_DICT_TABLE} (value TEXT, table_name TEXT, column_name TEXT)"
+        )
+        return "like"
+
+
+def _text_columns(conn, table_name: str) -> list:
+    # Columns declared as text, or untyped ones, hold the names worth matching
+    return [
+        row[1]
+        for row in conn.execute("SELECT * FROM pragma_table_info(?)", (table_name,))
+        if not row[2] or "CHAR" in row[2].upper() or "TEXT" in row[2].upper() or "CLOB" in row[2].upper()
+    ]
+
+
+def build_value_dictionary(db_path: str, table_name: str) -> int:
+    """
+    Index the distinct text values of every text column of a table in the value
+    dictionary next to the database, replacing its previous entries. The entries
+    are stamped with the version of the table they were read from.
+    Returns the number of indexed values.
+    """
+    path = value_dictionary_path(db_path)
+    with _build_lock(path):
+        # Read before the values, so a rewrite during the build leaves the dictionary stale
+        version = table_version(db_path, table_name)
+        values = []
+        with pool.connection(db_path) as source:
+            for column in _text_columns(source, table_name):
+                quoted = quote_identifier(column)
+                cursor = source.execute(
+                    f"SELECT DISTINCT {quoted} FROM {quote_identifier(table_name)} "
+                    f"WHERE typeof({quoted}) = 'text' AND length({quoted}) BETWEEN 1 AND ?",
+                    (VALUE_DICT_MAX_VALUE_LENGTH,),
+                )
+                values.extend(
+                    (value, table_name, column) for (value,) in cursor if not _NUMBER.match(value)
+                )
+
+        conn = sqlite3.connect(path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            mode = _create_tables(conn)
+            with conn:
+                conn.execute(f"DELETE FROM {VALUE_DICT_TABLE} WHERE table_name = ?", (table_name,))
+                conn.executemany(
+                    f"INSERT INTO {VALUE_DICT_TABLE} (value, table_name, column_name) VALUES (?, ?, ?)", values
+                )
+                conn.execute(
+                    f"INSERT OR REPLACE INTO {VALUE_DICT_META_TABLE} VALUES (?, ?, ?, ?)",
+                    (table_name, version, mode, len(values)),
+                )
+        finally:
+            conn.close()
+    logger.info(f"Indexed {len(values)} values of {table_name} in {path}")
+    return len(values)
+
+
+def refresh_value_dictionary(db_path: str, table_name: str):
+    """Best-effort rebuild after a table is (re)written; lookups rebuild stale dictionaries anyway."""
+    try:
+        build_value_dictionary(db_path, table_name)
+    except sqlite3.Error:
+        logger.exception(f"Failed to build the value dictionary of {table_name} in {db_path}")
+
+
+def _rebuild_later(db_path: str, table_name: str):
+    """Rebuild a stale dictionary in a background thread; lookups keep using the stale one meanwhile."""
+    pending = (value_dictionary_path(db_path), table_name)
+    with _build_locks_guard:
+        if pending in _pending_rebuilds:
+            return
+        _pending_rebuilds.add(pending)
+
+    def rebuild():
+        try:
+            refresh_value_dictionary(db_path, table_name)
+        finally:
+            with _build_locks_guard:
+                _pending_rebuilds.discard(pending)
+
+    threading.Thread(target=rebuild, name="value-dictionary", daemon=True).start()
+
+
+def _resolve_table(db_path: str, table_name: str) -> tuple:
+    """The file and table behind a table name, following the views of attached projects; (None, None) for unknown views."""
+    with pool.connection(db_path) as conn:
+        is_project = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (PROJECT_VIEWS_TABLE,)
+        ).fetchone()
+        if not is_project:
+            return db_path, table_name
+        row = conn.execute(
+            f"SELECT members.db_path, views.table_name FROM {PROJECT_VIEWS_TABLE} AS views "
+            f"JOIN {PROJECT_MEMBERS_TABLE} AS members ON members.alias = views.alias "
+            "WHERE views.view_name = ?",
+            (table_name,),
+        ).fetchone()
+    return (row[0], row[1]) if row else (None, None)
+
+
+def _stored_dictionary(path: str, table_name: str):
+    """(version, mode) the dictionary of a table was built with, or None when it has none."""
+    if not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True)
+    try:
+        return conn.execute(
+            f"SELECT version, mode FROM {VALUE_DICT_META_TABLE} WHERE table_name = ?", (table_name,)
+        ).fetchone()
+    except sqlite3.Error:
+        return None
+    finally:
+        conn.close()
+
+
+def question_tokens(question: str) -> list:
+    """Words of a question worth looking up, plus adjacent pairs for multi-word values."""
+    words = [word for word in _WORD.findall(question.lower()) if not word.isdigit()]
+    tokens = [word for word in words if len(word) >= 3 and word not in _STOP_WORDS]
+    tokens += [
+        f"{first} {second}"
+        for first, second in zip(words, words[1:])
+        if first not in _STOP_WORDS and second not in _STOP_WORDS
+    ]
+    return list(dict.fromkeys(tokens))
+
+
+def _score(token: str, value: str) -> float:
+    lowered = value.lower()
+    words = _WORD.findall(lowered)
+    if token in words or (" " in token and token in lowered):
+        return 1.0
+    # Compare against single words of the value as well as the whole value
+    return max(difflib.SequenceMatcher(None, token, candidate).ratio() for candidate in [lowered, *words])
+
+
+def _candidates(conn, mode: str, token: str, table_name: str, columns: list) -> list:
+    column_filter = f"AND column_name IN ({', '.join('?' * len(columns))})"
+    if mode == "fts5" and len(token) >= 3:
+        # Any shared trigram makes a candidate; bm25 ranks those sharing the most first
+        trigrams = dict.fromkeys(token[i:i + 3] for i in range(len(token) - 2))
+        match = " OR ".join('"' + trigram.replace('"', '""') + '"' for trigram in trigrams)
+        return conn.execute(
+            f"SELECT value, column_name FROM {VALUE_DICT_TABLE} WHERE {VALUE_DICT_TABLE} MATCH ? "
+            f"AND table_name = ? {column_filter} ORDER BY rank LIMIT ?",
+            (match, table_name, *columns, VALUE_DICT_CANDIDATES),
+        ).fetchall()
+    escaped = token.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return conn.execute(
+        f"SELECT value, column_name FROM {VALUE_DICT_TABLE} WHERE value LIKE ? ESCAPE '\\' "
+        f"AND table_name = ? {column_filter} LIMIT ?",
+        (f"%{escaped}%", table_name, *columns, VALUE_DICT_CANDIDATES),
+    ).fetchall()
+
+
+def match_values(db_path: str, question: str, columns: dict, limit: int = 20) -> list:
+    """
+    Values of the given {table: [column]} that fuzzily match the words of a question,
+    best matches first. Missing dictionaries are built first; dictionaries older than
+    their table are rebuilt in the background and used as they are until then.
+    """
+    tokens = question_tokens(question)
+    matches = {}
+    for table_name, table_columns in columns.items():
+        if not table_columns or not tokens:
+            continue
+        source_path, source_table = _resolve_table(db_path, table_name)
+        if source_path is None:
+            # Misnamed tables are left to SQL validation
+            continue
+        path = value_dictionary_path(source_path)
+        stored = _stored_dictionary(path, source_table)
+        if stored is None:
+            build_value_dictionary(source_path, source_table)
+            stored = _stored_dictionary(path, source_table)
+        elif stored[0] != table_version(source_path, source_table):
+            _rebuild_later(source_path, source_table)
+
+        conn = sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True)
+        try:
+            for token in tokens:
+                for value, column in _candidates(conn, stored[1], token, source_table, table_columns):
+                    score = _score(token, value)
+                    if score >= VALUE_DICT_MIN_SCORE:
+                        token_scores = matches.setdefault((table_name, column, value), {})
+                        token_scores[token] = max(score, token_scores.get(token, 0))
+        finally:
+            conn.close()
+
+    # Values matching several words of the question rank first
+    ranked = sorted(
+        ((key, sum(token_scores.values())) for key, token_scores in matches.items()),
+        key=lambda item: -item[1],
+    )[:limit]
+    return [
+        {"table": table, "column": column, "value": value, "score": round(score, 3)}
+        for (table, column, value), score in ranked
+    ]
@@ -0,0 +1,91 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+# Threads running blocking sqlite3/pandas work; sqlite3 releases the GIL while stepping
+WORKER_THREADS = int(os.getenv("SQLITE_WORKER_THREADS", str(min(32, (os.cpu_count() or 1) * 4))))
+# Jobs allowed to wait or run at once before new requests are rejected with 503
+MAX_QUEUE_DEPTH = int(os.getenv("SQLITE_MAX_QUEUE_DEPTH", "256"))
+# Jobs allowed to run concurrently against the same database
+PER_DB_CONCURRENCY = int(os.getenv("SQLITE_PER_DB_CONCURRENCY", "4"))
+
+_executor = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="sqlite-worker")
+
+# Only touched from the event loop thread, so no locking is needed
+_pending = 0
+_db_limits = {}  # database key -> [semaphore, number of jobs using it]
+
+
+def queue_depth() -> int:
+    return _pending
+
+
+def _limit_for(db_key: str):
+    entry = _db_limits.get(db_key)
+    if entry is None:
+        entry = _db_limits[db_key] = [asyncio.Semaphore(PER_DB_CONCURRENCY), 0]
+    entry[1] += 1
+    return entry[0]
+
+
+def _release_limit(db_key: str):
+    entry = _db_limits[db_key]
+    entry[1] -= 1
+    if entry[1] == 0:
+        del _db_limits[db_key]
+
+
+async def run_blocking(db_path, fn, *args, **kwargs):
+    """
+    Run blocking work on the worker pool instead of the event loop.
+    Work on the same database is limited to PER_DB_CONCURRENCY jobs at a time;
+    pass db_path=None for work that is not tied to a database.
+    Raises a 503 when MAX_QUEUE_DEPTH jobs are already queued or running.
+    """
+    global _pending
+    if _pending >= MAX_QUEUE_DEPTH:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is overloaded, please retry later",
+            headers={"Retry-After": "1"},
+        )
+
+    _pending += 1
+    db_key = os.path.realpath(db_path) if db_path else None
+    try:
+        loop = asyncio.get_running_loop()
+        job = functools.partial(fn, *args, **kwargs)
+        if db_key is None:
+            return await loop.run_in_executor(_executor, job)
+
+        async with _limit_for(db_key):
+            return await loop.run_in_executor(_executor, job)
+    finally:
+        if db_key is not None:
+            _release_limit(db_key)
+        _pending -= 1
+
+
+async def continue_blocking(db_path, fn, *args, **kwargs):
+    """
+    Run follow-up work of an already admitted request (e.g. the next block of a
+    streamed result) on the worker pool, without the queue-depth check.
+    """
+    db_key = os.path.realpath(db_path) if db_path else None
+    loop = asyncio.get_running_loop()
+    job = functools.partial(fn, *args, **kwargs)
+    if db_key is None:
+        return await loop.run_in_executor(_executor, job)
+
+    try:
+        async with _limit_for(db_key):
+            return await loop.run_in_executor(_executor, job)
+    finally:
+        _release_limit(db_key)
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
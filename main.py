@@ -1,9 +1,11 @@
+import asyncio
 import logging
 import os
 import sqlite3
 
 import httpx
 import pandas as pd
+import pyarrow as pa
 from typing import List
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException
@@ -16,6 +18,7 @@ from backend.cleaning import AdvancedDataPipeline
 # from backend_dateja.my_agent.main import graph
 from backend.my_agent.WorkflowManager import WorkflowManager
 from backend.my_agent.LLMManager import LLMManager
+from backend.my_agent.LLMCache import default_cache
 
 logger = logging.getLogger(__name__)
 
@@ -54,6 +57,7 @@ ENDPOINT_URL = os.getenv("DB_ENDPOINT_URL")
 SPEECH2TEXT_CREDS = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
 CLEANED_TABLE_NAME = "data_cleaned"
 ANALYSED_TABLE_NAME = "data_analysed"
+SHEETS_TABLE = "_sheets"
 # define csv_agent_graph
 csv_agent_graph = WorkflowManager(
     api_key=API_KEY, endpoint_url=ENDPOINT_URL
@@ -62,16 +66,68 @@ csv_agent_graph = WorkflowManager(
 # define summarizer llm agent
 summarizer_llm = LLMManager(api_key=API_KEY)
 
-def table_exists(conn, table_name):
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT name FROM sqlite_master 
-        WHERE type='table' AND name=?;
-    """,
-        (table_name,),
-    )
-    return cursor.fetchone() is None
+async def fetch_file_dataframe(file_uuid: str, table_name: str = "data") -> pd.DataFrame:
+    """Load a table of an uploaded file as Arrow instead of a JSON round-trip."""
+    async with httpx.AsyncClient(timeout=None) as client:
+        # Memory-map the sidecar directly when the uploads dir is shared with the sqlite-server
+        response = await client.get(
+            f"{ENDPOINT_URL}/get-file-sidecar/{file_uuid}", params={"table_name": table_name}
+        )
+        response.raise_for_status()
+        sidecar_path = response.json()["path"]
+        if os.path.exists(sidecar_path):
+            return pa.ipc.open_file(pa.memory_map(sidecar_path, "r")).read_pandas()
+
+        response = await client.get(
+            f"{ENDPOINT_URL}/get-file-dataframe/{file_uuid}",
+            params={"table_name": table_name, "format": "arrow"},
+        )
+        response.raise_for_status()
+        return pa.ipc.open_stream(response.content).read_pandas()
+
+
+async def fetch_column_stats(file_uuid: str, table_name: str = "data"):
+    # Column statistics the sqlite-server keeps per table, so insights don't rescan the data
+    try:
+        async with httpx.AsyncClient(timeout=None) as client:
+            response = await client.get(
+                f"{ENDPOINT_URL}/get-column-stats/{file_uuid}",
+                params={"table_name": table_name},
+            )
+            response.raise_for_status()
+            return response.json()["columns"]
+    except httpx.HTTPError:
+        logger.exception(f"Failed to fetch column statistics of {table_name} of {file_uuid}.")
+        return None
+
+
+def source_tables(db_path: str) -> list:
+    """(table, cleaned table) pairs to clean: one per sheet for Excel uploads, else just `data`."""
+    if not os.path.exists(db_path):
+        return [("data", CLEANED_TABLE_NAME)]
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            f"SELECT table_name, cleaned_table_name FROM {SHEETS_TABLE} ORDER BY sheet_index"
+        ).fetchall()
+    except sqlite3.OperationalError:
+        # Only Excel uploads record their sheets
+        return [("data", CLEANED_TABLE_NAME)]
+    finally:
+        conn.close()
+
+
+async def notify_table_updated(file_uuid: str, table_name: str):
+    # Let the sqlite-server refresh the data it derives from the table (e.g. columnar sidecars)
+    try:
+        async with httpx.AsyncClient(timeout=None) as client:
+            response = await client.post(
+                f"{ENDPOINT_URL}/notify-table-updated/{file_uuid}",
+                params={"table_name": table_name},
+            )
+            response.raise_for_status()
+    except httpx.HTTPError:
+        logger.exception(f"Failed to notify sqlite-server about {table_name} of {file_uuid}.")
 
 
 @app.post("/call-model")
@@ -84,28 +140,25 @@ async def call_model(request: QueryRequest):
     if not file_uuids or not question or not project_uuid:
         raise HTTPException(status_code=400, detail="Missing uuids or query")
     try:
+        # Validate every file with one catalog lookup on the sqlite-server
         async with httpx.AsyncClient() as client:
-            uploads_dir = await client.get(f"{ENDPOINT_URL}/get-uploads-dir")
-            uploads_dir = uploads_dir.json()
+            response = await client.get(
+                f"{ENDPOINT_URL}/get-files-metadata", params={"file_uuids": file_uuids}
+            )
+            response.raise_for_status()
+            files = response.json()["files"]
 
         for id in file_uuids:
-            # Connect to SQLite and save the cleaned data
-            db_file_path = os.path.join(uploads_dir, f"{id}.sqlite")
-            print("db path: ", db_file_path)
-            table_name = CLEANED_TABLE_NAME
-            conn = sqlite3.connect(db_file_path)
-
-            if table_exists(conn=conn, table_name=table_name):
-                conn.close()
+            if id not in files or not files[id]["is_cleaned"]:
                 raise HTTPException(
                     status_code=404,
-                    detail=f"Table '{table_name}' does not exist in the database",
+                    detail=f"Table '{CLEANED_TABLE_NAME}' does not exist in the database",
                 )
-            else:
-                conn.close()
         print("Executing invoke")
-        response = csv_agent_graph.invoke(request)
+        response = await csv_agent_graph.ainvoke(request)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
@@ -116,35 +169,36 @@ async def call_model(request: QueryRequest):
 async def data_cleaning_pipeline(file_uuid: str):
     try:
         async with httpx.AsyncClient() as client:
-            # from other application in port 8000
-            response = await client.get(
-                f"{ENDPOINT_URL}/get-file-dataframe/{file_uuid}"
-            )
-
             uploads_dir = await client.get(f"{ENDPOINT_URL}/get-uploads-dir")
             uploads_dir = uploads_dir.json()
-            df = pd.read_json(response.json())
-            print(df)
-
-        pipeline = AdvancedDataPipeline(df)
-        cleaned_df = pipeline.run_all()[0]
 
         # Connect to SQLite and save the cleaned data
         db_path = os.path.join(uploads_dir, f"{file_uuid}.sqlite")
 
-        conn = sqlite3.connect(db_path)
-        try:
-            cleaned_df.to_sql(
-                CLEANED_TABLE_NAME, conn, if_exists="replace", index=False
-            )
-            return {"message": "Finished data cleaning."}
-        except Exception as e:
-            logger.exception("Error saving data to SQLite.")
-            raise HTTPException(
-                status_code=500, detail=f"Failed to save cleaned data: {str(e)}"
-            )
-        finally:
-            conn.close()
+        # Every sheet of an Excel upload is cleaned into its own table
+        for table_name, cleaned_table_name in source_tables(db_path):
+            # from other application in port 8000
+            df = await fetch_file_dataframe(file_uuid, table_name)
+            print(df)
+
+            pipeline = AdvancedDataPipeline(df)
+            cleaned_df = pipeline.run_all()[0]
+
+            conn = sqlite3.connect(db_path)
+            try:
+                cleaned_df.to_sql(
+                    cleaned_table_name, conn, if_exists="replace", index=False
+                )
+                await notify_table_updated(file_uuid, cleaned_table_name)
+            except Exception as e:
+                logger.exception("Error saving data to SQLite.")
+                raise HTTPException(
+                    status_code=500, detail=f"Failed to save cleaned data: {str(e)}"
+                )
+            finally:
+                conn.close()
+
+        return {"message": "Finished data cleaning."}
 
     except Exception as e:
         logger.exception("Error during the data cleaning pipeline.")
@@ -156,15 +210,13 @@ async def data_cleaning_pipeline(file_uuid: str):
 @app.post("/data-analysis-pipeline")
 async def handle_data_analysis(file_uuid: str):
     try:
+        df = await fetch_file_dataframe(file_uuid)
+        column_stats = await fetch_column_stats(file_uuid)
         async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{ENDPOINT_URL}/get-file-dataframe/{file_uuid}"
-            )
-            df = pd.read_json(response.json())
             uploads_dir = await client.get(f"{ENDPOINT_URL}/get-uploads-dir")
             uploads_dir = uploads_dir.json()
 
-        visualizer = AdvancedVisualizer(df, api_key=API_KEY)
+        visualizer = AdvancedVisualizer(df, api_key=API_KEY, column_stats=column_stats)
         markdown_response = visualizer.handle_request("generate_report")
         # Connect to SQLite and save the cleaned data
         db_path = os.path.join(uploads_dir, f"{file_uuid}.sqlite")
@@ -194,6 +246,8 @@ async def handle_data_analysis(file_uuid: str):
 
             # Commit and close the connection
             conn.commit()
+            # Let the sqlite-server render the PDF ahead of the first download
+            await notify_table_updated(file_uuid, ANALYSED_TABLE_NAME)
             return {"message": "Finished data analysis."}
         except Exception as e:
             logger.exception("Error saving data to SQLite.")
@@ -206,6 +260,13 @@ async def handle_data_analysis(file_uuid: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@app.get("/llm-cache-stats")
+async def llm_cache_stats():
+    cache = default_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **await asyncio.to_thread(cache.stats)}
+
 # Basic hello world endpoint
 @app.get("/")
 async def root():
@@ -0,0 +1,52 @@
+import os
+import sqlite3
+
+from backend.sqlite_server import storage
+from backend.sqlite_server.governor import QueryBudget, governor
+from backend.sqlite_server.query_results import fetch_rows, has_more_rows, row_size
+
+
+def _cursor(rows: int):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE data (id INTEGER, name TEXT)")
+    conn.executemany("INSERT INTO data VALUES (?, ?)", [(i, f"name {i:04d}") for i in range(rows)])
+    return conn.execute("SELECT id, name FROM data")
+
+
+def test_fetch_rows_reports_byte_limit_within_a_batch():
+    # Smaller than one FETCH_SIZE batch, so the rest of the result is already off the cursor
+    cursor = _cursor(500)
+    rows, stop_reason = fetch_rows(cursor, 1000, max_bytes=2000)
+    assert stop_reason == "max_bytes"
+    assert 0 < len(rows) < 500
+    assert sum(row_size(row) for row in rows) <= 2000
+    assert not has_more_rows(cursor)
+
+
+def test_fetch_rows_without_byte_limit():
+    rows, stop_reason = fetch_rows(_cursor(500), 1000)
+    assert stop_reason is None
+    assert len(rows) == 500
+
+
+def test_run_query_pages_through_byte_limited_results(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    db_path = os.path.join(tmp_path, "file.sqlite")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE data (id INTEGER, name TEXT)")
+    conn.executemany("INSERT INTO data VALUES (?, ?)", [(i, f"name {i:04d}") for i in range(500)])
+    conn.commit()
+    conn.close()
+    monkeypatch.setitem(governor.budgets, "interactive", QueryBudget(30, 100000, 2000))
+
+    ids = []
+    cursor_token = None
+    while True:
+        page = storage.run_query(db_path, "select id, name from data", cursor_token=cursor_token)
+        ids.extend(row[0] for row in page["results"])
+        if not page["truncated"]:
+            break
+        assert page["truncated_reason"] == "byte_limit"
+        cursor_token = page["next_cursor"]
+    assert ids == list(range(500))
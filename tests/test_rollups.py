@@ -0,0 +1,90 @@
+import os
+import random
+import sqlite3
+
+import pytest
+
+from backend.sqlite_server import reader
+from backend.sqlite_server.connection_pool import pool
+from backend.sqlite_server.rollups import ROLLUP_MIN_QUERY_COUNT, rollups
+from backend.sqlite_server.sidecar import bump_table_version
+
+QUERIES = [
+    "SELECT region, SUM(revenue) FROM data GROUP BY region ORDER BY region",
+    "select product, count(*) as n, avg(qty), max(revenue) from data where region = 'N' "
+    "group by product order by n desc, product limit 5",
+    "SELECT COUNT(*), SUM(qty) FROM data WHERE region IN ('N', 'S')",
+    "SELECT region, product, TOTAL(qty), MIN(revenue) FROM data GROUP BY 1, 2 ORDER BY 1, 2",
+]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    db_path = os.path.join(tmp_path, "sales.sqlite")
+    generator = random.Random(0)
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE data (order_id INTEGER, region TEXT, product TEXT, revenue REAL, qty INTEGER)")
+    conn.executemany(
+        "INSERT INTO data VALUES (?, ?, ?, ?, ?)",
+        [
+            (i, generator.choice("NSEW"), f"p{i % 20}", round(generator.random() * 100, 2), generator.randint(1, 9))
+            for i in range(5000)
+        ],
+    )
+    conn.commit()
+    conn.close()
+    yield db_path
+    rollups.forget(db_path)
+    pool.discard(db_path)
+
+
+def _expected(db_path: str, query: str) -> list:
+    conn = sqlite3.connect(db_path)
+    try:
+        return [list(row) for row in conn.execute(query).fetchall()]
+    finally:
+        conn.close()
+
+
+def _assert_same_rows(actual: list, expected: list):
+    assert len(actual) == len(expected)
+    for actual_row, expected_row in zip(actual, expected):
+        # Sums over a rollup add the same values in a different order
+        assert actual_row == pytest.approx(expected_row, rel=1e-9)
+
+
+def test_rewritten_queries_match_the_base_table(db_path):
+    for query in QUERIES:
+        for _ in range(ROLLUP_MIN_QUERY_COUNT):
+            rollups.record_query(db_path, query)
+    rollups.maintain(db_path)
+    statuses = [rollup["status"] for rollup in rollups.describe(db_path)["rollups"]]
+    assert statuses and all(status == "ready" for status in statuses)
+
+    for query in QUERIES:
+        with pool.connection(db_path) as conn:
+            assert rollups.rewrite(conn, db_path, query) is not None
+        _assert_same_rows(reader.run_query(db_path, query)["results"], _expected(db_path, query))
+
+
+def test_stale_rollups_are_not_used(db_path):
+    query = QUERIES[0]
+    for _ in range(ROLLUP_MIN_QUERY_COUNT):
+        rollups.record_query(db_path, query)
+    rollups.maintain(db_path)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE data SET revenue = 0 WHERE region = 'N'")
+    conn.commit()
+    conn.close()
+    # What on_table_written does for a reported write
+    bump_table_version(db_path, "data")
+
+    with pool.connection(db_path) as conn:
+        assert rollups.rewrite(conn, db_path, query) is None
+    _assert_same_rows(reader.run_query(db_path, query)["results"], _expected(db_path, query))
+
+    rollups.maintain(db_path)
+    with pool.connection(db_path) as conn:
+        assert rollups.rewrite(conn, db_path, query) is not None
+    _assert_same_rows(reader.run_query(db_path, query)["results"], _expected(db_path, query))
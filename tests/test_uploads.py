@@ -0,0 +1,76 @@
+import io
+import os
+import sqlite3
+
+import pytest
+from fastapi import HTTPException
+
+from backend.sqlite_server import storage
+from backend.sqlite_server.metadata_store import MetadataStore
+
+CSV = b"name,age\nalice,30\nbob,41\ncarol,25\n"
+
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    # UPLOAD_DIR and BLOB_DIR are relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(storage.BLOB_DIR)
+    catalog = MetadataStore(os.path.join(storage.UPLOAD_DIR, "metadata.sqlite"))
+    monkeypatch.setattr(storage, "catalog", catalog)
+    yield catalog
+    catalog.close()
+
+
+def _rows(db_path: str) -> list:
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT name, age FROM data ORDER BY name").fetchall()
+    finally:
+        conn.close()
+
+
+def test_identical_uploads_share_one_blob(uploads):
+    first_path, first_stats = storage.save_upload(io.BytesIO(CSV), "people.csv", "first")
+    second_path, second_stats = storage.save_upload(io.BytesIO(CSV), "copy.csv", "second")
+
+    assert "deduplicated" not in first_stats
+    assert second_stats["deduplicated"] is True
+    blob_path = os.path.realpath(first_path)
+    assert os.path.realpath(second_path) == blob_path
+    content_hash = uploads.query("first")["content_hash"]
+    assert uploads.query("second")["content_hash"] == content_hash
+    assert uploads.blob_refcount(content_hash) == 2
+    assert _rows(second_path) == [("alice", 30), ("bob", 41), ("carol", 25)]
+
+    # Other content is converted into its own blob
+    other_path, other_stats = storage.save_upload(io.BytesIO(CSV + b"dave,52\n"), "more.csv", "other")
+    assert "deduplicated" not in other_stats
+    assert os.path.realpath(other_path) != blob_path
+
+
+def test_blob_is_removed_with_its_last_reference(uploads):
+    storage.save_upload(io.BytesIO(CSV), "people.csv", "first")
+    second_path, _ = storage.save_upload(io.BytesIO(CSV), "copy.csv", "second")
+    blob_path = os.path.realpath(second_path)
+    content_hash = uploads.query("first")["content_hash"]
+
+    storage.delete_file("first")
+    assert not os.path.lexists(storage.db_path_for("first"))
+    assert uploads.query("first") is None
+    assert uploads.blob_refcount(content_hash) == 1
+    assert os.path.exists(blob_path)
+    assert _rows(second_path) == [("alice", 30), ("bob", 41), ("carol", 25)]
+
+    storage.delete_file("second")
+    assert not os.path.lexists(second_path)
+    assert uploads.blob_refcount(content_hash) == 0
+    assert not os.path.exists(blob_path)
+
+    with pytest.raises(HTTPException) as error:
+        storage.delete_file("second")
+    assert error.value.status_code == 404
+
+    # The same content uploaded again is converted anew
+    _, stats = storage.save_upload(io.BytesIO(CSV), "people.csv", "third")
+    assert "deduplicated" not in stats